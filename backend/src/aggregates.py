@@ -0,0 +1,131 @@
+"""
+MCS-IOT 连续聚合查询路由 (Continuous Aggregate Router)
+
+该文件为历史曲线提供分桶聚合查询，优先读取预聚合的连续聚合视图，避免每次请求都对原始 sensor_data 做 time_bucket + AVG。
+主要功能包括：
+1. 视图选择：在 1 分钟 / 10 分钟 / 1 小时三个连续聚合中，选取桶宽能整除请求间隔的最粗粒度视图；没有可用视图时查询原始数据。
+2. 二次分桶：按请求间隔对视图中的桶再做 time_bucket，平均值按样本数加权 (sum(avg × n) / sum(n))，与直接对原始数据求平均的结果一致。
+3. 实时边缘：视图只物化到刷新策略的 end_offset 之前，最后一个已物化桶之后的部分 (按请求间隔对齐) 回退到原始数据查询。
+4. 多设备批量：多个 sn 在同一条语句中按 (sn, bucket) 分组，每个设备的实时边缘通过 unnest 参数数组分别传入。
+5. 就绪状态：视图的历史数据首次物化由 Worker 完成后写入 Redis (aggregates:ready)，未就绪的视图不会被选中。
+
+结构：
+- CONTINUOUS_AGGREGATES: 视图定义 (桶宽, 视图名)，与迁移 #6 一致。
+- pick_aggregate: 为请求间隔选择视图。
+- query_buckets_multi / query_buckets: 分桶聚合查询入口 (多设备一次查询 / 单设备)，返回 avg/min/max。
+- bucket_start: 与 time_bucket 一致的桶起点计算。
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+# 与 TimescaleDB time_bucket 对 timestamp 类型的默认对齐原点一致 (2000-01-03，周一)
+BUCKET_ORIGIN = datetime(2000, 1, 3)
+
+# 从粗到细排列
+CONTINUOUS_AGGREGATES: List[Tuple[timedelta, str]] = [
+    (timedelta(hours=1), "sensor_data_1h"),
+    (timedelta(minutes=10), "sensor_data_10m"),
+    (timedelta(minutes=1), "sensor_data_1m"),
+]
+
+# Worker 完成首次物化的视图集合
+READY_KEY = "aggregates:ready"
+
+METRICS = ("ppm", "temp", "humi")
+
+
+def bucket_start(ts: datetime, interval: timedelta) -> datetime:
+    """按 time_bucket 的对齐方式计算 ts 所在桶的起点"""
+    offset = (ts - BUCKET_ORIGIN) // interval
+    return BUCKET_ORIGIN + offset * interval
+
+
+async def pick_aggregate(redis, interval: timedelta) -> Optional[Tuple[timedelta, str]]:
+    """选择桶宽能整除 interval 的最粗粒度已就绪视图，没有时返回 None"""
+    ready = await redis.smembers(READY_KEY) if redis else set()
+    for width, view in CONTINUOUS_AGGREGATES:
+        if view in ready and interval >= width and interval % width == timedelta(0):
+            return width, view
+    return None
+
+
+def _aggregate_columns() -> str:
+    return ",\n".join(
+        f"""SUM({m}_avg * {m}_n) / NULLIF(SUM({m}_n), 0) AS {m},
+                   MIN({m}_min) AS {m}_min, MAX({m}_max) AS {m}_max"""
+        for m in METRICS
+    )
+
+
+def _raw_columns() -> str:
+    return ",\n".join(
+        f"AVG({m}) AS {m}, MIN({m}) AS {m}_min, MAX({m}) AS {m}_max"
+        for m in METRICS
+    )
+
+
+async def _query_raw(conn, sns: List[str], edges: List[datetime], end: datetime, interval: timedelta) -> list:
+    """原始数据分桶，每个 sn 从各自的 edge 开始 (按 (sn, time) 索引逐设备扫描)"""
+    return await conn.fetch(
+        f"""SELECT s.sn, time_bucket($1, s.time) AS bucket,
+                   {_raw_columns()}
+            FROM unnest($2::text[], $3::timestamp[]) AS e(sn, edge)
+            JOIN sensor_data s ON s.sn = e.sn AND s.time >= e.edge
+            WHERE s.time >= $4 AND s.time <= $5
+            GROUP BY s.sn, bucket ORDER BY s.sn, bucket""",
+        interval, sns, edges, min(edges), end
+    )
+
+
+async def query_buckets_multi(conn, redis, sns: List[str], start: datetime, end: datetime,
+                              interval: timedelta) -> list:
+    """
+    一次查询多个设备 [start, end] 内按 interval 分桶的 ppm/temp/humi (avg/min/max)
+    返回记录含 sn, bucket, ppm, ppm_min, ppm_max, temp, ..., 按 (sn, bucket) 升序
+    """
+    if not sns:
+        return []
+    source = await pick_aggregate(redis, interval)
+    if not source:
+        return await _query_raw(conn, sns, [start] * len(sns), end, interval)
+
+    width, view = source
+    # 已物化的边界: 每个设备在范围内最后一个桶的结束时间 (按 (sn, bucket) 索引查找)
+    last_buckets = {
+        r['sn']: r['last_bucket'] for r in await conn.fetch(
+            f"""SELECT sn, MAX(bucket) AS last_bucket FROM {view}
+                WHERE sn = ANY($1::text[]) AND bucket >= $2 AND bucket <= $3
+                GROUP BY sn""",
+            sns, bucket_start(start, width), end
+        )
+    }
+    # 实时边缘按请求间隔对齐，保证同一个桶只来自一侧；没有物化数据的设备全部查询原始数据
+    edges = []
+    for sn in sns:
+        last_bucket = last_buckets.get(sn)
+        edge = bucket_start(min(last_bucket + width, end), interval) if last_bucket else start
+        edges.append(max(edge, start))
+
+    rows = []
+    if any(edge > start for edge in edges):
+        rows = list(await conn.fetch(
+            f"""SELECT v.sn, time_bucket($1, v.bucket) AS bucket,
+                       {_aggregate_columns()}
+                FROM unnest($2::text[], $3::timestamp[]) AS e(sn, edge)
+                JOIN {view} v ON v.sn = e.sn AND v.bucket < e.edge
+                WHERE v.bucket >= $4 AND e.edge > $5
+                GROUP BY v.sn, 2 ORDER BY v.sn, 2""",
+            interval, sns, edges, bucket_start(start, width), start
+        ))
+    rows.extend(await _query_raw(conn, sns, edges, end, interval))
+    rows.sort(key=lambda r: (r['sn'], r['bucket']))
+    return rows
+
+
+async def query_buckets(conn, redis, sn: str, start: datetime, end: datetime,
+                        interval: timedelta) -> list:
+    """
+    查询单个设备 [start, end] 内按 interval 分桶的 ppm/temp/humi (avg/min/max)
+    返回记录含 bucket, ppm, ppm_min, ppm_max, temp, ..., 按 bucket 升序
+    """
+    return await query_buckets_multi(conn, redis, [sn], start, end, interval)
@@ -3,7 +3,7 @@ MCS-IOT 报警日志模块 (Alarm Logging)
 
 该文件负责系统报警记录的查询、确认及统计分析。
 主要功能包括：
-1. 分页查询报警日志，支持按 SN、报警类型、状态进行过滤。
+1. 分页查询报警日志，支持按 SN、报警类型、状态进行过滤；支持 (triggered_at, id) 游标分页及精确 / 限量 / 估算的总数模式 (见 pagination.py)。
 2. 关联查询设备及仪表信息，丰富报警记录的展示。
 3. 提供报警确认 (ACK) 功能，支持单个确认及一键全部确认。
 4. 统计报警概览，包括今日报警总数、近一周报警总数及各类型报警分布。
@@ -19,6 +19,8 @@ from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 
+from .pagination import count_rows, decode_cursor, encode_cursor
+
 router = APIRouter()
 
 class AlarmLog(BaseModel):
@@ -35,7 +37,9 @@ class AlarmLog(BaseModel):
     notified: bool
 
 class AlarmList(BaseModel):
-    total: int
+    total: Optional[int] = None
+    total_exact: bool = True
+    next_cursor: Optional[str] = None
     data: List[AlarmLog]
 
 async def get_db():
@@ -49,34 +53,53 @@ async def list_alarms(
     sn: Optional[str] = None,
     type: Optional[str] = None,
     status: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，提供时忽略 page"),
+    total: str = Query("capped", description="总数模式: exact / capped / approx / none"),
     db = Depends(get_db)
 ):
-    offset = (page - 1) * size
-    
+    """
+    报警日志分页 (按 triggered_at, id 倒序)
+    - cursor: 游标分页，按 (triggered_at, id) 索引定位，任意深度的代价相同
+    - page: 兼容旧客户端的 OFFSET 分页
+    - total: exact 精确计数 / capped 最多计数到上限 / approx 计划估算 / none 不统计
+    """
     # Build query
     where_clauses = []
     params = []
     param_idx = 1
     
     if sn:
-        where_clauses.append(f"sn = ${param_idx}")
+        where_clauses.append(f"a.sn = ${param_idx}")
         params.append(sn)
         param_idx += 1
     if type:
-        where_clauses.append(f"type = ${param_idx}")
+        where_clauses.append(f"a.type = ${param_idx}")
         params.append(type)
         param_idx += 1
     if status:
-        where_clauses.append(f"status = ${param_idx}")
+        where_clauses.append(f"a.status = ${param_idx}")
         params.append(status)
         param_idx += 1
     
+    filter_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
+    filter_params = list(params)
+    
+    offset = 0
+    if cursor:
+        last_time, last_id = decode_cursor(cursor, (datetime, int))
+        where_clauses.append(f"(a.triggered_at, a.id) < (${param_idx}, ${param_idx + 1})")
+        params.extend([last_time, last_id])
+        param_idx += 2
+    else:
+        offset = (page - 1) * size
+    
     where_sql = " AND ".join(where_clauses) if where_clauses else "1=1"
     
     async with db.acquire() as conn:
-        total = await conn.fetchval(f"SELECT COUNT(*) FROM alarm_logs WHERE {where_sql}", *params)
+        count, exact = await count_rows(conn, f"FROM alarm_logs a WHERE {filter_sql}", filter_params, total)
         
-        params.extend([size, offset])
+        # 多取一行判断是否还有下一页
+        params.extend([size + 1, offset])
         rows = await conn.fetch(
             f"""SELECT a.id, a.triggered_at as time, a.sn, d.name as device_name,
                        i.name as instrument_name, i.color as instrument_color,
@@ -85,12 +108,19 @@ async def list_alarms(
                 LEFT JOIN devices d ON a.sn = d.sn
                 LEFT JOIN instruments i ON d.instrument_id = i.id
                 WHERE {where_sql} 
-                ORDER BY a.triggered_at DESC LIMIT ${param_idx} OFFSET ${param_idx+1}""",
+                ORDER BY a.triggered_at DESC, a.id DESC LIMIT ${param_idx} OFFSET ${param_idx+1}""",
             *params
         )
     
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_cursor = encode_cursor(rows[-1]['time'], rows[-1]['id'])
+    
     return AlarmList(
-        total=total,
+        total=count,
+        total_exact=exact,
+        next_cursor=next_cursor,
         data=[AlarmLog(**dict(r)) for r in rows]
     )
 
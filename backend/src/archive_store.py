@@ -0,0 +1,47 @@
+"""
+MCS-IOT 归档云存储实例 (Archive Store Factory)
+
+该文件为配置管理及分层历史读取等模块提供共享的云存储实例，避免在每个请求中重复创建 boto3 客户端。
+主要功能包括：
+1. 实例缓存：按客户端参数 (终结点、区域、存储桶、密钥) 的哈希缓存云存储实例，仅在配置变化时重建 (与 Worker Archiver._get_store 一致)。
+2. 非阻塞创建：boto3 客户端创建时会读取 botocore 元数据文件，放到线程池中执行，不阻塞事件循环。
+
+结构：
+- get_object_store: 返回归档配置对应的云存储实例 (缓存)。
+- load_archive_store: 读取 Redis 中的归档配置并返回云存储实例。
+"""
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+from .object_store import S3ObjectStore, create_object_store, storage_endpoint
+
+ARCHIVE_CONFIG_KEY = "config:archive"
+
+# (配置哈希, store)
+_store_cache = (None, None)
+
+
+async def get_object_store(config: Optional[dict]) -> Optional[S3ObjectStore]:
+    """返回归档配置对应的云存储实例 (兼容 r2_* 旧字段)，未配置云存储时返回 None"""
+    global _store_cache
+    if not config:
+        return None
+    # 以实际的客户端参数作为缓存键，迁移前后 (r2_* / 统一字段) 的同一配置共用一个实例
+    params = [storage_endpoint(config),
+              config.get("bucket") or config.get("r2_bucket"),
+              config.get("access_key") or config.get("r2_access_key"),
+              config.get("secret_key") or config.get("r2_secret_key")]
+    config_hash = hashlib.sha1(json.dumps(params).encode()).hexdigest()
+    if _store_cache[0] != config_hash:
+        loop = asyncio.get_running_loop()
+        store = await loop.run_in_executor(None, create_object_store, config)
+        _store_cache = (config_hash, store)
+    return _store_cache[1]
+
+
+async def load_archive_store(redis) -> Optional[S3ObjectStore]:
+    """读取 Redis 中的归档配置并返回云存储实例，未配置时返回 None"""
+    config_str = await redis.get(ARCHIVE_CONFIG_KEY)
+    return await get_object_store(json.loads(config_str)) if config_str else None
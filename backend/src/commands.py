@@ -7,37 +7,54 @@ MCS-IOT 设备下行命令控制模块 (Device Control Commands)
 2. 校准参数下发：将服务器端的标定参数（k/b 值及温度补偿）远程同步至设备端固件。
 3. 远程运维支持：实现设备的远程重启、OTA 固件升级等高级运维指令。
 4. 广播能力：支持向所有在线设备同步下达特定指令。
+5. 命令总线：命令写入 Redis 队列 commands:queue，由 Worker 通过其 MQTT 连接发送 (见 worker/src/command_relay.py)，后端不持有进程级 MQTT 连接，可按需扩展副本与进程数。
 
 结构：
-- MQTT Connection Logic: get_mqtt_client 实现后端的实时命令推送能力。
+- Command Bus: _submit_command 提交命令并短暂等待 Worker 的发送确认。
 - Command Models: DebugCommand, CalibCommand 等封装了各种指令的具体参数。
-- API Handlers: /{sn}/debug, /{sn}/calibrate 等接口，处理“校验权限 -> 更新本地 DB/Redis -> 推送 MQTT 消息”的闭环流程。
+- API Handlers: /{sn}/debug, /{sn}/calibrate 等接口，处理“校验权限 -> 更新本地 DB/Redis -> 提交下行命令”的闭环流程。
 """
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
 import json
-import os
-import paho.mqtt.client as mqtt
+import time
+import uuid
 import asyncpg
 import redis.asyncio as aioredis
 
 router = APIRouter()
 
-# MQTT 客户端 (用于下行命令)
-mqtt_client = None
+# 命令队列 (后端写入，Worker 消费) 及结果键前缀，与 worker/src/command_relay.py 一致
+COMMAND_QUEUE = "commands:queue"
+COMMAND_RESULT_PREFIX = "commands:result:"
+# 命令有效期 (秒)，Worker 积压超过该时间的命令不再下发
+COMMAND_TTL = 60
+# 等待 Worker 发送确认的时间 (秒)
+COMMAND_WAIT = 5
 
-def get_mqtt_client():
-    global mqtt_client
-    if mqtt_client is None or not mqtt_client.is_connected():
-        mqtt_client = mqtt.Client()
-        mqtt_host = os.getenv("MQTT_HOST", "mosquitto")
-        mqtt_user = os.getenv("MQTT_USER", "worker")
-        mqtt_pass = os.getenv("MQTT_PASS", "worker123")
-        mqtt_client.username_pw_set(mqtt_user, mqtt_pass)
-        mqtt_client.connect(mqtt_host, 1883, 60)
-        mqtt_client.loop_start()
-    return mqtt_client
+async def _submit_command(redis, messages: List[Tuple[str, str]], wait: int = COMMAND_WAIT) -> Optional[dict]:
+    """
+    提交下行命令 [(topic, payload), ...] 并等待 Worker 的发送结果
+    在 wait 秒内确认时返回结果 ({"status", "sent", "total"})，否则返回 None (命令仍在队列中)
+    """
+    command_id = uuid.uuid4().hex
+    command = {
+        "id": command_id,
+        "messages": [{"topic": topic, "payload": payload} for topic, payload in messages],
+        "expires_at": time.time() + COMMAND_TTL,
+    }
+    await redis.rpush(COMMAND_QUEUE, json.dumps(command))
+    
+    item = await redis.blpop(f"{COMMAND_RESULT_PREFIX}{command_id}", timeout=wait)
+    if not item:
+        return None
+    return json.loads(item[1])
+
+def _check_sent(result: Optional[dict]):
+    """单设备命令: Worker 明确报告发送失败时返回 500，未及时确认视为已排队"""
+    if result is not None and result.get("status") != "success":
+        raise HTTPException(status_code=500, detail=f"MQTT publish failed: {result.get('message', result.get('status'))}")
 
 async def get_db():
     from .main import db_pool
@@ -76,7 +93,8 @@ class OtaCommand(BaseModel):
 async def send_debug_command(
     sn: str,
     cmd: DebugCommand,
-    db: asyncpg.Pool = Depends(get_db)
+    db: asyncpg.Pool = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis)
 ):
     """
     切换设备到调试模式
@@ -95,15 +113,10 @@ async def send_debug_command(
         "duration": min(cmd.duration, 600)  # 最长10分钟
     })
     
-    try:
-        client = get_mqtt_client()
-        result = client.publish(topic, payload)
-        if result.rc == 0:
-            return {"success": True, "message": f"Debug command sent to {sn}", "duration": cmd.duration}
-        else:
-            raise HTTPException(status_code=500, detail="MQTT publish failed")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send command: {str(e)}")
+    result = await _submit_command(redis, [(topic, payload)])
+    _check_sent(result)
+    return {"success": True, "message": f"Debug command {'sent' if result else 'queued'} for {sn}",
+            "queued": result is None, "duration": cmd.duration}
 
 
 @router.post("/{sn}/calibrate")
@@ -147,28 +160,30 @@ async def send_calib_command(
         "t_comp": cmd.t_comp
     })
     
+    params = {"k": cmd.k, "b": cmd.b, "t_ref": cmd.t_ref, "t_comp": cmd.t_comp}
     try:
-        client = get_mqtt_client()
-        client.publish(topic, payload)
-        return {
-            "success": True, 
-            "message": f"Calibration updated for {sn}",
-            "params": {"k": cmd.k, "b": cmd.b, "t_ref": cmd.t_ref, "t_comp": cmd.t_comp}
-        }
+        result = await _submit_command(redis, [(topic, payload)])
+        _check_sent(result)
     except Exception as e:
         # 数据库已更新，只是设备端可能未收到
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
         return {
             "success": True,
-            "warning": f"Database updated but device command may have failed: {str(e)}",
-            "params": {"k": cmd.k, "b": cmd.b, "t_ref": cmd.t_ref, "t_comp": cmd.t_comp}
+            "warning": f"Database updated but device command may have failed: {detail}",
+            "params": params
         }
+    response = {"success": True, "message": f"Calibration updated for {sn}", "params": params}
+    if result is None:
+        response["queued"] = True
+    return response
 
 
 @router.post("/{sn}/reboot")
 async def send_reboot_command(
     sn: str,
     cmd: RebootCommand,
-    db: asyncpg.Pool = Depends(get_db)
+    db: asyncpg.Pool = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis)
 ):
     """
     远程重启设备
@@ -186,22 +201,18 @@ async def send_reboot_command(
         "delay": cmd.delay
     })
     
-    try:
-        client = get_mqtt_client()
-        result = client.publish(topic, payload)
-        if result.rc == 0:
-            return {"success": True, "message": f"Reboot command sent to {sn}", "delay": cmd.delay}
-        else:
-            raise HTTPException(status_code=500, detail="MQTT publish failed")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send command: {str(e)}")
+    result = await _submit_command(redis, [(topic, payload)])
+    _check_sent(result)
+    return {"success": True, "message": f"Reboot command {'sent' if result else 'queued'} for {sn}",
+            "queued": result is None, "delay": cmd.delay}
 
 
 @router.post("/{sn}/ota")
 async def send_ota_command(
     sn: str,
     cmd: OtaCommand,
-    db: asyncpg.Pool = Depends(get_db)
+    db: asyncpg.Pool = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis)
 ):
     """
     发送OTA升级命令
@@ -220,21 +231,17 @@ async def send_ota_command(
         "md5": cmd.md5
     })
     
-    try:
-        client = get_mqtt_client()
-        result = client.publish(topic, payload)
-        if result.rc == 0:
-            return {"success": True, "message": f"OTA command sent to {sn}", "url": cmd.url}
-        else:
-            raise HTTPException(status_code=500, detail="MQTT publish failed")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send command: {str(e)}")
+    result = await _submit_command(redis, [(topic, payload)])
+    _check_sent(result)
+    return {"success": True, "message": f"OTA command {'sent' if result else 'queued'} for {sn}",
+            "queued": result is None, "url": cmd.url}
 
 
 @router.post("/broadcast/debug")
 async def broadcast_debug_command(
     cmd: DebugCommand,
-    db: asyncpg.Pool = Depends(get_db)
+    db: asyncpg.Pool = Depends(get_db),
+    redis: aioredis.Redis = Depends(get_redis)
 ):
     """
     向所有在线设备广播调试模式命令
@@ -245,23 +252,20 @@ async def broadcast_debug_command(
     if not devices:
         return {"success": False, "message": "No online devices found"}
     
-    client = get_mqtt_client()
-    sent_count = 0
-    
-    for device in devices:
-        sn = device['sn']
-        topic = f"mcs/{sn}/cmd"
-        payload = json.dumps({
-            "cmd": "debug",
-            "duration": min(cmd.duration, 600)
-        })
-        try:
-            client.publish(topic, payload)
-            sent_count += 1
-        except:
-            pass
+    payload = json.dumps({
+        "cmd": "debug",
+        "duration": min(cmd.duration, 600)
+    })
+    # 所有设备的消息合并为一条命令，由同一个 Worker 依次发送
+    result = await _submit_command(redis, [(f"mcs/{device['sn']}/cmd", payload) for device in devices])
+    if result is None:
+        return {
+            "success": True,
+            "queued": True,
+            "message": f"Debug command queued for {len(devices)} devices"
+        }
     
     return {
         "success": True,
-        "message": f"Debug command broadcast to {sent_count}/{len(devices)} devices"
+        "message": f"Debug command broadcast to {result.get('sent', 0)}/{len(devices)} devices"
     }
@@ -17,9 +17,13 @@ MCS-IOT 配置管理模块 (Configuration Management)
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from pydantic import BaseModel
 from typing import Optional, List
+import asyncio
 import json
 import os
 
+from .archive_store import get_object_store
+from .storage_stats import format_size
+
 router = APIRouter()
 
 class EmailConfig(BaseModel):
@@ -44,8 +48,11 @@ class SMSConfig(BaseModel):
     template_id: str = ""
 
 class AlarmGeneralConfig(BaseModel):
-    """报警通用配置：消抖时间和报警时段"""
+    """报警通用配置：消抖时间、滞回/持续时间和报警时段"""
     debounce_minutes: int = 10  # 消抖时间(分钟)
+    hysteresis_percent: float = 5.0  # 恢复滞回带 (阈值的百分比)
+    min_duration_seconds: int = 0  # 持续超限多少秒后才触发报警
+    clear_duration_seconds: int = 30  # 持续恢复多少秒后才判定报警已恢复
     time_restriction_enabled: bool = False  # 是否启用时段限制
     time_restriction_days: List[int] = [1, 2, 3, 4, 5]  # 周一到周五
     time_restriction_start: str = "08:00"  # 开始时间
@@ -60,6 +67,10 @@ class ArchiveConfig(BaseModel):
     """数据归档配置 (支持多云存储: Cloudflare R2, 腾讯云 COS, 阿里云 OSS)"""
     enabled: bool = False
     local_retention_days: int = 3  # 本地数据库保留天数
+    # 截止时间落在分块中间时的处理策略: keep (保留整个分块) / delete (删除分块内过期行)
+    boundary_strategy: str = "keep"
+    # 归档文件格式: csv (CSV.GZ) / parquet (列式，按设备划分行组，需要 Worker 安装 pyarrow)
+    archive_format: str = "csv"
     cloud_retention_days: int = 30  # 云端备份保留天数
     # 云存储提供商: cloudflare, tencent, alibaba
     provider: str = "cloudflare"
@@ -366,6 +377,23 @@ def _build_storage_endpoint(config: dict) -> tuple:
     else:
         raise ValueError(f"不支持的存储提供商: {provider}")
 
+async def _get_archive_config(redis) -> Optional[dict]:
+    """读取并迁移归档配置，未设置时返回 None"""
+    config_str = await redis.get("config:archive")
+    if not config_str:
+        return None
+    return _migrate_archive_config(json.loads(config_str))
+
+def _cloud_configured(config: Optional[dict]) -> bool:
+    return bool(config and (config.get("account_id") or config.get("region")) and config.get("bucket"))
+
+async def _get_object_store(redis):
+    """读取归档配置并返回云存储实例 (按配置缓存，见 archive_store.py)，返回 (store, config)，未配置时 store 为 None"""
+    config = await _get_archive_config(redis)
+    if not _cloud_configured(config):
+        return None, config
+    return await get_object_store(config), config
+
 @router.get("/archive", response_model=ArchiveConfig)
 async def get_archive_config(redis = Depends(get_redis)):
     """获取数据归档配置（自动迁移旧版配置）"""
@@ -473,207 +501,121 @@ async def test_archive_connection(redis = Depends(get_redis)):
             raise HTTPException(status_code=500, detail=f"连接测试失败: {error_str[:200]}")
 
 @router.get("/archive/stats")
-async def get_storage_stats(redis = Depends(get_redis), db = Depends(get_db)):
-    """获取存储空间统计"""
+async def get_storage_stats(refresh: bool = False, redis = Depends(get_redis), db = Depends(get_db)):
+    """获取存储空间统计 (本地部分来自 TimescaleDB 元数据，见 storage_stats.py，行数为估算值)"""
+    from .storage_stats import get_storage_stats as get_db_storage_stats
+    
     stats = {
         "local_db": {"size_bytes": 0, "size_human": "0 B", "row_count": 0},
         "r2": {"size_bytes": 0, "size_human": "0 B", "file_count": 0, "message": ""}
     }
     
-    def format_size(size_bytes: int) -> str:
-        if size_bytes < 1024:
-            return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.2f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.2f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
-    
     # 获取本地数据库大小
     try:
-        async with db.acquire() as conn:
-            # Use pg_database_size for total database size (more accurate)
-            size_result = await conn.fetchrow("""
-                SELECT pg_database_size(current_database()) as size,
-                       (SELECT COUNT(*) FROM sensor_data) as count
-            """)
-            if size_result:
-                stats["local_db"]["size_bytes"] = size_result['size'] or 0
-                stats["local_db"]["size_human"] = format_size(size_result['size'] or 0)
-                stats["local_db"]["row_count"] = size_result['count'] or 0
+        db_stats = await get_db_storage_stats(db, redis, refresh=refresh)
+        sensor_data = db_stats["sensor_data"]
+        stats["local_db"]["size_bytes"] = db_stats["db_size_bytes"]
+        stats["local_db"]["size_human"] = db_stats["db_size_human"]
+        stats["local_db"]["row_count"] = sensor_data["row_count"]
+        stats["local_db"]["row_count_estimated"] = True
+        stats["local_db"]["chunk_count"] = sensor_data["chunk_count"]
+        stats["local_db"]["compressed_chunks"] = sensor_data["compressed_chunks"]
+        stats["local_db"]["compression_ratio"] = sensor_data["compression_ratio"]
     except Exception as e:
         stats["local_db"]["error"] = str(e)
     
-    # 获取云端存储大小
-    config_str = await redis.get("config:archive")
-    if config_str:
-        config = json.loads(config_str)
-        # 迁移旧配置
-        if config.get("r2_account_id") and not config.get("account_id"):
-            config = _migrate_archive_config(config)
-        
-        # 检查是否配置了云存储
-        has_config = config.get("account_id") or config.get("region")
-        if has_config and config.get("bucket") and config.get("access_key"):
-            try:
-                import asyncio
-                import boto3
-                from botocore.config import Config as BotoConfig
-                
-                def get_cloud_stats():
-                    endpoint, bucket, sig_version = _build_storage_endpoint(config)
-                    provider = config.get("provider", "cloudflare")
-                    
-                    s3 = boto3.client(
-                        's3',
-                        endpoint_url=endpoint,
-                        aws_access_key_id=config['access_key'],
-                        aws_secret_access_key=config['secret_key'],
-                        config=BotoConfig(
-                            signature_version=sig_version,
-                            retries={'max_attempts': 3, 'mode': 'standard'}
-                        ),
-                        region_name='auto' if provider == 'cloudflare' else config.get('region', 'auto')
-                    )
-                    
-                    total_size = 0
-                    file_count = 0
-                    
-                    paginator = s3.get_paginator('list_objects_v2')
-                    for page in paginator.paginate(Bucket=bucket, Prefix='archive/'):
-                        for obj in page.get('Contents', []):
-                            total_size += obj.get('Size', 0)
-                            file_count += 1
-                    
-                    return total_size, file_count
-                
-                loop = asyncio.get_event_loop()
-                total_size, file_count = await loop.run_in_executor(None, get_cloud_stats)
-                
-                stats["r2"]["size_bytes"] = total_size
-                stats["r2"]["size_human"] = format_size(total_size)
-                stats["r2"]["file_count"] = file_count
-            except ImportError:
-                stats["r2"]["message"] = "boto3 未安装"
-            except Exception as e:
-                stats["r2"]["error"] = str(e)
-        else:
-            stats["r2"]["message"] = "云存储未配置"
-    else:
+    # 获取云端存储大小 (来自归档目录 archive_logs，不列举存储桶)
+    config = await _get_archive_config(redis)
+    if config is None:
         stats["r2"]["message"] = "归档配置未设置"
+    elif not _cloud_configured(config):
+        stats["r2"]["message"] = "云存储未配置"
+    else:
+        try:
+            async with db.acquire() as conn:
+                catalog = await conn.fetchrow("""
+                    SELECT COALESCE(SUM(file_size), 0) AS size, COUNT(*) AS count
+                    FROM archive_logs
+                    WHERE status = 'uploaded' AND r2_path NOT LIKE '/%'
+                """)
+            stats["r2"]["size_bytes"] = catalog['size']
+            stats["r2"]["size_human"] = format_size(catalog['size'])
+            stats["r2"]["file_count"] = catalog['count']
+        except Exception as e:
+            stats["r2"]["error"] = str(e)
     
     return stats
 
 @router.get("/archive/files")
-async def list_archive_files(redis = Depends(get_redis)):
-    """列出云存储中的所有归档文件"""
-    import asyncio
-    
-    config_str = await redis.get("config:archive")
-    if not config_str:
-        return {"files": [], "message": "归档配置未设置"}
-    
-    config = json.loads(config_str)
-    
-    # 迁移旧配置
-    if config.get("r2_account_id") and not config.get("account_id"):
-        config = _migrate_archive_config(config)
-    
-    # 检查是否配置了云存储
-    has_config = config.get("account_id") or config.get("region")
-    if not has_config or not config.get("bucket"):
-        return {"files": [], "message": "云存储未配置"}
+async def list_archive_files(page: int = 1, page_size: int = 20, kind: Optional[str] = None,
+                             redis = Depends(get_redis), db = Depends(get_db)):
+    """分页列出归档文件 (读取归档目录 archive_logs，桶列举仅在 Worker 定期对账时进行)"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    
+    conditions = ["status = 'uploaded'"]
+    params = []
+    if kind:
+        params.append(kind)
+        conditions.append(f"kind = ${len(params)}")
+    where = " AND ".join(conditions)
     
     try:
-        import boto3
-        from botocore.config import Config as BotoConfig
-        
-        def get_files_list():
-            endpoint, bucket, sig_version = _build_storage_endpoint(config)
-            provider = config.get("provider", "cloudflare")
-            
-            s3 = boto3.client(
-                's3',
-                endpoint_url=endpoint,
-                aws_access_key_id=config['access_key'],
-                aws_secret_access_key=config['secret_key'],
-                config=BotoConfig(
-                    signature_version=sig_version,
-                    retries={'max_attempts': 3, 'mode': 'standard'}
-                ),
-                region_name='auto' if provider == 'cloudflare' else config.get('region', 'auto')
+        async with db.acquire() as conn:
+            total = await conn.fetchval(f"SELECT COUNT(*) FROM archive_logs WHERE {where}", *params)
+            rows = await conn.fetch(
+                f"""SELECT archive_date, file_name, file_size, row_count, r2_path, checksum,
+                           sn_count, time_start, time_end, format, kind, created_at
+                    FROM archive_logs WHERE {where}
+                    ORDER BY archive_date DESC, kind
+                    LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}""",
+                *params, page_size, (page - 1) * page_size
             )
-            
-            files = []
-            paginator = s3.get_paginator('list_objects_v2')
-            for page in paginator.paginate(Bucket=bucket, Prefix='archive/'):
-                for obj in page.get('Contents', []):
-                    key = obj.get('Key', '')
-                    size = obj.get('Size', 0)
-                    last_modified = obj.get('LastModified')
-                    
-                    # 生成预签名下载 URL (有效期 1 小时)
-                    download_url = s3.generate_presigned_url(
-                        'get_object',
-                        Params={'Bucket': bucket, 'Key': key},
-                        ExpiresIn=3600
-                    )
-                    
-                    # 格式化文件大小
-                    if size < 1024:
-                        size_human = f"{size} B"
-                    elif size < 1024 * 1024:
-                        size_human = f"{size / 1024:.2f} KB"
-                    elif size < 1024 * 1024 * 1024:
-                        size_human = f"{size / (1024 * 1024):.2f} MB"
-                    else:
-                        size_human = f"{size / (1024 * 1024 * 1024):.2f} GB"
-                    
-                    files.append({
-                        "key": key,
-                        "name": key.split('/')[-1],
-                        "size": size,
-                        "size_human": size_human,
-                        "last_modified": last_modified.isoformat() if last_modified else None,
-                        "download_url": download_url
-                    })
-            
-            # 按时间倒序排列
-            files.sort(key=lambda x: x.get('last_modified', ''), reverse=True)
-            return files
-        
-        loop = asyncio.get_event_loop()
-        files = await loop.run_in_executor(None, get_files_list)
-        
-        return {"files": files, "count": len(files)}
-        
-    except ImportError:
-        return {"files": [], "message": "boto3 未安装"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # 只为当前页生成预签名下载 URL (有效期 1 小时)；本地归档 (绝对路径) 不提供下载链接
+    store, _ = await _get_object_store(redis)
+    async def download_url(key: str):
+        if not store or key.startswith("/"):
+            return None
+        try:
+            return await store.presigned_url(key, 3600)
+        except Exception:
+            return None
+    urls = await asyncio.gather(*(download_url(r['r2_path']) for r in rows))
+    
+    files = []
+    for row, url in zip(rows, urls):
+        files.append({
+            "key": row['r2_path'],
+            "name": row['file_name'],
+            "date": row['archive_date'].isoformat(),
+            "size": row['file_size'] or 0,
+            "size_human": format_size(row['file_size'] or 0),
+            "row_count": row['row_count'],
+            "checksum": row['checksum'],
+            "sn_count": row['sn_count'],
+            "time_start": row['time_start'].isoformat() if row['time_start'] else None,
+            "time_end": row['time_end'].isoformat() if row['time_end'] else None,
+            "format": row['format'],
+            "kind": row['kind'],
+            "last_modified": row['created_at'].isoformat() if row['created_at'] else None,
+            "download_url": url
+        })
+    
+    return {"files": files, "count": len(files), "total": total, "page": page, "page_size": page_size}
 
 class DeleteFileRequest(BaseModel):
     key: str  # R2 文件路径，如 "archive/2025/12/sensor_data_20251220.csv.gz"
 
 @router.post("/archive/delete")
-async def delete_archive_file(request: DeleteFileRequest, redis = Depends(get_redis)):
-    """删除 R2 中的单个归档文件"""
-    import asyncio
-    
-    config_str = await redis.get("config:archive")
-    if not config_str:
+async def delete_archive_file(request: DeleteFileRequest, redis = Depends(get_redis), db = Depends(get_db)):
+    """删除云存储中的单个归档文件"""
+    store, config = await _get_object_store(redis)
+    if config is None:
         raise HTTPException(status_code=400, detail="归档配置未设置")
-    
-    config = json.loads(config_str)
-    
-    # 迁移旧配置
-    if config.get("r2_account_id") and not config.get("account_id"):
-        config = _migrate_archive_config(config)
-    
-    # 检查是否配置了云存储
-    has_config = config.get("account_id") or config.get("region")
-    if not has_config or not config.get("bucket"):
+    if store is None:
         raise HTTPException(status_code=400, detail="云存储未配置")
     
     file_key = request.key
@@ -681,37 +623,14 @@ async def delete_archive_file(request: DeleteFileRequest, redis = Depends(get_re
         raise HTTPException(status_code=400, detail="无效的文件路径")
     
     try:
-        import boto3
-        from botocore.config import Config as BotoConfig
+        # 先检查文件是否存在
+        if not await store.head(file_key):
+            raise Exception(f"文件不存在: {file_key}")
         
-        def delete_file():
-            endpoint, bucket, sig_version = _build_storage_endpoint(config)
-            provider = config.get("provider", "cloudflare")
-            
-            s3 = boto3.client(
-                's3',
-                endpoint_url=endpoint,
-                aws_access_key_id=config['access_key'],
-                aws_secret_access_key=config['secret_key'],
-                config=BotoConfig(
-                    signature_version=sig_version,
-                    retries={'max_attempts': 3, 'mode': 'standard'}
-                ),
-                region_name='auto' if provider == 'cloudflare' else config.get('region', 'auto')
-            )
-            
-            # 先检查文件是否存在
-            try:
-                s3.head_object(Bucket=bucket, Key=file_key)
-            except:
-                raise Exception(f"文件不存在: {file_key}")
-            
-            # 删除文件
-            s3.delete_object(Bucket=bucket, Key=file_key)
-            return True
-        
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, delete_file)
+        # 删除文件并同步归档目录
+        await store.delete(file_key)
+        async with db.acquire() as conn:
+            await conn.execute("UPDATE archive_logs SET status = 'deleted' WHERE r2_path = $1", file_key)
         
         file_name = file_key.split('/')[-1]
         return {
@@ -720,16 +639,35 @@ async def delete_archive_file(request: DeleteFileRequest, redis = Depends(get_re
             "deleted_key": file_key
         }
         
-    except ImportError:
-        raise HTTPException(status_code=500, detail="boto3 未安装")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除失败: {str(e)}")
 
+# 归档任务队列：耗时的归档操作交由 Worker 的流式导出引擎执行 (见 worker/src/archiver.py)
+ARCHIVE_JOB_QUEUE = "archive:jobs"
+ARCHIVE_RESULT_PREFIX = "archive:result:"
+
+async def _submit_archive_job(redis, job_type: str, params: dict = None, wait: int = 50) -> Optional[dict]:
+    """
+    提交归档任务并等待结果
+    在 wait 秒内完成时返回结果，否则返回 None (任务仍在 Worker 中继续执行)
+    """
+    import uuid
+    from datetime import datetime
+    
+    job_id = uuid.uuid4().hex
+    job = {"id": job_id, "type": job_type, "submitted_at": datetime.now().isoformat()}
+    job.update(params or {})
+    await redis.rpush(ARCHIVE_JOB_QUEUE, json.dumps(job))
+    
+    item = await redis.blpop(f"{ARCHIVE_RESULT_PREFIX}{job_id}", timeout=wait)
+    if not item:
+        return None
+    return json.loads(item[1])
+
 @router.post("/archive/backup")
-async def manual_backup(redis = Depends(get_redis), db = Depends(get_db)):
-    """手动触发备份今日数据到云存储"""
-    import asyncio
-    from datetime import datetime, date
+async def manual_backup(redis = Depends(get_redis)):
+    """手动触发备份今日数据到云存储 (由 Worker 流式导出并分片上传)"""
+    from datetime import date
     
     config_str = await redis.get("config:archive")
     if not config_str:
@@ -747,113 +685,36 @@ async def manual_backup(redis = Depends(get_redis), db = Depends(get_db)):
     if not has_config or not config.get("bucket"):
         raise HTTPException(status_code=400, detail="请先配置云存储")
     
-    try:
-        import boto3
-        from botocore.config import Config as BotoConfig
-        import gzip
-        import csv
-        import io
-        
-        # 构建 endpoint URL
-        endpoint, bucket, sig_version = _build_storage_endpoint(config)
-        provider = config.get("provider", "cloudflare")
-        
-        # 获取今日数据
-        today = date.today()
-        
-        async with db.acquire() as conn:
-            rows = await conn.fetch("""
-                SELECT time, sn, v_raw, ppm, temp, humi, bat, rssi, seq
-                FROM sensor_data
-                WHERE time::date = $1
-                ORDER BY time
-            """, today)
-        
-        if not rows:
-            return {"status": "empty", "message": f"今日 ({today}) 暂无数据可备份"}
-        
-        # 生成 CSV
-        csv_buffer = io.StringIO()
-        writer = csv.writer(csv_buffer)
-        writer.writerow(["time", "sn", "v_raw", "ppm", "temp", "humi", "bat", "rssi", "seq"])
-        
-        for row in rows:
-            writer.writerow([
-                row['time'].isoformat(),
-                row['sn'],
-                row['v_raw'],
-                row['ppm'],
-                row['temp'],
-                row['humi'],
-                row['bat'],
-                row['rssi'],
-                row['seq']
-            ])
-        
-        # 压缩
-        csv_content = csv_buffer.getvalue().encode('utf-8')
-        gzipped = gzip.compress(csv_content)
-        
-        # 上传到云存储
-        file_name = f"sensor_data_{today.strftime('%Y%m%d')}_manual.csv.gz"
-        cloud_path = f"archive/{today.year}/{today.month:02d}/{file_name}"
-        
-        def upload_to_cloud():
-            s3 = boto3.client(
-                's3',
-                endpoint_url=endpoint,
-                aws_access_key_id=config['access_key'],
-                aws_secret_access_key=config['secret_key'],
-                config=BotoConfig(
-                    signature_version=sig_version,
-                    retries={'max_attempts': 3, 'mode': 'standard'}
-                ),
-                region_name='auto' if provider == 'cloudflare' else config.get('region', 'auto')
-            )
-            s3.put_object(
-                Bucket=bucket,
-                Key=cloud_path,
-                Body=gzipped,
-                ContentType='application/gzip'
-            )
-            return True
-        
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, upload_to_cloud)
-        
-        # 格式化文件大小
-        size = len(gzipped)
-        if size < 1024:
-            size_human = f"{size} B"
-        elif size < 1024 * 1024:
-            size_human = f"{size / 1024:.2f} KB"
-        else:
-            size_human = f"{size / (1024 * 1024):.2f} MB"
-        
-        provider_names = {"cloudflare": "R2", "tencent": "COS", "alibaba": "OSS"}
-        provider_name = provider_names.get(provider, "云存储")
-        
-        return {
-            "status": "success",
-            "message": f"备份到 {provider_name} 成功！{len(rows)} 条记录，{size_human}",
-            "row_count": len(rows),
-            "file_size": size,
-            "file_path": cloud_path
-        }
-        
-    except ImportError:
-        raise HTTPException(status_code=500, detail="boto3 未安装")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"备份失败: {str(e)}")
+    today = date.today()
+    result = await _submit_archive_job(redis, "backup", {"date": today.isoformat()})
+    
+    if result is None:
+        return {"status": "pending", "message": "备份任务已提交，正在后台执行，请稍后刷新文件列表"}
+    
+    if result.get("status") == "empty":
+        return {"status": "empty", "message": f"今日 ({today}) 暂无数据可备份"}
+    
+    if result.get("status") != "success":
+        raise HTTPException(status_code=500, detail=f"备份失败: {result.get('message', result.get('status'))}")
+    
+    provider_names = {"cloudflare": "R2", "tencent": "COS", "alibaba": "OSS"}
+    provider_name = provider_names.get(config.get("provider", "cloudflare"), "云存储")
+    size = result.get("file_size", 0)
+    
+    return {
+        "status": "success",
+        "message": f"备份到 {provider_name} 成功！{result.get('row_count', 0)} 条记录，{format_size(size)}",
+        "row_count": result.get("row_count", 0),
+        "file_size": size,
+        "file_path": result.get("r2_path")
+    }
 
 class CleanupRequest(BaseModel):
     days: int  # 保留最近多少天的数据
 
 @router.post("/archive/cleanup")
-async def manual_cleanup(request: CleanupRequest, db = Depends(get_db)):
-    """手动清理本地数据库中超过指定天数的数据"""
-    from datetime import datetime, timedelta
-    
+async def manual_cleanup(request: CleanupRequest, redis = Depends(get_redis)):
+    """手动清理本地数据库中超过指定天数的数据 (由 Worker 按分块删除)"""
     days = request.days
     if days < 1:
         raise HTTPException(status_code=400, detail="保留天数必须大于 0")
@@ -863,39 +724,87 @@ async def manual_cleanup(request: CleanupRequest, db = Depends(get_db)):
     if days not in allowed_days:
         raise HTTPException(status_code=400, detail=f"保留天数必须是以下之一: {allowed_days}")
     
-    try:
-        cutoff_date = (datetime.now() - timedelta(days=days)).date()
-        
-        async with db.acquire() as conn:
-            # 先统计要删除的行数
-            count = await conn.fetchval("""
-                SELECT COUNT(*) FROM sensor_data
-                WHERE time::date < $1
-            """, cutoff_date)
-            
-            if count == 0:
-                return {
-                    "status": "empty",
-                    "message": f"没有 {days} 天前的数据需要清理",
-                    "deleted_rows": 0,
-                    "cutoff_date": str(cutoff_date)
-                }
-            
-            # 删除旧数据
-            await conn.execute("""
-                DELETE FROM sensor_data
-                WHERE time::date < $1
-            """, cutoff_date)
-            
-            return {
-                "status": "success",
-                "message": f"成功清理 {count} 条 {days} 天前的数据",
-                "deleted_rows": count,
-                "cutoff_date": str(cutoff_date)
-            }
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
+    result = await _submit_archive_job(redis, "cleanup", {"days": days})
+    if result is None:
+        return {"status": "pending", "message": "清理任务已提交，正在后台执行"}
+    
+    if result.get("status") == "empty":
+        return {
+            "status": "empty",
+            "message": f"没有 {days} 天前的数据需要清理",
+            "deleted_rows": 0,
+            "cutoff_date": result.get("cutoff_date")
+        }
+    
+    if result.get("status") != "success":
+        raise HTTPException(status_code=500, detail=f"清理失败: {result.get('message', result.get('status'))}")
+    
+    deleted = result.get("deleted_rows", 0)
+    message = f"成功清理约 {deleted} 条 {days} 天前的数据 ({result.get('dropped_chunks', 0)} 个数据分块)"
+    if result.get("requested_cutoff_date"):
+        message += f"，{result['cutoff_date']} 起存在未归档数据，已保留"
+    return {
+        "status": "success",
+        "message": message,
+        "deleted_rows": deleted,
+        "dropped_chunks": result.get("dropped_chunks", 0),
+        "cutoff_date": result.get("cutoff_date")
+    }
+
+class BackfillRequest(BaseModel):
+    until: Optional[str] = None  # 补归档截止日期 (含)，YYYY-MM-DD，默认为本地保留期之外的最后一天
+    concurrency: int = 3  # 同时导出的天数
+
+@router.post("/archive/backfill")
+async def manual_backfill(request: BackfillRequest, redis = Depends(get_redis)):
+    """补归档 archive_logs 中缺失的日期 (由 Worker 逐日并行导出)"""
+    from datetime import date
+    
+    if request.until:
+        try:
+            date.fromisoformat(request.until)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="日期格式应为 YYYY-MM-DD")
+    if not 1 <= request.concurrency <= 8:
+        raise HTTPException(status_code=400, detail="并发数必须在 1-8 之间")
+    
+    result = await _submit_archive_job(redis, "backfill",
+                                       {"until": request.until, "concurrency": request.concurrency})
+    if result is None:
+        return {"status": "pending", "message": "补归档任务已提交，正在后台执行，请稍后刷新文件列表"}
+    
+    if result.get("status") == "empty":
+        return {"status": "empty", "message": "没有漏归档的日期", "days": []}
+    
+    if result.get("status") == "error":
+        raise HTTPException(status_code=500, detail=f"补归档失败: {result.get('message', result.get('status'))}")
+    
+    return {
+        "status": result["status"],
+        "message": f"补归档完成：成功 {result.get('archived', 0)} 天，失败 {result.get('failed', 0)} 天",
+        "archived": result.get("archived", 0),
+        "failed": result.get("failed", 0),
+        "days": result.get("days", [])
+    }
+
+@router.post("/archive/reconcile")
+async def reconcile_archive_catalog(redis = Depends(get_redis)):
+    """立即执行归档目录与云存储桶的对账 (通常由 Worker 每周自动执行)"""
+    if not _cloud_configured(await _get_archive_config(redis)):
+        raise HTTPException(status_code=400, detail="云存储未配置")
+    
+    result = await _submit_archive_job(redis, "reconcile")
+    if result is None:
+        return {"status": "pending", "message": "对账任务已提交，正在后台执行"}
+    if result.get("status") != "success":
+        raise HTTPException(status_code=500, detail=f"对账失败: {result.get('message', result.get('status'))}")
+    
+    return {
+        "status": "success",
+        "message": f"对账完成：缺失 {result.get('missing', 0)} 个，补登记 {result.get('registered', 0)} 个，"
+                   f"大小修正 {result.get('resized', 0)} 个",
+        **{k: result.get(k, 0) for k in ("missing", "registered", "resized", "objects")}
+    }
 
 # Test notification
 @router.post("/alarm/test")
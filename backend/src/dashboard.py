@@ -4,46 +4,30 @@ MCS-IOT 大屏与仪表盘数据模块 (Dashboard & Real-time Data)
 该文件负责为监控前端提供高度聚合的系统概览数据及低延迟的实时状态流。
 主要功能包括：
 1. 统计全系统的设备在线状态、今日报警及确认情况。
-2. 提供所有设备的最新实时监测数据（PPM、温度、电量、信号等），并关联所属仪表信息。
-3. 通过 WebSocket (WS) 协议向前端实时推送数据更新，实现无刷新同步。
+2. 提供所有设备的最新实时监测数据（PPM、温度、电量、信号等），并关联所属仪表信息；数据来自 Worker 物化的快照，一次 Redis 读取并支持 ETag / 304。
+3. 通过 WebSocket (WS) 协议向前端实时推送数据更新，实现无刷新同步 (由 realtime.py 的推送中心统一扇出)。
 4. 提供设备布局坐标的管理接口，支持在大屏上拖拽保存设备位置。
 
 结构：
-- ConnectionManager: 管理 WebSocket 连接的生命周期及消息广播。
 - get_dashboard_stats: 聚合统计逻辑，用于仪表盘卡片展示。
-- get_realtime_data: 实时数据快照获取逻辑。
-- websocket_endpoint: WS 服务端实现，每秒定时推送最新传感器状态。
+- get_realtime_data: 实时数据快照获取逻辑 (_build_realtime_data 为快照不可用时的降级路径)。
+- websocket_endpoint: WS 服务端实现，将连接注册到推送中心，由其推送最新传感器状态。
 - update_device_positions: 布局管理逻辑，将位置信息持久化至 Redis。
 """
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, Depends, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
-import asyncio
-import json
+import time
 
-router = APIRouter()
-
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+from .device_state import read_device_states
+from .realtime import hub
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
+router = APIRouter()
 
-manager = ConnectionManager()
+# Worker 物化的实时数据快照 (见 worker/src/realtime_snapshot.py)，超过 SNAPSHOT_MAX_AGE 秒未刷新时视为失效
+SNAPSHOT_KEY = "realtime:snapshot"
+SNAPSHOT_MAX_AGE = 30
 
 async def get_redis():
     from .main import redis_pool
@@ -107,9 +91,23 @@ async def get_dashboard_stats(db = Depends(get_db), redis = Depends(get_redis)):
     )
 
 @router.get("/realtime", response_model=List[DeviceRealtime])
-async def get_realtime_data(db = Depends(get_db), redis = Depends(get_redis)):
-    devices = []
+async def get_realtime_data(request: Request, db = Depends(get_db), redis = Depends(get_redis)):
+    """
+    所有设备的实时数据
+    优先返回 Worker 物化的快照 (一次 Redis 读取)，客户端携带相同 ETag 时返回 304
+    """
+    etag, body, updated_at = await redis.hmget(SNAPSHOT_KEY, "etag", "body", "updated_at")
+    if body is None or not updated_at or time.time() - float(updated_at) > SNAPSHOT_MAX_AGE:
+        # 快照尚未生成或 Worker 未在维护，直接构建
+        return await _build_realtime_data(db, redis)
     
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def _build_realtime_data(db, redis) -> Response:
+    """从数据库与 Redis 直接构建实时数据 (快照不可用时的降级路径，Redis 读取经管道批量完成)"""
     async with db.acquire() as conn:
         # JOIN instruments 表获取仪表名称和颜色
         rows = await conn.fetch("""
@@ -119,82 +117,57 @@ async def get_realtime_data(db = Depends(get_db), redis = Depends(get_redis)):
             LEFT JOIN instruments i ON d.instrument_id = i.id
         """)
     
+    states = await read_device_states(redis, [row['sn'] for row in rows], positions=True)
+    
+    devices = []
     for row in rows:
-        sn = row['sn']
-        rt_data = await redis.hgetall(f"realtime:{sn}")
-        is_online = await redis.exists(f"online:{sn}")
-        pos_data = await redis.hgetall(f"position:{sn}")
-        
-        devices.append(DeviceRealtime(
-            sn=sn,
-            name=row['name'],
-            ppm=float(rt_data.get('ppm')) if rt_data.get('ppm') else None,
-            temp=float(rt_data.get('temp')) if rt_data.get('temp') else None,
-            status="online" if is_online else "offline",
-            position_x=float(pos_data.get('x')) if pos_data.get('x') else None,
-            position_y=float(pos_data.get('y')) if pos_data.get('y') else None,
-            battery=int(rt_data.get('bat')) if rt_data.get('bat') else None,
-            rssi=int(rt_data.get('rssi')) if rt_data.get('rssi') else None,
-            network=rt_data.get('net') if rt_data.get('net') else None,
-            instrument_id=row['instrument_id'],
-            instrument_name=row['instrument_name'],
-            instrument_color=row['instrument_color'],
-            unit=row['unit'] or "ppm",
-            sensor_type=row['sensor_type']
-        ))
+        state = states[row['sn']]
+        devices.append({
+            "sn": row['sn'],
+            "name": row['name'],
+            "ppm": state.float_value('ppm'),
+            "temp": state.float_value('temp'),
+            "status": state.status,
+            "position_x": state.position_value('x'),
+            "position_y": state.position_value('y'),
+            "battery": state.int_value('bat'),
+            "rssi": state.int_value('rssi'),
+            "network": state.network,
+            "instrument_name": row['instrument_name'],
+            "instrument_color": row['instrument_color'],
+            "instrument_id": row['instrument_id'],
+            "unit": row['unit'] or "ppm",
+            "sensor_type": row['sensor_type'],
+        })
     
-    return devices
+    return JSONResponse(devices)
 
 @router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
-    
-    # Get redis connection
-    from .main import redis_pool
-    redis = redis_pool
-    
+    # 实时数据由推送中心统一订阅并扇出 (见 realtime.py)，连接本身不再查询数据库或 Redis
+    await hub.connect(websocket)
     try:
         while True:
-            # Push realtime data every second
-            devices = []
-            
-            # Get all device SNs (simplified)
-            # In production, maintain a set of registered devices
-            async with (await get_db()).acquire() as conn:
-                rows = await conn.fetch("SELECT sn, name, unit, sensor_type, instrument_id FROM devices")
-            
-            for row in rows:
-                sn = row['sn']
-                rt_data = await redis.hgetall(f"realtime:{sn}")
-                is_online = await redis.exists(f"online:{sn}")
-                
-                devices.append({
-                    "sn": sn,
-                    "name": row['name'],
-                    "ppm": float(rt_data.get('ppm')) if rt_data.get('ppm') else None,
-                    "temp": float(rt_data.get('temp')) if rt_data.get('temp') else None,
-                    "status": "online" if is_online else "offline",
-                    "unit": row['unit'],
-                    "sensor_type": row['sensor_type'],
-                    "instrument_id": row['instrument_id']
-                })
-            
-            await websocket.send_json({
-                "type": "realtime",
-                "data": devices
-            })
-            
-            await asyncio.sleep(1)
-            
+            # 订阅变更 / 重同步请求 (MessagePack 连接可发送二进制消息)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            await hub.handle_message(websocket, message.get("text") or message.get("bytes"))
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        hub.disconnect(websocket)
 
 @router.post("/devices/positions")
 async def update_device_positions(positions: Dict[str, Dict[str, float]], redis = Depends(get_redis)):
     """Update device positions for dashboard layout"""
+    pipe = redis.pipeline(transaction=False)
     for sn, pos in positions.items():
-        await redis.hset(f"position:{sn}", mapping={
+        pipe.hset(f"position:{sn}", mapping={
             "x": pos.get("x", 0),
             "y": pos.get("y", 0)
         })
+    # 使快照立即失效，Worker 下次物化前的请求直接读取新位置
+    pipe.hdel(SNAPSHOT_KEY, "updated_at")
+    await pipe.execute()
     return {"message": "Positions updated"}
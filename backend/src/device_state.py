@@ -0,0 +1,69 @@
+"""
+MCS-IOT 设备实时状态读取 (Device State Reader)
+
+该文件为设备列表、大屏等接口提供统一的设备实时状态批量读取，一页设备的状态通过一个 Redis 管道取回，往返次数与设备数量无关。
+主要功能包括：
+1. 管道读取：realtime:{sn} (最新数据)、online:{sn} (在线标记) 以及可选的 position:{sn} (大屏坐标) 在同一个管道中读取。
+2. 字段解析：将 Redis 中的字符串值转换为接口使用的 ppm / 电量 / 信号 / 网络类型等字段。
+
+结构：
+- DeviceState: 单台设备的实时状态。
+- read_device_states: 批量读取一组设备的实时状态。
+"""
+from typing import Dict, Iterable, Optional
+
+
+class DeviceState:
+    """单台设备的实时状态 (来自 Redis)"""
+
+    __slots__ = ("realtime", "online", "position")
+
+    def __init__(self, realtime: dict, online: bool, position: Optional[dict] = None):
+        self.realtime = realtime or {}
+        self.online = online
+        self.position = position or {}
+
+    @property
+    def status(self) -> str:
+        return "online" if self.online else "offline"
+
+    def float_value(self, key: str) -> Optional[float]:
+        value = self.realtime.get(key)
+        return float(value) if value else None
+
+    def int_value(self, key: str) -> Optional[int]:
+        value = self.realtime.get(key)
+        return int(float(value)) if value else None
+
+    @property
+    def network(self) -> Optional[str]:
+        return self.realtime.get('net') or None
+
+    def position_value(self, axis: str) -> Optional[float]:
+        value = self.position.get(axis)
+        return float(value) if value else None
+
+
+async def read_device_states(redis, sns: Iterable[str], positions: bool = False) -> Dict[str, DeviceState]:
+    """通过一个 Redis 管道读取一组设备的实时状态，返回 {sn: DeviceState}"""
+    sns = list(dict.fromkeys(sns))
+    if not sns:
+        return {}
+
+    pipe = redis.pipeline(transaction=False)
+    for sn in sns:
+        pipe.hgetall(f"realtime:{sn}")
+        pipe.exists(f"online:{sn}")
+        if positions:
+            pipe.hgetall(f"position:{sn}")
+    results = await pipe.execute()
+
+    step = 3 if positions else 2
+    return {
+        sn: DeviceState(
+            results[i * step],
+            bool(results[i * step + 1]),
+            results[i * step + 2] if positions else None
+        )
+        for i, sn in enumerate(sns)
+    }
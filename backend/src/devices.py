@@ -4,22 +4,28 @@ MCS-IOT 设备管理模块 (Device Management)
 该文件负责物联网设备的生命周期管理及其数据的实时与历史查询。
 主要功能包括：
 1. 定义设备基础信息、响应格式及控制命令的 Pydantic 模型。
-2. 实现设备的增删改查 (CRUD) 接口。
-3. 结合 PostgreSQL 存储静态配置与 Redis 存储实时数据（如在线状态、最新 PPM 值、电量等）。
+2. 实现设备的增删改查 (CRUD) 接口，设备列表支持游标分页及可选的总数模式 (见 pagination.py)。
+3. 结合 PostgreSQL 存储静态配置与 Redis 存储实时数据（如在线状态、最新 PPM 值、电量等），整页设备的实时状态经 device_state.py 一次管道读取。
 4. 提供设备历史趋势数据的查询接口，支持按不同时间维度（1h, 3h, 24h, 72h）自动聚合数据。
 5. 在更新设备信息时，同步刷新 Redis 中的校准参数及设备缓存。
+6. 管理设备的窗口报警规则 (上升速率、滑动平均、k/n 超限)，同步至 Redis 供 Worker 编译执行。
 
 结构：
 - Pydantic Models: DeviceBase, DeviceResponse 等数据交换格式定义。
 - API Handlers: list_devices, get_device, create_device, update_device, delete_device 等核心业务逻辑。
-- History Handler: get_device_history 负责时序数据的分桶聚合查询。
+- Rules Handlers: get_device_rules / update_device_rules 负责窗口报警规则的读写。
+- History Handler: get_device_history 负责时序数据的分桶聚合查询 (超出本地保留期的部分经 history.py 从归档读取)。
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
+from .device_state import DeviceState, read_device_states
+from .pagination import count_rows, decode_cursor, encode_cursor
+
 router = APIRouter()
 
 # Models
@@ -50,9 +56,40 @@ class DeviceResponse(DeviceBase):
     instrument_color: Optional[str] = None  # 仪表颜色
 
 class DeviceList(BaseModel):
-    total: int
+    total: Optional[int] = None
+    total_exact: bool = True
+    next_cursor: Optional[str] = None
     data: List[DeviceResponse]
 
+# 设备列表排序键 (与原 ORDER BY COALESCE(i.sort_order, 999999), i.name NULLS LAST, d.sensor_order NULLS LAST, d.sn 等价)
+# NULL 以 (x IS NULL) 标志位置后并 COALESCE 为定值，使整个键可用于行比较 (游标分页)
+# 该键跨 devices LEFT JOIN instruments 计算，没有索引可用，每页都会对设备表排序；设备数量通常为数百至数千台，
+# 排序代价很小，游标在这里提供的是翻页过程中设备增删时的稳定分页，按索引定位的游标分页只用于报警日志
+DEVICE_SORT_KEY = ("COALESCE(i.sort_order, 999999), (i.name IS NULL), COALESCE(i.name, ''), "
+                   "(d.sensor_order IS NULL), COALESCE(d.sensor_order, 0), d.sn")
+DEVICE_SORT_COLUMNS = ("COALESCE(i.sort_order, 999999) AS k_order, (i.name IS NULL) AS k_no_name, "
+                       "COALESCE(i.name, '') AS k_name, (d.sensor_order IS NULL) AS k_no_sensor, "
+                       "COALESCE(d.sensor_order, 0) AS k_sensor")
+# 游标各键的类型 (顺序与 DEVICE_SORT_KEY 一致)
+DEVICE_CURSOR_TYPES = (int, bool, str, bool, int, str)
+
+class AlarmRule(BaseModel):
+    """窗口报警规则 (由 Worker 在内存环形缓冲区上求值)"""
+    type: str  # rate_of_rise, moving_avg, k_of_n
+    threshold: float
+    metric: str = "ppm"  # ppm, temp, humi
+    window_seconds: Optional[int] = None  # rate_of_rise / moving_avg 窗口
+    k: Optional[int] = None  # k_of_n: 至少 k 个样本超限
+    n: Optional[int] = None  # k_of_n: 最近 n 个样本
+    hysteresis: float = 0.0  # 恢复滞回带 (与阈值同单位)
+    alarm_type: Optional[str] = None  # 写入报警记录的类型，默认按规则类型生成
+    enabled: bool = True
+
+ALARM_RULE_TYPES = {"rate_of_rise": "RATE_RISE", "moving_avg": "AVG_HIGH", "k_of_n": "K_OF_N"}
+ALARM_RULE_METRICS = ("ppm", "temp", "humi")
+# 与静态阈值报警冲突的类型不能被规则使用
+RESERVED_ALARM_TYPES = {"HIGH", "LOW", "LOW_BAT", "WEAK_SIGNAL", "OFFLINE"}
+
 class DeviceCommand(BaseModel):
     cmd: str  # debug, calib, reboot, ota
     params: Optional[dict] = None
@@ -66,91 +103,97 @@ async def get_redis():
     from .main import redis_pool
     return redis_pool
 
+def _device_payload(row, state: DeviceState) -> dict:
+    """数据库记录 + 实时状态 -> DeviceResponse 结构的字典 (不经过逐行模型校验)"""
+    last_seen = row['last_seen']
+    return {
+        "sn": row['sn'],
+        "name": row['name'],
+        "model": row['model'],
+        "sensor_type": row['sensor_type'] or "custom",
+        "unit": row['unit'] or "ppm",
+        "high_limit": row['high_limit'] or 1000.0,
+        "low_limit": row['low_limit'],
+        "k_val": row['calib_k'] or 1.0,
+        "b_val": row['calib_b'] or 0.0,
+        "t_coef": row['calib_t_comp'] or 0.0,
+        "instrument_id": row['instrument_id'],
+        "sensor_order": row['sensor_order'] or 0,
+        "status": state.status,
+        "last_seen": last_seen.isoformat() if last_seen else None,
+        "last_ppm": state.float_value('ppm'),
+        "battery": state.int_value('bat'),
+        "rssi": state.int_value('rssi'),
+        "network": state.network,
+        "instrument_name": row['instrument_name'],
+        "instrument_color": row['instrument_color'],
+    }
+
 @router.get("", response_model=DeviceList)
 async def list_devices(
     page: int = Query(1, ge=1),
     size: int = Query(20, ge=1, le=100),
     status: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，提供时忽略 page"),
+    total: str = Query("exact", description="总数模式: exact / capped / approx / none"),
     db = Depends(get_db),
     redis = Depends(get_redis)
 ):
-    offset = (page - 1) * size
+    # 排序键 (仪表排序, 无仪表名置后, 仪表名, 无传感器顺序置后, 传感器顺序, sn)，同时作为游标分页的比较键
+    params = []
+    cursor_sql = ""
+    offset = 0
+    if cursor:
+        params.extend(decode_cursor(cursor, DEVICE_CURSOR_TYPES))
+        cursor_sql = f"WHERE ({DEVICE_SORT_KEY}) > ($1, $2, $3, $4, $5, $6)"
+    else:
+        offset = (page - 1) * size
     
     # Get devices from DB with zone and instrument info
     async with db.acquire() as conn:
-        total = await conn.fetchval("SELECT COUNT(*) FROM devices")
+        count, exact = await count_rows(conn, "FROM devices", [], total)
         rows = await conn.fetch(
-            """SELECT d.sn, d.name, d.model, d.sensor_type, d.unit, d.high_limit, d.low_limit, d.calib_k, d.calib_b, 
+            f"""SELECT d.sn, d.name, d.model, d.sensor_type, d.unit, d.high_limit, d.low_limit, d.calib_k, d.calib_b, 
                       d.calib_t_comp, d.status, d.last_seen,
-                      d.instrument_id, d.sensor_order, i.name as instrument_name, i.color as instrument_color
+                      d.instrument_id, d.sensor_order, i.name as instrument_name, i.color as instrument_color,
+                      {DEVICE_SORT_COLUMNS}
                FROM devices d 
                LEFT JOIN instruments i ON d.instrument_id = i.id
-               ORDER BY COALESCE(i.sort_order, 999999), i.name NULLS LAST, d.sensor_order, d.sn 
-               LIMIT $1 OFFSET $2""",
-            size, offset
+               {cursor_sql}
+               ORDER BY {DEVICE_SORT_KEY} 
+               LIMIT ${len(params) + 1} OFFSET ${len(params) + 2}""",
+            *params, size + 1, offset
         )
     
-    devices = []
-    for row in rows:
-        # Get realtime data from Redis
-        rt_data = await redis.hgetall(f"realtime:{row['sn']}")
-        is_online = await redis.exists(f"online:{row['sn']}")
-        
-        devices.append(DeviceResponse(
-            sn=row['sn'],
-            name=row['name'],
-            model=row['model'],
-            sensor_type=row['sensor_type'],
-            unit=row['unit'],
-            high_limit=row['high_limit'] or 1000,
-            low_limit=row['low_limit'],
-            k_val=row['calib_k'] or 1.0,
-            b_val=row['calib_b'] or 0.0,
-            t_coef=row['calib_t_comp'] or 0.0,
-
-            instrument_id=row['instrument_id'],
-            sensor_order=row['sensor_order'] or 0,
-            instrument_name=row['instrument_name'],
-            instrument_color=row['instrument_color'],
-            status="online" if is_online else "offline",
-            last_seen=row['last_seen'],
-            last_ppm=float(rt_data.get('ppm')) if rt_data.get('ppm') else None,
-            battery=int(rt_data.get('bat')) if rt_data.get('bat') else None,
-            rssi=int(rt_data.get('rssi')) if rt_data.get('rssi') else None,
-            network=rt_data.get('net') if rt_data.get('net') else None
-        ))
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['k_order'], last['k_no_name'], last['k_name'],
+                                    last['k_no_sensor'], last['k_sensor'], last['sn'])
     
-    return DeviceList(total=total, data=devices)
+    # 整页设备的实时状态一次管道读取，响应直接序列化 (字段与 DeviceResponse 一致)
+    states = await read_device_states(redis, [row['sn'] for row in rows])
+    devices = [_device_payload(row, states[row['sn']]) for row in rows]
+    
+    return JSONResponse({"total": count, "total_exact": exact, "next_cursor": next_cursor, "data": devices})
 
 @router.get("/{sn}", response_model=DeviceResponse)
 async def get_device(sn: str, db = Depends(get_db), redis = Depends(get_redis)):
     async with db.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM devices WHERE sn = $1", sn)
+        row = await conn.fetchrow(
+            """SELECT d.*, i.name as instrument_name, i.color as instrument_color
+               FROM devices d
+               LEFT JOIN instruments i ON d.instrument_id = i.id
+               WHERE d.sn = $1""",
+            sn
+        )
     
     if not row:
         raise HTTPException(status_code=404, detail="Device not found")
     
-    rt_data = await redis.hgetall(f"realtime:{sn}")
-    is_online = await redis.exists(f"online:{sn}")
-    
-    return DeviceResponse(
-        sn=row['sn'],
-        name=row['name'],
-        model=row['model'],
-        sensor_type=row['sensor_type'],
-        unit=row['unit'],
-        high_limit=row['high_limit'] or 1000,
-        low_limit=row['low_limit'],
-        k_val=row['calib_k'] or 1.0,
-        b_val=row['calib_b'] or 0.0,
-        t_coef=row['calib_t_comp'] or 0.0,
-        status="online" if is_online else "offline",
-        last_seen=row['last_seen'],
-        last_ppm=float(rt_data.get('ppm')) if rt_data.get('ppm') else None,
-        battery=int(rt_data.get('bat')) if rt_data.get('bat') else None,
-        rssi=int(rt_data.get('rssi')) if rt_data.get('rssi') else None,
-        network=rt_data.get('net') if rt_data.get('net') else None
-    )
+    states = await read_device_states(redis, [sn])
+    return JSONResponse(_device_payload(row, states[sn]))
 
 @router.post("")
 async def create_device(device: DeviceBase, db = Depends(get_db)):
@@ -192,46 +235,219 @@ async def update_device(sn: str, device: DeviceBase, db = Depends(get_db), redis
     return {"message": "Device updated", "sn": sn}
 
 @router.delete("/{sn}")
-async def delete_device(sn: str, db = Depends(get_db)):
+async def delete_device(sn: str, db = Depends(get_db), redis = Depends(get_redis)):
     async with db.acquire() as conn:
         await conn.execute("DELETE FROM devices WHERE sn = $1", sn)
+    # 从离线检测索引中移除，避免已删除设备被重复检测
+    await redis.zrem("devices:last_seen", sn)
     return {"message": "Device deleted", "sn": sn}
 
+@router.get("/{sn}/rules", response_model=List[AlarmRule])
+async def get_device_rules(sn: str, db = Depends(get_db)):
+    """获取设备的窗口报警规则"""
+    async with db.acquire() as conn:
+        row = await conn.fetchrow("SELECT alarm_rules FROM devices WHERE sn = $1", sn)
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Device not found")
+    
+    return [AlarmRule(**r) for r in json.loads(row['alarm_rules'] or "[]")]
+
+@router.put("/{sn}/rules")
+async def update_device_rules(sn: str, rules: List[AlarmRule], db = Depends(get_db), redis = Depends(get_redis)):
+    """更新设备的窗口报警规则，并通知 Worker 重新编译"""
+    seen_types = set()
+    for rule in rules:
+        if rule.type not in ALARM_RULE_TYPES:
+            raise HTTPException(status_code=400, detail=f"不支持的规则类型: {rule.type}")
+        if rule.metric not in ALARM_RULE_METRICS:
+            raise HTTPException(status_code=400, detail=f"不支持的监测指标: {rule.metric}")
+        if rule.window_seconds is not None and rule.window_seconds <= 0:
+            raise HTTPException(status_code=400, detail="窗口长度必须大于 0")
+        if rule.type == "k_of_n" and rule.k and rule.n and rule.k > rule.n:
+            raise HTTPException(status_code=400, detail="k 不能大于 n")
+        alarm_type = (rule.alarm_type or ALARM_RULE_TYPES[rule.type]).upper()[:32]
+        if alarm_type in RESERVED_ALARM_TYPES or alarm_type in seen_types:
+            raise HTTPException(status_code=400, detail=f"报警类型重复或被保留: {alarm_type}")
+        seen_types.add(alarm_type)
+        rule.alarm_type = alarm_type
+    
+    rules_json = json.dumps([r.dict() for r in rules])
+    async with db.acquire() as conn:
+        result = await conn.execute(
+            "UPDATE devices SET alarm_rules = $2 WHERE sn = $1", sn, rules_json
+        )
+    if result == "UPDATE 0":
+        raise HTTPException(status_code=404, detail="Device not found")
+    
+    await redis.set(f"rules:{sn}", rules_json)
+    await redis.incr("rules:version")
+    
+    return {"message": "Alarm rules updated", "sn": sn, "count": len(rules)}
+
+# 可选的聚合粒度 (与连续聚合的桶宽对齐，见 aggregates.py)
+HISTORY_INTERVALS = [timedelta(minutes=1), timedelta(minutes=2), timedelta(minutes=10), timedelta(minutes=30),
+                     timedelta(hours=1), timedelta(hours=6), timedelta(days=1)]
+# 指定 max_points 时，先按约 max_points × LTTB_OVERSAMPLE 个桶查询，再用 LTTB 降采样
+LTTB_OVERSAMPLE = 4
+
+def _history_interval(span: timedelta, max_points: Optional[int] = None) -> timedelta:
+    """根据查询跨度选择聚合粒度 (指定 max_points 时选择更细的粒度供 LTTB 降采样)"""
+    if max_points:
+        target = span / (max_points * LTTB_OVERSAMPLE)
+        for interval in HISTORY_INTERVALS:
+            if interval >= target:
+                return interval
+        return HISTORY_INTERVALS[-1]
+    hours = span.total_seconds() / 3600
+    if hours <= 1:
+        return timedelta(minutes=1)
+    elif hours <= 3:
+        return timedelta(minutes=2)
+    elif hours <= 24:
+        return timedelta(minutes=10)
+    elif hours <= 72:
+        return timedelta(minutes=30)
+    elif hours <= 24 * 7:
+        return timedelta(hours=1)
+    elif hours <= 24 * 31:
+        return timedelta(hours=6)
+    return timedelta(days=1)
+
+HISTORY_FIELDS = {f"{m}{suffix}" for m in ("ppm", "temp", "humi") for suffix in ("", "_min", "_max")}
+MAX_BATCH_SERIES = 200
+
+def _parse_csv_param(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+@router.get("/history/batch")
+async def get_batch_history(
+    sns: Optional[str] = Query(None, description="逗号分隔的设备 SN"),
+    instrument_ids: Optional[str] = Query(None, description="逗号分隔的仪表 ID，展开为仪表下的所有设备"),
+    hours: int = Query(1, ge=1, le=72),
+    fields: str = Query("ppm", description="逗号分隔的字段: ppm/temp/humi，可加 _min/_max 后缀"),
+    max_points: Optional[int] = Query(None, ge=10, le=5000, description="每条曲线的最大点数 (LTTB 降采样)"),
+    db = Depends(get_db),
+    redis = Depends(get_redis)
+):
+    """批量获取多个设备的历史曲线 (一次分组查询，列式返回)
+    
+    返回的 timestamps 为所有序列共用的时间轴 (毫秒)，每个序列的各字段为与之等长的数组，缺失值为 null
+    指定 max_points 时按第一个字段对每条曲线做 LTTB 选点 (平均值字段以桶内最大值选点，保留浓度尖峰)，
+    时间轴为各曲线选中点的并集，总点数不超过 max_points
+    """
+    sn_list = _parse_csv_param(sns)
+    field_list = _parse_csv_param(fields)
+    try:
+        instrument_list = [int(i) for i in _parse_csv_param(instrument_ids)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="仪表 ID 必须为整数")
+    if not sn_list and not instrument_list:
+        raise HTTPException(status_code=400, detail="请指定 sns 或 instrument_ids")
+    invalid = [f for f in field_list if f not in HISTORY_FIELDS]
+    if invalid or not field_list:
+        raise HTTPException(status_code=400, detail=f"不支持的字段: {', '.join(invalid) or fields}")
+    
+    end = datetime.now()
+    start = end - timedelta(hours=hours)
+    interval = _history_interval(end - start, max_points)
+    
+    from .aggregates import query_buckets_multi
+    async with db.acquire() as conn:
+        devices = await conn.fetch(
+            """SELECT sn, name, sensor_type, unit, instrument_id
+               FROM devices
+               WHERE sn = ANY($1::text[]) OR instrument_id = ANY($2::int[])
+               ORDER BY instrument_id, sensor_order, sn""",
+            sn_list, instrument_list
+        )
+        if len(devices) > MAX_BATCH_SERIES:
+            raise HTTPException(status_code=400, detail=f"一次最多查询 {MAX_BATCH_SERIES} 个设备")
+        rows = await query_buckets_multi(conn, redis, [d['sn'] for d in devices], start, end, interval)
+    
+    buckets = sorted({r['bucket'] for r in rows})
+    index = {b: i for i, b in enumerate(buckets)}
+    series = {
+        d['sn']: {
+            "sn": d['sn'],
+            "name": d['name'],
+            "sensor_type": d['sensor_type'],
+            "unit": d['unit'],
+            "instrument_id": d['instrument_id'],
+            **{f: [None] * len(buckets) for f in field_list}
+        }
+        for d in devices
+    }
+    # 降采样的选点依据: 平均值已抹平尖峰，改用同一指标的桶内最大值
+    select_field = field_list[0] if "_" in field_list[0] else f"{field_list[0]}_max"
+    select_values = {d['sn']: [None] * len(buckets) for d in devices}
+    for r in rows:
+        target = series[r['sn']]
+        i = index[r['bucket']]
+        for f in field_list:
+            value = r[f]
+            if value is not None:
+                target[f][i] = round(value, 2 if f.startswith("ppm") else 1)
+        select_values[r['sn']][i] = r[select_field]
+    
+    timestamps = [int(b.timestamp() * 1000) for b in buckets]
+    if max_points and len(timestamps) > max_points:
+        from .downsample import lttb_union_indices
+        keep = lttb_union_indices(timestamps, list(select_values.values()), max_points)
+        timestamps = [timestamps[i] for i in keep]
+        for s in series.values():
+            for f in field_list:
+                s[f] = [s[f][i] for i in keep]
+    
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "interval_seconds": int(interval.total_seconds()),
+        "timestamps": timestamps,
+        "series": list(series.values())
+    }
+
 @router.get("/{sn}/history")
 async def get_device_history(
     sn: str,
     hours: int = Query(1, ge=1, le=72),  # 1-72 hours
-    db = Depends(get_db)
+    start: Optional[datetime] = Query(None, description="开始时间，指定后忽略 hours，可查询已归档的历史数据"),
+    end: Optional[datetime] = Query(None, description="结束时间，默认当前时间"),
+    max_points: Optional[int] = Query(None, ge=10, le=5000, description="最大点数，指定后以 LTTB 降采样 (按 ppm 选点)"),
+    db = Depends(get_db),
+    redis = Depends(get_redis)
 ):
     """Get device history data for charts
     
     Args:
         sn: Device serial number
         hours: Time range in hours (1, 3, 24, 72)
+        start / end: Explicit time range (up to 1 year), older ranges are read from archives
+        max_points: Optional point budget, finer buckets are downsampled with LTTB to keep peaks
     """
-    end = datetime.now()
-    start = end - timedelta(hours=hours)
+    # 未指定起止时间时为 "最近 N 小时" 轮询，走增量缓存
+    rolling = start is None and end is None
+    end = end or datetime.now()
+    start = start or end - timedelta(hours=hours)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="开始时间必须早于结束时间")
+    if end - start > timedelta(days=366):
+        raise HTTPException(status_code=400, detail="查询范围不能超过 1 年")
     
-    # Choose interval based on time range
-    if hours <= 1:
-        interval = timedelta(minutes=1)
-    elif hours <= 3:
-        interval = timedelta(minutes=2)
-    elif hours <= 24:
-        interval = timedelta(minutes=10)
+    interval = _history_interval(end - start, max_points)
+    
+    # 本地保留期内查询数据库，更早的数据从归档文件读取；滚动窗口只增量查询最新的桶
+    if rolling:
+        from .history_cache import cached_history_buckets
+        points = await cached_history_buckets(db, redis, sn, start, end, hours, interval)
     else:
-        interval = timedelta(minutes=30)
+        from .history import query_history_buckets
+        points = await query_history_buckets(db, redis, sn, start, end, interval)
+    if max_points:
+        from .downsample import lttb_select
+        points = lttb_select(points, max_points, x=lambda p: p[0].timestamp(), y=lambda p: p[1])
     
     async with db.acquire() as conn:
-        rows = await conn.fetch(
-            """SELECT time_bucket($1, time) AS bucket, 
-                      AVG(ppm) as ppm, AVG(temp) as temp, AVG(humi) as humi
-               FROM sensor_data 
-               WHERE sn = $2 AND time BETWEEN $3 AND $4
-               GROUP BY bucket ORDER BY bucket""",
-            interval, sn, start, end
-        )
-        
         # Also get alarms in this period
         alarms = await conn.fetch(
             """SELECT triggered_at, type, value 
@@ -245,15 +461,15 @@ async def get_device_history(
         "sn": sn,
         "start": start.isoformat(),
         "end": end.isoformat(),
-        "hours": hours,
+        "hours": round((end - start).total_seconds() / 3600, 2),
         "points": [
             {
-                "ts": r['bucket'].isoformat(), 
-                "ppm": round(r['ppm'], 2) if r['ppm'] else None, 
-                "temp": round(r['temp'], 1) if r['temp'] else None,
-                "humi": round(r['humi'], 1) if r['humi'] else None
+                "ts": bucket.isoformat(), 
+                "ppm": round(ppm, 2) if ppm else None, 
+                "temp": round(temp, 1) if temp else None,
+                "humi": round(humi, 1) if humi else None
             } 
-            for r in rows
+            for bucket, ppm, temp, humi in points
         ],
         "alarms": [
             {
@@ -264,5 +480,3 @@ async def get_device_history(
             for a in alarms
         ]
     }
-
-from datetime import timedelta
@@ -0,0 +1,92 @@
+"""
+MCS-IOT 曲线降采样 (LTTB Downsampling)
+
+该文件为历史曲线接口提供 Largest-Triangle-Three-Buckets (LTTB) 降采样，在限定点数的同时保留曲线形状，尤其是气体浓度的尖峰。
+主要功能包括：
+1. LTTB 选点：首尾点固定，中间点均分为 threshold - 2 个桶，每个桶选取与 "上一选中点" 及 "下一桶均值点" 构成三角形面积最大的点。
+2. 向量化：各桶的均值点一次性由 np.add.reduceat 计算，桶内三角形面积用 NumPy 数组运算，Python 循环次数只与目标点数相关。
+3. 多序列共用时间轴：点数预算按序列均分，各序列分别选点后取时间戳并集，保证每条曲线的关键点都在共享时间轴上，且总点数不超过 max_points。
+4. 可选依赖：numpy 未安装时不做降采样并记录警告。
+
+结构：
+- lttb_indices: 返回被选中点的下标。
+- lttb_select: 从记录列表中选取降采样后的记录 (按 x / y 取值函数)。
+- lttb_union_indices: 多个序列共用时间轴时的选点并集。
+"""
+import logging
+from typing import Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+
+def lttb_indices(x: Sequence[float], y: Sequence[float], threshold: int) -> List[int]:
+    """对 (x, y) 序列执行 LTTB，返回升序的选中下标 (点数不超过 threshold 时原样返回)"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    if not NUMPY_AVAILABLE:
+        logger.warning("numpy not installed, skipping LTTB downsampling")
+        return list(range(n))
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # 中间点 [1, n-1) 均分为 threshold - 2 个桶，第 i 个桶为 [bounds[i], bounds[i+1])
+    bounds = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    counts = np.diff(bounds)
+    mean_x = np.add.reduceat(x[:n - 1], bounds[:-1]) / counts
+    mean_y = np.add.reduceat(y[:n - 1], bounds[:-1]) / counts
+    # 每个桶的 "下一桶均值点"，最后一个桶使用末尾点
+    next_x = np.append(mean_x[1:], x[n - 1])
+    next_y = np.append(mean_y[1:], y[n - 1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected.tolist()
+
+
+def lttb_select(items: list, max_points: Optional[int], x: Callable, y: Callable) -> list:
+    """从按 x 升序的记录中选取不超过 max_points 条 (y 为空的记录不参与选点并被丢弃)"""
+    if not max_points or len(items) <= max_points:
+        return items
+    valid = [item for item in items if y(item) is not None]
+    indices = lttb_indices([x(item) for item in valid], [y(item) for item in valid], max_points)
+    return [valid[i] for i in indices]
+
+
+def lttb_union_indices(xs: Sequence[float], series: List[Sequence[Optional[float]]],
+                       max_points: Optional[int]) -> List[int]:
+    """
+    多个序列共用时间轴 xs 时，按序列数均分点数预算分别执行 LTTB，返回选中下标的并集 (升序，不超过 max_points)
+    - 序列中的 None 不参与选点，每个序列至少保留 3 个点
+    - 序列过多导致并集仍超出预算时，以各时刻的序列最大值 (包络) 再执行一次 LTTB
+    """
+    if not max_points or len(xs) <= max_points:
+        return list(range(len(xs)))
+    active = [values for values in series if any(v is not None for v in values)]
+    budget = max(3, max_points // max(len(active), 1))
+    chosen = set()
+    for values in active:
+        valid = [i for i, v in enumerate(values) if v is not None]
+        picked = lttb_indices([xs[i] for i in valid], [values[i] for i in valid], budget)
+        chosen.update(valid[i] for i in picked)
+    keep = sorted(chosen)
+    if len(keep) > max_points:
+        envelope = [max(values[i] for values in active if values[i] is not None) for i in keep]
+        picked = lttb_indices([xs[i] for i in keep], envelope, max_points)
+        keep = [keep[i] for i in picked]
+    return keep
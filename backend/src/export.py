@@ -3,7 +3,7 @@ MCS-IOT 数据导出模块 (Data Export)
 
 该文件负责将系统中的传感器历史数据及报警记录导出为标准格式文件（如 CSV），方便用户进行离线分析或报表制作。
 主要功能包括：
-1. 提供传感器数据的导出接口，支持按 SN、时间范围进行筛选，并自动处理物理量转换及格式化。
+1. 提供传感器数据的导出接口，支持按 SN、时间范围进行筛选，并自动处理物理量转换及格式化；超出本地保留期的数据从归档文件读取。
 2. 提供报警日志的导出接口，支持按设备、报警类型及日期范围进行过滤。
 3. 采用 StreamingResponse 流式相应，支持大规模数据导出时减少内存占用。
 4. 自动生成规范的文件命名，包含导出内容的描述及时间范围。
@@ -26,6 +26,10 @@ async def get_db():
     from .main import db_pool
     return db_pool
 
+async def get_redis():
+    from .main import redis_pool
+    return redis_pool
+
 
 @router.get("/sensor-data")
 async def export_sensor_data(
@@ -33,7 +37,8 @@ async def export_sensor_data(
     start: Optional[str] = Query(None, description="开始时间 YYYY-MM-DD"),
     end: Optional[str] = Query(None, description="结束时间 YYYY-MM-DD"),
     format: str = Query("csv", description="导出格式: csv 或 excel"),
-    db: asyncpg.Pool = Depends(get_db)
+    db: asyncpg.Pool = Depends(get_db),
+    redis = Depends(get_redis)
 ):
     """
     导出传感器历史数据
@@ -49,22 +54,9 @@ async def export_sensor_data(
     else:
         start_date = datetime.strptime(start, "%Y-%m-%d")
     
-    # 构建查询
-    query = """
-        SELECT time, sn, v_raw, ppm, temp, humi, bat, rssi, seq
-        FROM sensor_data
-        WHERE time >= $1 AND time <= $2
-    """
-    params = [start_date, end_date]
-    
-    if sn:
-        query += " AND sn = $3"
-        params.append(sn)
-    
-    query += " ORDER BY time DESC LIMIT 100000"  # 限制导出行数
-    
-    async with db.acquire() as conn:
-        rows = await conn.fetch(query, *params)
+    # 本地保留期内查询数据库，更早的数据从归档文件读取
+    from .history import query_raw_rows
+    rows = await query_raw_rows(db, redis, sn, start_date, end_date, limit=100000)  # 限制导出行数
     
     if not rows:
         raise HTTPException(status_code=404, detail="No data found for the specified criteria")
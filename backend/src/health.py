@@ -115,7 +115,7 @@ async def run_health_check(redis = Depends(get_redis), db = Depends(get_db)):
         overall_status = "unhealthy"
     
     # 10. 数据库存储空间
-    result = await check_db_size(db)
+    result = await check_db_size(db, redis)
     results.append(result)
     if result["status"] == "error":
         overall_status = "unhealthy"
@@ -464,30 +464,22 @@ async def check_db_tables(db) -> Dict[str, Any]:
         }
 
 
-async def check_db_size(db) -> Dict[str, Any]:
-    """检查数据库大小"""
+async def check_db_size(db, redis) -> Dict[str, Any]:
+    """检查数据库大小 (基于元数据统计，不扫描 sensor_data)"""
     try:
-        async with db.acquire() as conn:
-            result = await conn.fetchrow("""
-                SELECT 
-                    pg_database_size(current_database()) as db_size,
-                    (SELECT COUNT(*) FROM sensor_data) as sensor_rows
-            """)
-        
-        size_bytes = result['db_size']
-        sensor_rows = result['sensor_rows'] or 0
+        from .storage_stats import get_storage_stats
+        stats = await get_storage_stats(db, redis)
         
-        # 格式化大小
-        if size_bytes < 1024 * 1024:
-            size_human = f"{size_bytes / 1024:.2f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            size_human = f"{size_bytes / (1024 * 1024):.2f} MB"
-        else:
-            size_human = f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
+        size_bytes = stats['db_size_bytes']
+        size_human = stats['db_size_human']
+        sensor_rows = stats['sensor_data']['row_count']
         
         # 如果超过 10GB，警告
         status = "ok"
-        message = f"数据库大小: {size_human}，传感器数据: {sensor_rows:,} 条"
+        message = f"数据库大小: {size_human}，传感器数据: 约 {sensor_rows:,} 条"
+        ratio = stats['sensor_data'].get('compression_ratio')
+        if ratio:
+            message += f"，压缩比 {ratio}x"
         solution = None
         
         if size_bytes > 10 * 1024 * 1024 * 1024:
@@ -500,7 +492,10 @@ async def check_db_size(db) -> Dict[str, Any]:
             "status": status,
             "message": message,
             "solution": solution,
-            "details": {"size_bytes": size_bytes, "sensor_rows": sensor_rows}
+            "details": {"size_bytes": size_bytes, "sensor_rows": sensor_rows,
+                        "chunk_count": stats['sensor_data']['chunk_count'],
+                        "compressed_chunks": stats['sensor_data']['compressed_chunks'],
+                        "compression_ratio": ratio}
         }
     except Exception as e:
         return {
@@ -0,0 +1,325 @@
+"""
+MCS-IOT 分层历史数据读取 (Tiered History Read Layer)
+
+该文件为历史曲线及数据导出提供统一的读取入口：本地保留期内的数据查询 TimescaleDB，更早的数据从归档文件中读取，两部分合并为同样的结果结构。
+主要功能包括：
+1. 分层路由：以本地数据库中最早一条数据的时间为界，界内查询数据库，界外按天查找 archive_logs 中记录的归档文件。
+2. 本地 LRU 磁盘缓存：归档文件首次访问时经对象存储层 (object_store.py) 下载到缓存目录，按最近访问时间淘汰，总大小受 ARCHIVE_CACHE_MAX_MB 限制；正在读取的文件不会被淘汰。
+3. 谓词下推：Parquet 归档按 sn / time 过滤，借助行组 min/max 统计信息跳过无关行组；CSV.GZ 归档流式解压并逐行过滤，每天需完整解析，单次查询最多读取 ARCHIVE_CSV_MAX_DAYS 天 (长范围查询需使用 Parquet 归档)。
+4. 聚合对齐：数据库部分经连续聚合路由查询 (见 aggregates.py)，归档数据按与 time_bucket 相同的对齐方式分桶求平均，保证两层数据在曲线上无缝衔接。
+
+结构：
+- ArchiveCache: 归档文件的本地 LRU 磁盘缓存。
+- read_archive_rows: 从单个归档文件中读取过滤后的原始数据。
+- query_history_buckets: 分桶聚合的历史曲线查询 (设备详情页)。
+- query_raw_rows: 原始数据查询 (数据导出)。
+"""
+import asyncio
+import csv
+import gzip
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .aggregates import bucket_start, query_buckets
+from .archive_store import load_archive_store
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pq = None
+    PYARROW_AVAILABLE = False
+
+ARCHIVE_CACHE_DIR = os.getenv("ARCHIVE_CACHE_DIR", "/tmp/mcs_archive_cache")
+ARCHIVE_CACHE_MAX_BYTES = int(os.getenv("ARCHIVE_CACHE_MAX_MB", "2048")) * 1024 * 1024
+# 单次查询最多读取的 CSV.GZ 归档天数 (每天需完整解压并逐行解析)，更长的范围需使用 Parquet 归档
+ARCHIVE_CSV_MAX_DAYS = int(os.getenv("ARCHIVE_CSV_MAX_DAYS", "31"))
+
+RAW_COLUMNS = ("time", "sn", "v_raw", "ppm", "temp", "humi", "bat", "rssi", "seq")
+INT_COLUMNS = {"bat", "rssi", "seq"}
+
+
+def _touch(path: str) -> bool:
+    """更新文件的访问时间，文件不存在时返回 False"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class ArchiveCache:
+    """
+    归档文件的本地 LRU 磁盘缓存 (以文件 mtime 作为最近访问时间)
+    - 通过 use() 获取的文件在使用期间被引用计数保护，淘汰时跳过
+    - 命中检查、下载落盘与淘汰在 _evict_lock 下互斥，淘汰看到的引用集合与磁盘状态一致
+    - 文件系统操作均在线程池中执行
+    """
+
+    def __init__(self, cache_dir: str = ARCHIVE_CACHE_DIR, max_bytes: int = ARCHIVE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # key -> [下载锁, 等待/持有者数量]，数量归零时移除
+        self._locks: Dict[str, list] = {}
+        self._in_use: Dict[str, int] = {}
+        self._evict_lock = asyncio.Lock()
+
+    def _local_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key.replace("/", "_"))
+
+    def _evict(self, protected: frozenset):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".part") or path in protected:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(e[1] for e in entries) + sum(
+            os.path.getsize(p) for p in protected if os.path.exists(p)
+        )
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def _pin(self, path: str):
+        self._in_use[path] = self._in_use.get(path, 0) + 1
+
+    def _unpin(self, path: str):
+        count = self._in_use.get(path, 0) - 1
+        if count > 0:
+            self._in_use[path] = count
+        else:
+            self._in_use.pop(path, None)
+
+    async def _fetch(self, store, key: str) -> str:
+        """返回已加引用的本地路径，缓存未命中时从对象存储下载"""
+        path = self._local_path(key)
+        loop = asyncio.get_running_loop()
+
+        async with self._evict_lock:
+            if await loop.run_in_executor(None, _touch, path):
+                self._pin(path)
+                return path
+
+        await loop.run_in_executor(None, partial(os.makedirs, self.cache_dir, exist_ok=True))
+        tmp_path = path + ".part"
+        await store.download(key, tmp_path)
+
+        async with self._evict_lock:
+            await loop.run_in_executor(None, os.replace, tmp_path, path)
+            self._pin(path)
+            try:
+                await loop.run_in_executor(None, self._evict, frozenset(self._in_use))
+            except OSError as e:
+                logger.warning(f"Archive cache eviction failed: {e}")
+        logger.info(f"Archive cached: {key}")
+        return path
+
+    @asynccontextmanager
+    async def use(self, store, key: str):
+        """获取归档文件的本地路径，退出前该文件不会被淘汰"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                path = await self._fetch(store, key)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(key, None)
+        try:
+            yield path
+        finally:
+            self._unpin(path)
+
+
+archive_cache = ArchiveCache()
+
+
+def _parse_csv_value(column: str, value: str):
+    if value == "":
+        return None
+    if column == "time":
+        return datetime.fromisoformat(value)
+    if column == "sn":
+        return value
+    if column in INT_COLUMNS:
+        return int(value)
+    return float(value)
+
+
+def _read_csv_gz(path: str, sn: Optional[str], start: datetime, end: datetime) -> List[dict]:
+    rows = []
+    with gzip.open(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return rows
+        sn_idx = header.index("sn")
+        time_idx = header.index("time")
+        for record in reader:
+            if sn and record[sn_idx] != sn:
+                continue
+            ts = datetime.fromisoformat(record[time_idx])
+            if ts < start or ts >= end:
+                continue
+            rows.append({col: _parse_csv_value(col, val) for col, val in zip(header, record)})
+    return rows
+
+
+def _read_parquet(path: str, sn: Optional[str], start: datetime, end: datetime) -> List[dict]:
+    filters = [("time", ">=", start), ("time", "<", end)]
+    if sn:
+        filters.append(("sn", "=", sn))
+    table = pq.read_table(path, columns=list(RAW_COLUMNS), filters=filters)
+    return table.to_pylist()
+
+
+def read_archive_rows(path: str, sn: Optional[str], start: datetime, end: datetime) -> List[dict]:
+    """从单个归档文件读取 [start, end) 内的数据 (同步函数，需在线程池中调用)"""
+    if path.endswith(".parquet"):
+        if not PYARROW_AVAILABLE:
+            logger.warning(f"pyarrow not installed, cannot read {path}")
+            return []
+        return _read_parquet(path, sn, start, end)
+    return _read_csv_gz(path, sn, start, end)
+
+
+async def get_local_start(conn) -> Optional[datetime]:
+    """本地数据库中最早一条数据的时间 (按分块顺序读取，不做全表扫描)"""
+    return await conn.fetchval("SELECT time FROM sensor_data ORDER BY time ASC LIMIT 1")
+
+
+async def _archived_rows(db, redis, sn: Optional[str], start: datetime, end: datetime,
+                         newest_first: bool = False, limit: Optional[int] = None) -> List[dict]:
+    """读取 [start, end) 范围内的归档数据，按天从 archive_logs 定位归档文件"""
+    async with db.acquire() as conn:
+        archives = await conn.fetch(
+            """SELECT archive_date, r2_path FROM archive_logs
+               WHERE archive_date >= $1 AND archive_date <= $2
+                 AND status = 'uploaded' AND kind = 'daily'
+               ORDER BY archive_date""",
+            start.date(), (end - timedelta(microseconds=1)).date()
+        )
+    if not archives:
+        return []
+    csv_days = sum(1 for a in archives if not a['r2_path'].endswith(".parquet"))
+    if csv_days > ARCHIVE_CSV_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"查询范围包含 {csv_days} 天 CSV.GZ 归档 (上限 {ARCHIVE_CSV_MAX_DAYS} 天)，请缩小时间范围或将归档格式切换为 Parquet"
+        )
+
+    store = await load_archive_store(redis)
+    loop = asyncio.get_running_loop()
+    results = []
+    for archive in (reversed(archives) if newest_first else archives):
+        r2_path = archive['r2_path']
+        day_start = max(start, datetime.combine(archive['archive_date'], datetime.min.time()))
+        day_end = min(end, datetime.combine(archive['archive_date'] + timedelta(days=1), datetime.min.time()))
+        local = r2_path.startswith("/")
+        # 未配置云存储时 Worker 写入的本地归档仅在共享目录时可读；云端归档需要当前配置了云存储
+        if (local and not await loop.run_in_executor(None, os.path.exists, r2_path)) or (not local and not store):
+            logger.warning(f"Archive {r2_path} is not reachable from backend, skipped")
+            continue
+        try:
+            if local:
+                rows = await loop.run_in_executor(None, read_archive_rows, r2_path, sn, day_start, day_end)
+            else:
+                async with archive_cache.use(store, r2_path) as path:
+                    rows = await loop.run_in_executor(None, read_archive_rows, path, sn, day_start, day_end)
+        except Exception as e:
+            # 不跳过读取失败的日期，否则曲线 / 导出会静默缺少一整天的数据
+            logger.error(f"Failed to read archive {r2_path}: {e}")
+            raise HTTPException(status_code=502, detail=f"读取 {archive['archive_date']} 的归档数据失败: {e}")
+
+        rows.sort(key=lambda r: r['time'], reverse=newest_first)
+        results.extend(rows)
+        if limit and len(results) >= limit:
+            return results[:limit]
+    return results
+
+
+def _aggregate(rows: List[dict], interval: timedelta) -> List[Tuple[datetime, Optional[float], Optional[float], Optional[float]]]:
+    """按 time_bucket 对齐方式对原始数据分桶求平均"""
+    buckets: Dict[datetime, list] = {}
+    for row in rows:
+        acc = buckets.setdefault(bucket_start(row['time'], interval), [0.0, 0, 0.0, 0, 0.0, 0])
+        for i, key in enumerate(("ppm", "temp", "humi")):
+            value = row.get(key)
+            if value is not None:
+                acc[i * 2] += value
+                acc[i * 2 + 1] += 1
+    return [
+        (bucket,
+         acc[0] / acc[1] if acc[1] else None,
+         acc[2] / acc[3] if acc[3] else None,
+         acc[4] / acc[5] if acc[5] else None)
+        for bucket, acc in sorted(buckets.items())
+    ]
+
+
+async def query_history_buckets(db, redis, sn: str, start: datetime, end: datetime,
+                                interval: timedelta) -> List[Tuple[datetime, Optional[float], Optional[float], Optional[float]]]:
+    """
+    分层查询设备历史曲线，返回 [(bucket, ppm, temp, humi), ...]
+    - [local_start, end] 查询 TimescaleDB (连续聚合 + 实时边缘的原始数据)
+    - [start, local_start) 读取归档文件
+    """
+    async with db.acquire() as conn:
+        local_start = await get_local_start(conn)
+        db_start = max(start, local_start) if local_start else start
+        rows = await query_buckets(conn, redis, sn, db_start, end, interval)
+    points = [(r['bucket'], r['ppm'], r['temp'], r['humi']) for r in rows]
+
+    archive_end = min(end, local_start) if local_start else end
+    if start < archive_end:
+        archived = _aggregate(await _archived_rows(db, redis, sn, start, archive_end), interval)
+        # 边界桶可能同时包含两层数据，以数据库结果为准
+        db_buckets = {p[0] for p in points}
+        points = [p for p in archived if p[0] not in db_buckets] + points
+    return points
+
+
+async def query_raw_rows(db, redis, sn: Optional[str], start: datetime, end: datetime,
+                         limit: int) -> List[dict]:
+    """
+    分层查询原始数据 (按时间倒序，最多 limit 行)，用于数据导出
+    数据库中的数据优先，不足 limit 时继续读取更早的归档数据
+    """
+    query = f"""
+        SELECT {", ".join(RAW_COLUMNS)}
+        FROM sensor_data
+        WHERE time >= $1 AND time <= $2
+    """
+    params = [start, end]
+    if sn:
+        query += " AND sn = $3"
+        params.append(sn)
+    query += f" ORDER BY time DESC LIMIT {int(limit)}"
+
+    async with db.acquire() as conn:
+        local_start = await get_local_start(conn)
+        rows = [dict(r) for r in await conn.fetch(query, *params)]
+
+    archive_end = min(end, local_start) if local_start else end
+    if len(rows) < limit and start < archive_end:
+        rows.extend(await _archived_rows(db, redis, sn, start, archive_end,
+                                         newest_first=True, limit=limit - len(rows)))
+    return rows
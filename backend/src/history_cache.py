@@ -0,0 +1,77 @@
+"""
+MCS-IOT 历史曲线增量缓存 (Incremental History Cache)
+
+该文件为设备详情页的历史曲线 (最近 N 小时) 提供增量缓存，轮询刷新时不再重复查询整个时间窗口。
+主要功能包括：
+1. 只缓存已定型的桶：结束时间早于 "min(当前时间, 设备最新数据时间) - FINALIZE_LAG" 的桶不会再变化，按 (sn, 聚合间隔, 窗口小时数) 缓存在 Redis；数据按设备时钟写入，时钟偏慢的设备以其自身时间线判断定型。
+2. 增量拼接：刷新时只查询最后一个已定型桶之后的数据 (通常 1~2 个桶)，与缓存拼接后按窗口起点裁剪。
+3. 版本失效：缓存记录写入时的版本号，迟到数据 (早于该设备已收到的最新时间且超过定型延迟) 写入 (Worker) 时递增设备版本 history:version:{sn}，数据清理等全局变更递增 history:version，版本不一致即整体重算。
+
+结构：
+- cached_history_buckets: 带缓存的历史曲线查询入口。
+- invalidate_history: 使单个设备或全部设备的缓存失效。
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from .aggregates import bucket_start, query_buckets
+from .history import query_history_buckets
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "history:cache:"
+# 全局版本 / 设备版本 (Worker 侧使用相同的键名)
+VERSION_KEY = "history:version"
+SN_VERSION_PREFIX = "history:version:"
+CACHE_TTL = 3600
+# 桶结束后等待迟到数据的时间，超过后视为定型
+FINALIZE_LAG = timedelta(seconds=60)
+
+Point = Tuple[datetime, Optional[float], Optional[float], Optional[float]]
+
+
+async def invalidate_history(redis, sn: Optional[str] = None):
+    """使历史曲线缓存失效: 指定 sn 时只影响该设备，否则影响全部设备"""
+    await redis.incr(f"{SN_VERSION_PREFIX}{sn}" if sn else VERSION_KEY)
+
+
+async def cached_history_buckets(db, redis, sn: str, start: datetime, end: datetime,
+                                 hours: int, interval: timedelta) -> List[Point]:
+    """
+    查询以 end (当前时间) 结尾的 hours 小时窗口的分桶曲线，返回 [(bucket, ppm, temp, humi), ...]
+    缓存命中时只查询最后一个已定型桶之后的数据
+    """
+    key = f"{CACHE_PREFIX}{sn}:{int(interval.total_seconds())}:{hours}"
+    pipe = redis.pipeline(transaction=False)
+    pipe.mget(key, VERSION_KEY, f"{SN_VERSION_PREFIX}{sn}")
+    pipe.hget(f"realtime:{sn}", "ts")
+    (cached_raw, global_version, sn_version), newest_ts = await pipe.execute()
+    version = f"{global_version or 0}:{sn_version or 0}"
+
+    entry = json.loads(cached_raw) if cached_raw else None
+    if entry and entry.get("version") == version:
+        cached = [(datetime.fromisoformat(p[0]), p[1], p[2], p[3]) for p in entry["buckets"]]
+        final_until = datetime.fromisoformat(entry["final_until"])
+        async with db.acquire() as conn:
+            rows = await query_buckets(conn, redis, sn, max(final_until, start), end, interval)
+        fresh = [(r['bucket'], r['ppm'], r['temp'], r['humi']) for r in rows]
+    else:
+        cached = []
+        fresh = await query_history_buckets(db, redis, sn, start, end, interval)
+
+    window_start = bucket_start(start, interval)
+    points = [p for p in cached if p[0] >= window_start] + fresh
+
+    # 桶 [b, b + interval) 在 b + interval <= min(now, 设备最新数据时间) - FINALIZE_LAG 时定型
+    # (行按设备上报的 ts 写入，设备时钟落后于服务器时，服务器时间之前的桶仍会继续写入)
+    newest = datetime.fromtimestamp(float(newest_ts)) if newest_ts else end
+    finalized_before = bucket_start(min(end, newest) - FINALIZE_LAG, interval)
+    entry = {
+        "version": version,
+        "final_until": finalized_before.isoformat(),
+        "buckets": [[p[0].isoformat(), p[1], p[2], p[3]] for p in points if p[0] < finalized_before],
+    }
+    await redis.set(key, json.dumps(entry), ex=CACHE_TTL)
+    return points
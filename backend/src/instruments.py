@@ -47,6 +47,10 @@ async def get_db():
     from .main import db_pool
     return db_pool
 
+async def get_redis():
+    from .main import redis_pool
+    return redis_pool
+
 @router.get("", response_model=InstrumentList)
 async def list_instruments(db = Depends(get_db)):
     """获取所有仪表"""
@@ -64,7 +68,7 @@ async def list_instruments(db = Depends(get_db)):
                        SELECT COUNT(*) 
                        FROM alarm_logs a 
                        JOIN devices d ON a.sn = d.sn 
-                       WHERE d.instrument_id = i.id AND a.status != 'ack'
+                       WHERE d.instrument_id = i.id AND a.status = 'active'
                    ), 0) as alarms_unhandled
             FROM instruments i 
             ORDER BY i.sort_order, i.id
@@ -109,7 +113,7 @@ async def get_instrument(instrument_id: int, db = Depends(get_db)):
                        SELECT COUNT(*) 
                        FROM alarm_logs a 
                        JOIN devices d ON a.sn = d.sn 
-                       WHERE d.instrument_id = i.id AND a.status != 'ack'
+                       WHERE d.instrument_id = i.id AND a.status = 'active'
                    ), 0) as alarms_unhandled
             FROM instruments i 
             WHERE i.id = $1
@@ -228,14 +232,21 @@ from datetime import datetime, timedelta
 async def get_instrument_history(
     instrument_id: int,
     hours: int = Query(1, ge=1, le=72),
-    db = Depends(get_db)
+    max_points: Optional[int] = Query(None, ge=10, le=5000, description="每条曲线的最大点数 (LTTB 降采样)"),
+    db = Depends(get_db),
+    redis = Depends(get_redis)
 ):
-    """获取仪表下所有传感器的历史数据"""
+    """获取仪表下所有传感器的历史数据 (经连续聚合路由查询，见 aggregates.py)"""
+    from .aggregates import query_buckets_multi
+    
     end = datetime.now()
     start = end - timedelta(hours=hours)
     
-    # Choose interval based on time range
-    if hours <= 1:
+    # Choose interval based on time range (finer buckets when LTTB downsampling is requested)
+    if max_points:
+        from .devices import _history_interval
+        interval = _history_interval(end - start, max_points)
+    elif hours <= 1:
         interval = timedelta(minutes=1)
     elif hours <= 3:
         interval = timedelta(minutes=2)
@@ -256,32 +267,30 @@ async def get_instrument_history(
         if not devices:
             return {"instrument_id": instrument_id, "series": []}
             
-        series = []
-        for dev in devices:
-            # 2. Get history for each device
-            rows = await conn.fetch(
-                """SELECT time_bucket($1, time) AS bucket, 
-                          AVG(ppm) as ppm
-                   FROM sensor_data 
-                   WHERE sn = $2 AND time BETWEEN $3 AND $4
-                   GROUP BY bucket ORDER BY bucket""",
-                interval, dev['sn'], start, end
-            )
-            
-            # Format data points: [timestamp_ms, value]
-            points = []
-            for r in rows:
-                if r['bucket']:
-                    points.append([r['bucket'].timestamp() * 1000, round(r['ppm'], 2)])
-            
-            series.append({
-                "sn": dev['sn'],
-                "name": dev['name'],
-                "sensor_type": dev['sensor_type'],
-                "unit": dev['unit'],
-                "data": points
-            })
-            
+        # 2. Get history for all devices in one grouped query
+        rows = await query_buckets_multi(conn, redis, [d['sn'] for d in devices], start, end, interval)
+    
+    # Format data points: [timestamp_ms, value]
+    points_by_sn = {d['sn']: [] for d in devices}
+    for r in rows:
+        if r['bucket'] and r['ppm'] is not None:
+            points_by_sn[r['sn']].append([r['bucket'].timestamp() * 1000, round(r['ppm'], 2)])
+    if max_points:
+        from .downsample import lttb_select
+        points_by_sn = {sn: lttb_select(points, max_points, x=lambda p: p[0], y=lambda p: p[1])
+                        for sn, points in points_by_sn.items()}
+    
+    series = [
+        {
+            "sn": dev['sn'],
+            "name": dev['name'],
+            "sensor_type": dev['sensor_type'],
+            "unit": dev['unit'],
+            "data": points_by_sn[dev['sn']]
+        }
+        for dev in devices
+    ]
+    
     return {
         "instrument_id": instrument_id,
         "start": start.isoformat(),
@@ -6,7 +6,7 @@ MCS-IOT 后端主程序 (Main Entry Point)
 1. 初始化 FastAPI 应用实例。
 2. 配置跨域资源共享 (CORS)。
 3. 管理应用生命周期事件 (Lifespan)，包括 Redis 和 数据库 (TimescaleDB) 线程池的启动与关闭。
-4. 自动执行数据库迁移和授权系统初始化。
+4. 自动执行数据库迁移和授权系统初始化，并启动实时数据推送中心。
 5. 注册所有子模块的 API 路由。
 6. 提供全局健康检查接口 (/api/health)。
 
@@ -185,10 +185,15 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning(f"Archive config migration failed: {e}")
     
+    # 实时数据推送中心 (订阅 Worker 发布的更新并扇出到 WebSocket)
+    from .realtime import hub as realtime_hub
+    await realtime_hub.start(deps.db_pool, deps.redis_pool)
+    
     yield
     
     # Shutdown
     logger.info("Shutting down...")
+    await realtime_hub.stop()
     if deps.redis_pool:
         await deps.redis_pool.close()
     if deps.db_pool:
@@ -3,6 +3,7 @@
 
 在后端启动时自动检查并执行必要的数据库 Schema 升级
 确保用户升级 Docker 后数据库结构能自动更新
+多个后端进程/副本同时启动时通过 PostgreSQL 咨询锁串行执行，每个迁移只应用一次
 """
 
 import logging
@@ -10,6 +11,40 @@ from typing import List, Tuple
 
 logger = logging.getLogger(__name__)
 
+# 迁移咨询锁 ID (pg_advisory_lock 键，任意固定值)
+MIGRATION_LOCK_ID = 7_245_301
+
+
+def _continuous_aggregate_sqls(view: str, bucket: str, start_offset: str, end_offset: str,
+                               schedule: str) -> List[str]:
+    """
+    sensor_data 连续聚合 (按 sn + 时间桶预聚合 ppm/temp/humi 的 avg/min/max 及样本数)
+    WITH NO DATA 可在事务中创建，历史数据的首次物化由 Worker 完成 (见 worker/src/maintenance.py)
+    """
+    metrics = ",\n".join(
+        f"                   AVG({m}) AS {m}_avg, MIN({m}) AS {m}_min, MAX({m}) AS {m}_max, COUNT({m}) AS {m}_n"
+        for m in ("ppm", "temp", "humi")
+    )
+    return [
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+            SELECT time_bucket(INTERVAL '{bucket}', time) AS bucket,
+                   sn,
+{metrics}
+            FROM sensor_data
+            GROUP BY bucket, sn
+        WITH NO DATA;
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{view}',
+            start_offset => INTERVAL '{start_offset}',
+            end_offset => INTERVAL '{end_offset}',
+            schedule_interval => INTERVAL '{schedule}',
+            if_not_exists => TRUE);
+        """,
+    ]
+
 
 # 定义所有迁移
 # 每个迁移是一个元组: (版本号, 描述, SQL语句列表)
@@ -24,6 +59,84 @@ MIGRATIONS: List[Tuple[int, str, List[str]]] = [
             """,
         ]
     ),
+    (
+        3,
+        "添加 alarm_logs.resolved_at 字段用于报警自动恢复",
+        [
+            """
+            ALTER TABLE alarm_logs 
+            ADD COLUMN IF NOT EXISTS resolved_at TIMESTAMP;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_open 
+            ON alarm_logs (sn, type) WHERE resolved_at IS NULL;
+            """,
+        ]
+    ),
+    (
+        4,
+        "添加 devices.alarm_rules 字段存储窗口报警规则",
+        [
+            """
+            ALTER TABLE devices 
+            ADD COLUMN IF NOT EXISTS alarm_rules TEXT DEFAULT '[]';
+            """,
+        ]
+    ),
+    (
+        5,
+        "archive_logs 扩展为归档目录: 校验和、设备数、时间范围、格式及类型",
+        [
+            """
+            ALTER TABLE archive_logs
+            ADD COLUMN IF NOT EXISTS checksum VARCHAR(64),
+            ADD COLUMN IF NOT EXISTS sn_count INT,
+            ADD COLUMN IF NOT EXISTS time_start TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS time_end TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS format VARCHAR(16) DEFAULT 'csv',
+            ADD COLUMN IF NOT EXISTS kind VARCHAR(16) DEFAULT 'daily';
+            """,
+            """
+            UPDATE archive_logs SET kind = 'daily' WHERE kind IS NULL;
+            """,
+            # 手动备份也进入目录，唯一约束由 archive_date 改为 (archive_date, kind)
+            """
+            DROP INDEX IF EXISTS archive_logs_date_unique;
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS archive_logs_date_kind_unique
+            ON archive_logs (archive_date, kind);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_archive_logs_path ON archive_logs (r2_path);
+            """,
+        ]
+    ),
+    (
+        6,
+        "添加 sensor_data 连续聚合 (1 分钟 / 10 分钟 / 1 小时) 用于历史曲线",
+        _continuous_aggregate_sqls("sensor_data_1m", "1 minute", "1 day", "1 minute", "1 minute")
+        + _continuous_aggregate_sqls("sensor_data_10m", "10 minutes", "2 days", "10 minutes", "10 minutes")
+        + _continuous_aggregate_sqls("sensor_data_1h", "1 hour", "3 days", "1 hour", "1 hour")
+    ),
+    (
+        7,
+        "添加 alarm_logs 游标分页索引 (triggered_at, id) 及按 sn / status / type 过滤的复合索引",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_time_id ON alarm_logs (triggered_at DESC, id DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_sn_time ON alarm_logs (sn, triggered_at DESC, id DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_status_time ON alarm_logs (status, triggered_at DESC, id DESC);
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_alarm_type_time ON alarm_logs (type, triggered_at DESC, id DESC);
+            """,
+        ]
+    ),
     # 后续迁移可以在这里添加
     # (
     #     2,
@@ -80,30 +193,40 @@ async def run_migrations(pool) -> None:
         return
     
     async with pool.acquire() as conn:
-        # 确保迁移表存在
-        await ensure_migration_table(conn)
-        
-        # 获取已应用的版本
-        applied = await get_applied_versions(conn)
-        
-        # 筛选待应用的迁移
-        pending = [(v, d, s) for v, d, s in MIGRATIONS if v not in applied]
-        
-        if not pending:
-            logger.info("数据库 Schema 已是最新版本")
-            return
-        
-        logger.info(f"发现 {len(pending)} 个待执行的数据库迁移")
-        
-        # 按版本号排序执行
-        pending.sort(key=lambda x: x[0])
-        
-        success_count = 0
-        for version, description, sqls in pending:
-            if await apply_migration(conn, version, description, sqls):
-                success_count += 1
-            else:
-                logger.error(f"迁移在版本 #{version} 处停止")
-                break
-        
-        logger.info(f"数据库迁移完成: {success_count}/{len(pending)} 个迁移已应用")
+        # 多个后端副本同时启动时，通过会话级咨询锁保证只有一个副本执行迁移，其余副本等待后看到已应用的版本
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            await _run_pending(conn)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def _run_pending(conn) -> None:
+    """在持有迁移锁的连接上应用待执行的迁移"""
+    # 确保迁移表存在
+    await ensure_migration_table(conn)
+    
+    # 获取已应用的版本
+    applied = await get_applied_versions(conn)
+    
+    # 筛选待应用的迁移
+    pending = [(v, d, s) for v, d, s in MIGRATIONS if v not in applied]
+    
+    if not pending:
+        logger.info("数据库 Schema 已是最新版本")
+        return
+    
+    logger.info(f"发现 {len(pending)} 个待执行的数据库迁移")
+    
+    # 按版本号排序执行
+    pending.sort(key=lambda x: x[0])
+    
+    success_count = 0
+    for version, description, sqls in pending:
+        if await apply_migration(conn, version, description, sqls):
+            success_count += 1
+        else:
+            logger.error(f"迁移在版本 #{version} 处停止")
+            break
+    
+    logger.info(f"数据库迁移完成: {success_count}/{len(pending)} 个迁移已应用")
@@ -0,0 +1,74 @@
+"""
+MCS-IOT 游标分页工具 (Keyset Pagination)
+
+该文件为报警日志、设备列表等分页接口提供基于游标 (keyset) 的分页及可选的总数统计方式，排序键有索引时翻到第 N 页的代价与第 1 页相同。
+主要功能包括：
+1. 游标编解码：将上一页最后一行的排序键 (如 triggered_at, id) 编码为不透明的 URL 安全字符串，下一页以 WHERE (排序键) < (游标) 继续读取，可使用索引而不是 OFFSET 跳过前面的行 (排序键有对应索引时，如报警日志的 (triggered_at, id))。
+2. 总数模式：exact 为精确 COUNT(*)；capped 最多计数到 TOTAL_CAP 行 (超过时返回上限)；approx 读取查询计划的行数估算 (不扫描数据)；none 不统计。
+
+结构：
+- encode_cursor / decode_cursor: 游标编解码。
+- count_rows: 按总数模式统计满足条件的行数。
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+TOTAL_MODES = ("exact", "capped", "approx", "none")
+# capped 模式的计数上限
+TOTAL_CAP = 10000
+
+
+def encode_cursor(*values: Any) -> str:
+    """将排序键编码为游标 (datetime 以 ISO 格式保存)"""
+    payload = [{"t": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _decode_value(value: Any, expected: type) -> Any:
+    if expected is datetime:
+        if not isinstance(value, dict) or not isinstance(value.get("t"), str):
+            raise ValueError("expected datetime")
+        return datetime.fromisoformat(value["t"])
+    # bool 是 int 的子类，需单独区分
+    if isinstance(value, bool) != (expected is bool) or not isinstance(value, expected):
+        raise ValueError(f"expected {expected.__name__}")
+    return value
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    """按各排序键的类型 (datetime / int / bool / str) 解析游标，格式、数量或类型不符时返回 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("cursor size mismatch")
+        return [_decode_value(v, t) for v, t in zip(payload, types)]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def count_rows(conn, from_sql: str, params: list, mode: str) -> Tuple[Optional[int], bool]:
+    """
+    统计 "FROM ... WHERE ..." 片段匹配的行数，返回 (total, 是否精确)
+    from_sql 不含 ORDER BY / LIMIT，params 为其中引用的参数
+    """
+    if mode not in TOTAL_MODES:
+        raise HTTPException(status_code=400, detail=f"total must be one of {', '.join(TOTAL_MODES)}")
+    if mode == "none":
+        return None, False
+    if mode == "exact":
+        return await conn.fetchval(f"SELECT COUNT(*) {from_sql}", *params), True
+    if mode == "capped":
+        total = await conn.fetchval(
+            f"SELECT COUNT(*) FROM (SELECT 1 {from_sql} LIMIT {TOTAL_CAP + 1}) capped", *params
+        )
+        return min(total, TOTAL_CAP), total <= TOTAL_CAP
+    # approx: 查询计划的行数估算 (依赖 ANALYZE 统计信息)
+    plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) SELECT 1 {from_sql}", *params)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"]), False
@@ -0,0 +1,386 @@
+"""
+MCS-IOT 实时数据推送中心 (Realtime Push Hub)
+
+该文件负责将 Worker 发布的实时数据扇出到所有已连接的大屏 / 仪表盘 WebSocket。每个后端进程只运行一个推送中心，Redis 与数据库的负载与打开的屏幕数量无关。
+主要功能包括：
+1. 订阅更新：Worker 每处理一条上报即向 Redis 频道 realtime:updates 发布该设备的最新数据，设备离线时发布状态变更；推送中心通过一条 pub/sub 连接接收全部更新。
+2. 内存快照：推送中心维护所有设备的最新状态，启动时及每 SNAPSHOT_REFRESH 秒从数据库与 Redis (管道批量读取) 重建一次，用于同步设备名称等元数据并补齐订阅断开期间丢失的更新。
+3. 订阅视图：客户端可按仪表 ID、SN 列表或传感器类型订阅 / 退订 (满足任一条件的设备即在订阅范围内，不订阅时接收全部设备)。订阅条件相同的连接共享一个视图 (RealtimeView)，推送中心维护 SN -> 视图集合的索引，每条更新只路由到关心该设备的视图。
+4. 增量帧：每个视图按设备、按字段累积变化，每 PUSH_INTERVAL 秒合并为一个增量帧 (只含变化的字段)，每个视图只序列化一次并由其所有连接共享；发送超时的连接被断开，不会拖慢其他屏幕。
+5. 序号与重同步：每个视图的增量帧携带该视图单调递增的序号 seq。连接建立或订阅变更后先收到一份完整快照 (含当前 seq)，客户端发现序号不连续时发送 {"type": "resync"} 重新获取快照。
+6. 保活：没有变化的周期不发送任何帧，每 KEEPALIVE_INTERVAL 秒发送一次只含当前 seq 的保活帧。
+7. 二进制编码：连接时通过查询参数 ?format=msgpack 或子协议 "msgpack" 协商 MessagePack 二进制帧 (内容与 JSON 帧相同)，默认仍为 JSON 文本帧。每个视图的帧按连接使用的编码各编码一次，同一编码的连接共享同一份字节；msgpack 未安装时回退为 JSON。
+
+帧格式 (服务端 -> 客户端)：
+- {"type": "snapshot", "seq": N, "data": [设备, ...]}
+- {"type": "delta", "seq": N, "changes": {sn: {字段: 新值}}, "removed": [sn, ...]}  (新进入视图的设备的 changes 为完整记录)
+- {"type": "keepalive", "seq": N}
+
+客户端消息 (JSON 文本，MessagePack 连接也可发送二进制)：
+- {"type": "subscribe" | "unsubscribe", "instrument_ids": [...], "sns": [...], "sensor_types": [...]}  (在当前订阅上增加 / 移除条件)
+- {"type": "resync"}
+
+结构：
+- REALTIME_CHANNEL: Worker 发布实时数据的频道 (Worker 侧使用相同的名称)。
+- RealtimeView: 订阅条件相同的一组连接及其待发送的变化。
+- RealtimeHub: 推送中心，负责 Redis 订阅、快照维护、视图路由及连接管理。
+- hub: 进程内单例，由 main.py 的 lifespan 启动与停止。
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, FrozenSet, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket
+
+from .device_state import read_device_states
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+REALTIME_CHANNEL = "realtime:updates"
+# 推送周期 (秒)
+PUSH_INTERVAL = 1.0
+# 快照全量重建周期 (秒)
+SNAPSHOT_REFRESH = 60
+# 无变化时的保活间隔 (秒)
+KEEPALIVE_INTERVAL = 15.0
+# 单个连接的发送超时 (秒)
+SEND_TIMEOUT = 5.0
+# 单次订阅消息中每类条件的最大数量
+MAX_FILTER_ITEMS = 1000
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+
+
+def _to_float(value) -> Optional[float]:
+    return float(value) if value not in (None, "") else None
+
+
+def encode_frame(frame: dict, encoding: str) -> Union[str, bytes]:
+    """按连接协商的编码序列化帧: JSON 为文本，MessagePack 为字节"""
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(frame, use_bin_type=True)
+    return json.dumps(frame, separators=(",", ":"))
+
+
+class RealtimeView:
+    """订阅条件相同的一组连接，共享增量帧的序号与编码结果"""
+
+    def __init__(self, key: Tuple[FrozenSet, FrozenSet, FrozenSet]):
+        self.key = key
+        self.instrument_ids, self.sns, self.sensor_types = key
+        self.connections: Set[WebSocket] = set()
+        self.members: Set[str] = set()
+        self.seq = 0
+        # 上次推送后累积的变化: sn -> {字段: 新值}
+        self.changes: Dict[str, dict] = {}
+        self.removed: Set[str] = set()
+        self.last_sent = 0.0
+
+    def matches(self, device: dict) -> bool:
+        if not (self.instrument_ids or self.sns or self.sensor_types):
+            return True
+        return (device["sn"] in self.sns
+                or device.get("instrument_id") in self.instrument_ids
+                or device.get("sensor_type") in self.sensor_types)
+
+    def delta_frame(self) -> Optional[dict]:
+        """取出累积的变化并生成下一个增量帧，没有变化时返回 None"""
+        if not self.changes and not self.removed:
+            return None
+        self.seq += 1
+        frame = {"type": "delta", "seq": self.seq, "changes": self.changes, "removed": sorted(self.removed)}
+        self.changes = {}
+        self.removed = set()
+        return frame
+
+
+def _parse_filter(message: dict) -> Tuple[FrozenSet, FrozenSet, FrozenSet]:
+    """解析订阅消息中的条件 (忽略类型不符的条目)"""
+    def items(field, cast):
+        values = message.get(field) or []
+        if not isinstance(values, list):
+            return frozenset()
+        parsed = set()
+        for value in values[:MAX_FILTER_ITEMS]:
+            try:
+                parsed.add(cast(value))
+            except (TypeError, ValueError):
+                continue
+        return frozenset(parsed)
+    return items("instrument_ids", int), items("sns", str), items("sensor_types", str)
+
+
+class RealtimeHub:
+    """实时数据推送中心: 一个 Redis 订阅 + 内存快照，按订阅视图扇出到 WebSocket 连接"""
+
+    def __init__(self):
+        self.devices: Dict[str, dict] = {}
+        self.views: Dict[tuple, RealtimeView] = {}
+        # 连接 -> 所属视图 / 帧编码；SN -> 包含该设备的视图集合
+        self._conn_views: Dict[WebSocket, RealtimeView] = {}
+        self._encodings: Dict[WebSocket, str] = {}
+        self._index: Dict[str, Set[RealtimeView]] = {}
+        self._tasks = []
+
+    async def start(self, db, redis):
+        """加载初始快照并启动订阅、推送及快照刷新任务"""
+        try:
+            await self.load_snapshot(db, redis)
+        except Exception as e:
+            logger.error(f"Realtime snapshot load failed: {e}")
+        self._tasks = [
+            asyncio.create_task(self._subscribe_loop(db, redis)),
+            asyncio.create_task(self._push_loop()),
+            asyncio.create_task(self._refresh_loop(db, redis)),
+        ]
+        logger.info("Realtime hub started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ==================== 快照维护 ====================
+
+    async def load_snapshot(self, db, redis):
+        """从数据库读取设备列表，并通过 Redis 管道批量读取实时数据与在线标记"""
+        async with db.acquire() as conn:
+            rows = await conn.fetch("SELECT sn, name, unit, sensor_type, instrument_id FROM devices")
+
+        states = await read_device_states(redis, [row['sn'] for row in rows])
+
+        devices = {}
+        for row in rows:
+            state = states[row['sn']]
+            devices[row['sn']] = {
+                "sn": row['sn'],
+                "name": row['name'],
+                "ppm": state.float_value('ppm'),
+                "temp": state.float_value('temp'),
+                "status": state.status,
+                "unit": row['unit'],
+                "sensor_type": row['sensor_type'],
+                "instrument_id": row['instrument_id'],
+            }
+        # 与旧快照逐字段比较，只把差异计入各视图的下一个增量帧
+        for sn, device in devices.items():
+            old = self.devices.get(sn)
+            if old is not None:
+                self._record(sn, {k: v for k, v in device.items() if old.get(k) != v})
+        self.devices = devices
+        # 仪表 / 类型变更或设备增删会改变视图成员
+        for view in self.views.values():
+            self._sync_members(view)
+
+    def _record(self, sn: str, changed: dict):
+        if changed:
+            for view in self._index.get(sn, ()):
+                view.changes.setdefault(sn, {}).update(changed)
+
+    def _sync_members(self, view: RealtimeView, initial: bool = False):
+        """重新计算视图成员并更新索引，新进入的设备以完整记录计入增量，离开的设备计入 removed"""
+        members = {sn for sn, device in self.devices.items() if view.matches(device)}
+        if not initial:
+            for sn in members - view.members:
+                view.changes[sn] = dict(self.devices[sn])
+                view.removed.discard(sn)
+            for sn in view.members - members:
+                view.changes.pop(sn, None)
+                view.removed.add(sn)
+        for sn in view.members - members:
+            self._index.get(sn, set()).discard(view)
+            if not self._index.get(sn):
+                self._index.pop(sn, None)
+        for sn in members - view.members:
+            self._index.setdefault(sn, set()).add(view)
+        view.members = members
+
+    def apply_update(self, update: dict):
+        """合并 Worker 发布的单设备更新 (未知设备等待下一次快照刷新补齐元数据)"""
+        device = self.devices.get(update.get("sn"))
+        if device is None:
+            return
+        values = {}
+        if "ppm" in update:
+            values["ppm"] = _to_float(update["ppm"])
+        if "temp" in update:
+            values["temp"] = _to_float(update["temp"])
+        if update.get("status"):
+            values["status"] = update["status"]
+        changed = {k: v for k, v in values.items() if device.get(k) != v}
+        device.update(changed)
+        self._record(device["sn"], changed)
+
+    async def _subscribe_loop(self, db, redis):
+        """订阅 realtime:updates，断开后重连并重建快照 (补齐断开期间的更新)"""
+        while True:
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(REALTIME_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        self.apply_update(json.loads(message["data"]))
+                    except (ValueError, TypeError) as e:
+                        logger.warning(f"Invalid realtime update: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime subscription error: {e}")
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+            await asyncio.sleep(1)
+            try:
+                await self.load_snapshot(db, redis)
+            except Exception as e:
+                logger.error(f"Realtime snapshot reload failed: {e}")
+
+    async def _refresh_loop(self, db, redis):
+        while True:
+            await asyncio.sleep(SNAPSHOT_REFRESH)
+            try:
+                await self.load_snapshot(db, redis)
+            except Exception as e:
+                logger.error(f"Realtime snapshot refresh failed: {e}")
+
+    # ==================== 视图与连接 ====================
+
+    def _attach(self, websocket: WebSocket, key: tuple) -> RealtimeView:
+        """将连接移入订阅条件为 key 的视图 (不存在时创建)，空视图随即释放"""
+        old = self._conn_views.get(websocket)
+        if old is not None and old.key == key:
+            return old
+        view = self.views.get(key)
+        if view is None:
+            view = RealtimeView(key)
+            self.views[key] = view
+            self._sync_members(view, initial=True)
+        view.connections.add(websocket)
+        self._conn_views[websocket] = view
+        if old is not None:
+            self._detach_view(old, websocket)
+        return view
+
+    def _detach_view(self, view: RealtimeView, websocket: WebSocket):
+        view.connections.discard(websocket)
+        if not view.connections:
+            self.views.pop(view.key, None)
+            for sn in view.members:
+                self._index.get(sn, set()).discard(view)
+                if not self._index.get(sn):
+                    self._index.pop(sn, None)
+
+    async def connect(self, websocket: WebSocket):
+        """接受连接并协商帧编码 (?format=msgpack 或子协议 msgpack)"""
+        via_subprotocol = ENCODING_MSGPACK in (websocket.scope.get("subprotocols") or [])
+        encoding = ENCODING_JSON
+        if via_subprotocol or websocket.query_params.get("format") == ENCODING_MSGPACK:
+            if MSGPACK_AVAILABLE:
+                encoding = ENCODING_MSGPACK
+            else:
+                logger.warning("msgpack not installed, realtime feed falls back to JSON")
+        await websocket.accept(subprotocol=ENCODING_MSGPACK if via_subprotocol and encoding == ENCODING_MSGPACK else None)
+        self._encodings[websocket] = encoding
+        self._attach(websocket, (frozenset(), frozenset(), frozenset()))
+        await self.send_snapshot(websocket)
+
+    def disconnect(self, websocket: WebSocket):
+        self._encodings.pop(websocket, None)
+        view = self._conn_views.pop(websocket, None)
+        if view is not None:
+            self._detach_view(view, websocket)
+
+    async def send_snapshot(self, websocket: WebSocket):
+        """向单个连接发送所属视图的完整快照 (新连接、订阅变更或客户端请求重同步)"""
+        view = self._conn_views.get(websocket)
+        if view is None:
+            return
+        data = [self.devices[sn] for sn in sorted(view.members)]
+        frame = {"type": "snapshot", "seq": view.seq, "data": data}
+        await self._send(websocket, encode_frame(frame, self._encodings.get(websocket, ENCODING_JSON)))
+
+    async def handle_message(self, websocket: WebSocket, raw: Union[str, bytes]):
+        """处理客户端消息: subscribe / unsubscribe / resync"""
+        try:
+            if isinstance(raw, bytes):
+                if not MSGPACK_AVAILABLE:
+                    return
+                message = msgpack.unpackb(raw, raw=False)
+            else:
+                message = json.loads(raw)
+        except Exception:
+            return
+        if not isinstance(message, dict):
+            return
+        msg_type = message.get("type")
+        if msg_type in ("subscribe", "unsubscribe"):
+            view = self._conn_views.get(websocket)
+            if view is None:
+                return
+            requested = _parse_filter(message)
+            if msg_type == "subscribe":
+                key = tuple(current | extra for current, extra in zip(view.key, requested))
+            else:
+                key = tuple(current - extra for current, extra in zip(view.key, requested))
+            self._attach(websocket, key)
+            await self.send_snapshot(websocket)
+        elif msg_type == "resync":
+            await self.send_snapshot(websocket)
+
+    async def _send(self, websocket: WebSocket, payload: Union[str, bytes]):
+        try:
+            if isinstance(payload, bytes):
+                await asyncio.wait_for(websocket.send_bytes(payload), timeout=SEND_TIMEOUT)
+            else:
+                await asyncio.wait_for(websocket.send_text(payload), timeout=SEND_TIMEOUT)
+        except Exception:
+            # 发送失败或超时的连接直接断开，由客户端重连
+            self.disconnect(websocket)
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+    async def _push_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(PUSH_INTERVAL)
+            now = loop.time()
+            sends = []
+            for view in list(self.views.values()):
+                frame = view.delta_frame()
+                if frame is None:
+                    if now - view.last_sent < KEEPALIVE_INTERVAL:
+                        continue
+                    frame = {"type": "keepalive", "seq": view.seq}
+                view.last_sent = now
+                # 每个视图的帧对每种编码只序列化一次，由使用该编码的所有连接共享
+                encoded: Dict[str, Union[str, bytes]] = {}
+                for ws in list(view.connections):
+                    encoding = self._encodings.get(ws, ENCODING_JSON)
+                    if encoding not in encoded:
+                        encoded[encoding] = encode_frame(frame, encoding)
+                    sends.append(self._send(ws, encoded[encoding]))
+            if sends:
+                try:
+                    await asyncio.gather(*sends)
+                except Exception as e:
+                    logger.error(f"Realtime broadcast failed: {e}")
+
+
+hub = RealtimeHub()
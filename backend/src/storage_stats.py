@@ -0,0 +1,134 @@
+"""
+MCS-IOT 存储统计服务 (Storage Statistics)
+
+该文件为健康检查、归档页面等提供数据库存储统计，全部数据来自 TimescaleDB / PostgreSQL 的元数据，不对 sensor_data 做 COUNT(*) 全表扫描。Worker 与 Backend 各持有一份相同的副本 (两者为独立镜像)。
+主要功能包括：
+1. 近似行数：approximate_row_count 读取各分块的统计信息 (已压缩分块使用压缩前行数)，耗时与数据量无关。
+2. 空间占用：hypertable_detailed_size 给出表/索引/TOAST 大小，chunks_detailed_size 给出每个分块的大小。
+3. 压缩效果：hypertable_compression_stats 给出压缩前后大小及压缩比。
+4. 短期缓存：统计结果缓存在 Redis (stats:storage)，有效期 STATS_CACHE_TTL 秒，页面刷新不会反复查询元数据。
+5. 降级：TimescaleDB 函数不可用时退回 pg_class.reltuples 及 pg_total_relation_size。
+
+结构：
+- collect_storage_stats: 从数据库元数据收集统计。
+- get_storage_stats: 带 Redis 缓存的入口函数。
+- format_size: 字节数格式化。
+"""
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+HYPERTABLE = "sensor_data"
+STATS_CACHE_KEY = "stats:storage"
+STATS_CACHE_TTL = 60
+
+
+def format_size(size_bytes: int) -> str:
+    """格式化文件大小"""
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.2f} KB"
+    elif size_bytes < 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.2f} MB"
+    return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
+
+
+async def _hypertable_stats(conn) -> Dict[str, Any]:
+    """TimescaleDB 元数据: 近似行数、分块大小及压缩统计"""
+    row_count = await conn.fetchval("SELECT approximate_row_count($1::text::regclass)", HYPERTABLE)
+    size = await conn.fetchrow(
+        "SELECT table_bytes, index_bytes, toast_bytes, total_bytes FROM hypertable_detailed_size($1::text::regclass)",
+        HYPERTABLE
+    )
+    compression = await conn.fetchrow(
+        """SELECT total_chunks, number_compressed_chunks,
+                  before_compression_total_bytes, after_compression_total_bytes
+           FROM hypertable_compression_stats($1::text::regclass)""",
+        HYPERTABLE
+    )
+    chunks = await conn.fetch(
+        """SELECT c.chunk_name, c.range_start, c.range_end, c.is_compressed, s.total_bytes
+           FROM timescaledb_information.chunks c
+           JOIN chunks_detailed_size($1::text::regclass) s ON s.chunk_name = c.chunk_name
+           WHERE c.hypertable_name = $1
+           ORDER BY c.range_start""",
+        HYPERTABLE
+    )
+
+    before = (compression and compression['before_compression_total_bytes']) or 0
+    after = (compression and compression['after_compression_total_bytes']) or 0
+    return {
+        "row_count": row_count or 0,
+        "table_bytes": (size and size['table_bytes']) or 0,
+        "index_bytes": (size and size['index_bytes']) or 0,
+        "toast_bytes": (size and size['toast_bytes']) or 0,
+        "total_bytes": (size and size['total_bytes']) or 0,
+        "chunk_count": len(chunks),
+        "compressed_chunks": (compression and compression['number_compressed_chunks']) or 0,
+        "before_compression_bytes": before,
+        "after_compression_bytes": after,
+        "compression_ratio": round(before / after, 2) if after else None,
+        "chunks": [
+            {
+                "name": c['chunk_name'],
+                "range_start": c['range_start'].isoformat() if c['range_start'] else None,
+                "range_end": c['range_end'].isoformat() if c['range_end'] else None,
+                "compressed": c['is_compressed'],
+                "size_bytes": c['total_bytes'] or 0,
+            }
+            for c in chunks
+        ],
+    }
+
+
+async def _fallback_stats(conn) -> Dict[str, Any]:
+    """非超表 / TimescaleDB 函数不可用时，使用 PostgreSQL 统计信息"""
+    row = await conn.fetchrow(
+        """SELECT GREATEST(reltuples, 0)::bigint AS row_count,
+                  pg_total_relation_size(oid) AS total_bytes
+           FROM pg_class WHERE oid = $1::text::regclass""",
+        HYPERTABLE
+    )
+    return {
+        "row_count": (row and row['row_count']) or 0,
+        "total_bytes": (row and row['total_bytes']) or 0,
+        "chunk_count": 0,
+        "compressed_chunks": 0,
+        "compression_ratio": None,
+        "chunks": [],
+    }
+
+
+async def collect_storage_stats(conn) -> Dict[str, Any]:
+    """收集数据库存储统计 (只读元数据，行数为估算值)"""
+    db_size = await conn.fetchval("SELECT pg_database_size(current_database())")
+    try:
+        sensor_data = await _hypertable_stats(conn)
+    except Exception as e:
+        logger.warning(f"TimescaleDB size functions unavailable, using pg_class statistics: {e}")
+        sensor_data = await _fallback_stats(conn)
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "db_size_bytes": db_size or 0,
+        "db_size_human": format_size(db_size or 0),
+        "row_count_estimated": True,
+        "sensor_data": sensor_data,
+    }
+
+
+async def get_storage_stats(db, redis, refresh: bool = False) -> Dict[str, Any]:
+    """获取存储统计，优先读取 Redis 缓存"""
+    if not refresh:
+        cached = await redis.get(STATS_CACHE_KEY)
+        if cached:
+            return json.loads(cached)
+
+    async with db.acquire() as conn:
+        stats = await collect_storage_stats(conn)
+    await redis.set(STATS_CACHE_KEY, json.dumps(stats), ex=STATS_CACHE_TTL)
+    return stats
@@ -58,7 +58,11 @@ export const devicesApi = {
     create: (data: any) => api.post('/devices', data),
     update: (sn: string, data: any) => api.put(`/devices/${sn}`, data),
     delete: (sn: string) => api.delete(`/devices/${sn}`),
-    history: (sn: string, params: any) => api.get(`/devices/${sn}/history`, { params })
+    history: (sn: string, params: any) => api.get(`/devices/${sn}/history`, { params }),
+    batchHistory: (params: { sns?: string, instrument_ids?: string, hours?: number, fields?: string, max_points?: number }) =>
+        api.get('/devices/history/batch', { params }),
+    getRules: (sn: string) => api.get(`/devices/${sn}/rules`),
+    updateRules: (sn: string, rules: any[]) => api.put(`/devices/${sn}/rules`, rules)
 }
 
 // Alarms API
@@ -88,9 +92,11 @@ export const configApi = {
     updateArchive: (data: any) => api.put('/config/archive', data),
     testArchive: () => api.post('/config/archive/test'),
     getArchiveStats: () => api.get('/config/archive/stats'),
-    listArchiveFiles: () => api.get('/config/archive/files'),
+    listArchiveFiles: (page = 1, page_size = 20) => api.get('/config/archive/files', { params: { page, page_size } }),
+    reconcileArchive: () => api.post('/config/archive/reconcile', null, { timeout: 60000 }),
     backupArchive: () => api.post('/config/archive/backup', null, { timeout: 60000 }),
     cleanupData: (days: number) => api.post('/config/archive/cleanup', { days }, { timeout: 60000 }),
+    backfillArchive: (until?: string, concurrency = 3) => api.post('/config/archive/backfill', { until, concurrency }, { timeout: 60000 }),
     deleteArchiveFile: (key: string) => api.post('/config/archive/delete', { key }),
     // 站点品牌配置
     getSite: () => api.get('/config/site'),
@@ -60,6 +60,7 @@ CREATE TABLE IF NOT EXISTS devices (
     high_limit FLOAT DEFAULT 1000.0,
     low_limit FLOAT,
     bat_limit FLOAT DEFAULT 20.0,    -- 低电量阈值
+    alarm_rules TEXT DEFAULT '[]',   -- 窗口报警规则 (JSON 数组)
     
     -- 状态
     status VARCHAR(20) DEFAULT 'offline',
@@ -103,6 +104,47 @@ ALTER TABLE sensor_data SET (
 );
 SELECT add_compression_policy('sensor_data', INTERVAL '1 day', if_not_exists => TRUE);
 
+-- Continuous Aggregates (历史曲线预聚合，查询路由见 backend/src/aggregates.py)
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensor_data_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+SELECT time_bucket(INTERVAL '1 minute', time) AS bucket,
+       sn,
+       AVG(ppm) AS ppm_avg, MIN(ppm) AS ppm_min, MAX(ppm) AS ppm_max, COUNT(ppm) AS ppm_n,
+       AVG(temp) AS temp_avg, MIN(temp) AS temp_min, MAX(temp) AS temp_max, COUNT(temp) AS temp_n,
+       AVG(humi) AS humi_avg, MIN(humi) AS humi_min, MAX(humi) AS humi_max, COUNT(humi) AS humi_n
+FROM sensor_data
+GROUP BY bucket, sn
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('sensor_data_1m', start_offset => INTERVAL '1 day', end_offset => INTERVAL '1 minute',
+    schedule_interval => INTERVAL '1 minute', if_not_exists => TRUE);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensor_data_10m
+WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+SELECT time_bucket(INTERVAL '10 minutes', time) AS bucket,
+       sn,
+       AVG(ppm) AS ppm_avg, MIN(ppm) AS ppm_min, MAX(ppm) AS ppm_max, COUNT(ppm) AS ppm_n,
+       AVG(temp) AS temp_avg, MIN(temp) AS temp_min, MAX(temp) AS temp_max, COUNT(temp) AS temp_n,
+       AVG(humi) AS humi_avg, MIN(humi) AS humi_min, MAX(humi) AS humi_max, COUNT(humi) AS humi_n
+FROM sensor_data
+GROUP BY bucket, sn
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('sensor_data_10m', start_offset => INTERVAL '2 days', end_offset => INTERVAL '10 minutes',
+    schedule_interval => INTERVAL '10 minutes', if_not_exists => TRUE);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS sensor_data_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = true) AS
+SELECT time_bucket(INTERVAL '1 hour', time) AS bucket,
+       sn,
+       AVG(ppm) AS ppm_avg, MIN(ppm) AS ppm_min, MAX(ppm) AS ppm_max, COUNT(ppm) AS ppm_n,
+       AVG(temp) AS temp_avg, MIN(temp) AS temp_min, MAX(temp) AS temp_max, COUNT(temp) AS temp_n,
+       AVG(humi) AS humi_avg, MIN(humi) AS humi_min, MAX(humi) AS humi_max, COUNT(humi) AS humi_n
+FROM sensor_data
+GROUP BY bucket, sn
+WITH NO DATA;
+SELECT add_continuous_aggregate_policy('sensor_data_1h', start_offset => INTERVAL '3 days', end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '1 hour', if_not_exists => TRUE);
+
+
 -- 4. Alarm Logs
 CREATE TABLE IF NOT EXISTS alarm_logs (
     id SERIAL PRIMARY KEY,
@@ -115,10 +157,17 @@ CREATE TABLE IF NOT EXISTS alarm_logs (
     notified BOOLEAN DEFAULT FALSE,
     channels VARCHAR(128),           -- 通知渠道: email,sms,webhook
     ack_at TIMESTAMP,
-    ack_by VARCHAR(64)
+    ack_by VARCHAR(64),
+    resolved_at TIMESTAMP            -- 报警恢复时间 (由 Worker 状态机写入)
 );
 CREATE INDEX IF NOT EXISTS idx_alarm_sn ON alarm_logs (sn);
 CREATE INDEX IF NOT EXISTS idx_alarm_time ON alarm_logs (triggered_at DESC);
+CREATE INDEX IF NOT EXISTS idx_alarm_open ON alarm_logs (sn, type) WHERE resolved_at IS NULL;
+-- 游标分页 (triggered_at, id) 及按 sn / status / type 过滤 (迁移 #7)
+CREATE INDEX IF NOT EXISTS idx_alarm_time_id ON alarm_logs (triggered_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alarm_sn_time ON alarm_logs (sn, triggered_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alarm_status_time ON alarm_logs (status, triggered_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alarm_type_time ON alarm_logs (type, triggered_at DESC, id DESC);
 
 -- 4. System Config (Key-Value)
 CREATE TABLE IF NOT EXISTS system_config (
@@ -135,12 +184,19 @@ CREATE TABLE IF NOT EXISTS archive_logs (
     file_size BIGINT,                -- 文件大小(字节)
     row_count INT,                   -- 归档行数
     r2_path VARCHAR(512),            -- R2存储路径
-    status VARCHAR(32) DEFAULT 'pending', -- pending, uploaded, deleted, failed
+    status VARCHAR(32) DEFAULT 'pending', -- pending, uploaded, deleted, failed, missing
+    checksum VARCHAR(64),            -- 文件 SHA-256
+    sn_count INT,                    -- 覆盖的设备数
+    time_start TIMESTAMP,            -- 数据起止时间
+    time_end TIMESTAMP,
+    format VARCHAR(16) DEFAULT 'csv', -- csv, parquet
+    kind VARCHAR(16) DEFAULT 'daily', -- daily (定时归档), manual (手动备份)
     created_at TIMESTAMP DEFAULT NOW()
 );
 
--- 添加 archive_date 唯一索引 (支持 ON CONFLICT 语法)
-CREATE UNIQUE INDEX IF NOT EXISTS archive_logs_date_unique ON archive_logs(archive_date);
+-- 每天每种类型一条记录 (支持 ON CONFLICT 语法)
+CREATE UNIQUE INDEX IF NOT EXISTS archive_logs_date_kind_unique ON archive_logs(archive_date, kind);
+CREATE INDEX IF NOT EXISTS idx_archive_logs_path ON archive_logs(r2_path);
 
 -- 6. Operation Logs (操作日志)
 CREATE TABLE IF NOT EXISTS operation_logs (
@@ -191,7 +247,12 @@ CREATE INDEX IF NOT EXISTS idx_ai_summary_time ON ai_summary_logs (created_at DE
 -- 标记初始迁移已应用 (新安装时)
 INSERT INTO schema_migrations (version, description) VALUES 
 (1, '添加 users.permissions 字段用于子账号权限管理'),
-(2, '添加 ai_summary_logs 表存储 AI 总结历史')
+(2, '添加 ai_summary_logs 表存储 AI 总结历史'),
+(3, '添加 alarm_logs.resolved_at 字段用于报警自动恢复'),
+(4, '添加 devices.alarm_rules 字段存储窗口报警规则'),
+(5, 'archive_logs 扩展为归档目录: 校验和、设备数、时间范围、格式及类型'),
+(6, '添加 sensor_data 连续聚合 (1 分钟 / 10 分钟 / 1 小时) 用于历史曲线'),
+(7, '添加 alarm_logs 游标分页索引 (triggered_at, id) 及按 sn / status / type 过滤的复合索引')
 ON CONFLICT DO NOTHING;
 
 -- Create default admin user (placeholder with dummy hash)
@@ -3,16 +3,18 @@ MCS-IOT 报警中心 (Alarm Center)
 
 该文件是系统的核心预警引擎，负责判定异常状况并触发多渠道通知。
 主要功能包括：
-1. 多维阈值判定：支持高浓度、低浓度、低电量、弱信号等多种报警因子的判定。
-2. 报警消抖 (Debounce)：利用 Redis 缓存实现可配置的消抖期，防止同一报警在短时间内重复滋扰。
+1. 多维阈值判定：支持高浓度、低浓度、低电量、弱信号等多种报警因子的判定，以及上升速率、滑动平均、k/n 超限等窗口规则 (rules.py)。
+2. 报警状态机：按 (设备, 报警类型) 维护 NORMAL → ACTIVE → RESOLVED 状态，支持滞回带与持续时间条件，仅在状态转换时写库与通知。
+   报警消抖 (Debounce)：利用 Redis 缓存实现可配置的消抖期，限制同一报警在短时间内重复通知。
 3. 通知窗口控制：支持配置工作时段限制，确保非紧急报警在休息时间不会发送通知。
 4. 多渠道推送：集成了 邮件 (SMTP)、Webhook (钉钉/飞书/企微，支持签名校验) 及 阿里云短信。
-5. 历史存证：所有报警触发（无论是否发送通知）均会记录在数据库的报警日志表中。
+5. 历史存证：所有报警触发（无论是否发送通知）均会记录在数据库的报警日志表中，恢复时更新为 resolved。
 
 结构：
 - AlarmCenter: 核心类，封装了配置读取、判定逻辑及分发逻辑。
-- check_and_alert: 判定入口，根据传感器实时数值对比设备特定阈值。
-- process_alarm: 处理报警生命周期（防抖、时段过滤、记录、通知）。
+- check_and_alert: 判定入口，根据传感器实时数值对比设备特定阈值并驱动状态机。
+- process_alarm / resolve_alarm: 处理报警触发与恢复（记录、防抖、时段过滤、通知）。
+- restore_state: 启动时从报警日志恢复报警中的状态。
 - Notification Handlers: send_email, send_webhook, send_sms 等具体外发逻辑。
 """
 import logging
@@ -29,6 +31,9 @@ from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 from typing import Optional
 
+from alarm_state import AlarmStateMachine, AlarmPolicy, ACTIVATE, RESOLVE
+from rules import RuleEngine
+
 logger = logging.getLogger(__name__)
 
 class AlarmCenter:
@@ -36,6 +41,10 @@ class AlarmCenter:
         self.redis = redis
         self.storage = storage
         self._default_debounce_ttl = 600  # 默认 10 分钟
+        self.states = AlarmStateMachine()
+        self.rules = RuleEngine(redis, storage)
+        self._policy = AlarmPolicy()
+        self._policy_loaded_at = 0.0
 
     async def get_debounce_ttl(self) -> int:
         """从 Redis 获取消抖时间(秒)，如果未配置则使用默认值"""
@@ -49,6 +58,19 @@ class AlarmCenter:
             logger.error(f"Error loading debounce config: {e}")
         return self._default_debounce_ttl
 
+    async def get_alarm_policy(self) -> AlarmPolicy:
+        """获取滞回/持续时间策略 (进程内缓存 30 秒，避免每个样本多一次 Redis 往返)"""
+        now = time.time()
+        if now - self._policy_loaded_at < 30:
+            return self._policy
+        try:
+            cfg = await self.redis.get("config:alarm_general")
+            self._policy = AlarmPolicy.from_config(json.loads(cfg) if cfg else {})
+        except Exception as e:
+            logger.error(f"Error loading alarm policy: {e}")
+        self._policy_loaded_at = now
+        return self._policy
+
     async def get_device_config(self, sn):
         """Get device alarm thresholds from Redis or DB"""
         cache_key = f"device:{sn}"
@@ -159,70 +181,122 @@ class AlarmCenter:
         net_type = network.upper().replace(' ', '')
         return self.SIGNAL_EDGE_THRESHOLDS.get(net_type, self.SIGNAL_EDGE_THRESHOLDS['DEFAULT'])
 
+    def _evaluate(self, sn: str, alarm_type: str, breached: bool, cleared: bool,
+                  policy: AlarmPolicy) -> Optional[str]:
+        return self.states.evaluate(sn, alarm_type, breached, cleared, time.time(), policy)
+
     async def check_and_alert(self, sn: str, ppm: float, temp: float, bat: int = 100, 
-                             rssi: int = None, network: str = None):
-        """Check thresholds and trigger alerts if needed"""
+                             rssi: int = None, network: str = None, humi: float = None):
+        """
+        Check thresholds and drive the per-(sn, type) state machine.
+        只有状态转换 (触发 / 恢复) 时才写库和发送通知。
+        """
         config = await self.get_device_config(sn)
+        policy = await self.get_alarm_policy()
         high_limit = config["high_limit"]
         low_limit = config["low_limit"]
         bat_limit = config.get("bat_limit", 20)
         device_name = config["name"]
 
-        # 检查高浓度报警
-        if ppm > high_limit:
+        # 检查高浓度报警 (恢复条件: 回落到 high_limit - 滞回带 以下)
+        action = self._evaluate(sn, "HIGH", ppm > high_limit,
+                                ppm <= high_limit - policy.band(high_limit), policy)
+        if action == ACTIVATE:
             await self.process_alarm(sn, "HIGH", ppm, high_limit, 
                 f"设备 {device_name} 浓度超标: {ppm:.2f} ppm (阈值: {high_limit:.2f})")
+        elif action == RESOLVE:
+            await self.resolve_alarm(sn, "HIGH", ppm)
         
-        # 检查低浓度报警 (如果配置了)
-        elif low_limit is not None and ppm < low_limit:
+        # 检查低浓度报警 (如果配置了; 取消配置时视为已恢复)
+        if low_limit is not None:
+            low_breached = ppm < low_limit
+            low_cleared = ppm >= low_limit + policy.band(low_limit)
+        else:
+            low_breached, low_cleared = False, True
+        action = self._evaluate(sn, "LOW", low_breached, low_cleared, policy)
+        if action == ACTIVATE:
             await self.process_alarm(sn, "LOW", ppm, low_limit,
                 f"设备 {device_name} 浓度过低: {ppm:.2f} ppm (阈值: {low_limit:.2f})")
+        elif action == RESOLVE:
+            await self.resolve_alarm(sn, "LOW", ppm)
         
         # 检查低电量报警
-        if bat < bat_limit:
+        action = self._evaluate(sn, "LOW_BAT", bat < bat_limit,
+                                bat >= bat_limit + policy.band(bat_limit), policy)
+        if action == ACTIVATE:
             await self.process_alarm(sn, "LOW_BAT", bat, bat_limit,
                 f"设备 {device_name} 电量过低: {bat}% (阈值: {bat_limit}%)")
+        elif action == RESOLVE:
+            await self.resolve_alarm(sn, "LOW_BAT", bat)
         
         # 检查弱信号报警
         if rssi is not None:
             edge_threshold = self.get_signal_edge_threshold(network)
-            if rssi <= edge_threshold:
+            action = self._evaluate(sn, "WEAK_SIGNAL", rssi <= edge_threshold,
+                                    rssi > edge_threshold + policy.band(edge_threshold), policy)
+            if action == ACTIVATE:
                 network_label = network.upper() if network else "未知"
                 await self.process_alarm(sn, "WEAK_SIGNAL", rssi, edge_threshold,
                     f"设备 {device_name} 信号不好: {rssi} dBm ({network_label}, 阈值: {edge_threshold} dBm)")
+            elif action == RESOLVE:
+                await self.resolve_alarm(sn, "WEAK_SIGNAL", rssi)
+
+        # 窗口规则 (上升速率、滑动平均、k/n 超限)，在 Worker 内存中求值
+        results = await self.rules.evaluate(sn, {"ppm": ppm, "temp": temp, "humi": humi})
+        for rule, stat, breached, cleared in results:
+            action = self._evaluate(sn, rule.alarm_type, breached, cleared, policy)
+            if action == ACTIVATE:
+                await self.process_alarm(sn, rule.alarm_type, stat, rule.threshold,
+                    f"设备 {device_name} {rule.describe(stat)}")
+            elif action == RESOLVE:
+                await self.resolve_alarm(sn, rule.alarm_type, stat)
+        for alarm_type in self.rules.pop_retired(sn):
+            await self.resolve_alarm(sn, alarm_type)
 
     async def process_alarm(self, sn: str, alarm_type: str, value: float, 
                            threshold: float, message: str = ""):
         """
-        统一的报警处理接口
-        - 防抖检查
+        统一的报警触发接口 (NORMAL → ACTIVE 转换)
+        - 记录日志 (每次转换写入一行)
+        - 进入 ACTIVE 状态
+        - 防抖检查 (仅限制通知频率)
         - 时段检查
-        - 记录日志
         - 发送通知
         """
-        # 防抖检查
-        debounce_key = f"alarm:debounce:{sn}:{alarm_type}"
-        if await self.redis.exists(debounce_key):
-            logger.debug(f"[{sn}] Alarm {alarm_type} debounced")
+        if self.states.is_active(sn, alarm_type):
+            logger.debug(f"[{sn}] Alarm {alarm_type} already active")
             return False
 
-        # 获取动态消抖时间并设置防抖键
-        debounce_ttl = await self.get_debounce_ttl()
-        await self.redis.setex(debounce_key, debounce_ttl, "1")
-        logger.info(f"[{sn}] Debounce key set with TTL={debounce_ttl}s ({debounce_ttl//60}min)")
-
         # 获取通知配置
         notify_config = await self.get_notification_config()
         time_config = notify_config.get("time_restriction", {})
         
         # 时段检查
         in_window = self.is_in_notification_window(time_config)
+
+        # 防抖检查：同一报警在消抖期内重复触发时只记录不通知
+        debounce_key = f"alarm:debounce:{sn}:{alarm_type}"
+        debounced = bool(await self.redis.exists(debounce_key))
+        should_notify = in_window and not debounced
         
         # 记录到数据库 (始终记录)
-        await self.log_alarm(sn, alarm_type, value, threshold, notified=in_window)
+        alarm_id = await self.log_alarm(sn, alarm_type, value, threshold, notified=should_notify)
+        if alarm_id is None and self.storage.pool:
+            # 写库失败，保持 PENDING 以便下一个样本重试
+            return False
+        self.states.mark_active(sn, alarm_type, alarm_id, time.time())
+        await self.redis.sadd("alarm:active", f"{sn}:{alarm_type}")
+
+        if debounced:
+            logger.info(f"[{sn}] ALARM {alarm_type} recorded but not notified (debounced)")
+            return True
 
         # 只在工作时段发送通知
         if in_window:
+            # 获取动态消抖时间并设置防抖键
+            debounce_ttl = await self.get_debounce_ttl()
+            await self.redis.setex(debounce_key, debounce_ttl, "1")
+
             config = await self.get_device_config(sn)
             device_name = config["name"]
             if not message:
@@ -234,19 +308,74 @@ class AlarmCenter:
 
         return True
 
-    async def log_alarm(self, sn: str, alarm_type: str, value: float, 
-                       threshold: float, notified: bool = True):
-        """Log alarm to database"""
+    async def resolve_alarm(self, sn: str, alarm_type: str, value: float = None):
+        """
+        报警恢复 (ACTIVE → RESOLVED 转换)
+        为该设备该类型所有未恢复的报警记录写入 resolved_at；仅 active 状态改为 resolved，已确认 (ack) 的保留确认状态
+        """
+        if not self.states.is_active(sn, alarm_type):
+            return False
+
         try:
             if self.storage.pool:
                 async with self.storage.pool.acquire() as conn:
                     await conn.execute(
+                        """UPDATE alarm_logs
+                           SET status = CASE WHEN status = 'active' THEN 'resolved' ELSE status END,
+                               resolved_at = NOW()
+                           WHERE sn = $1 AND type = $2 AND resolved_at IS NULL""",
+                        sn, alarm_type
+                    )
+        except Exception as e:
+            logger.error(f"Failed to resolve alarm: {e}")
+            return False
+
+        self.states.mark_resolved(sn, alarm_type)
+        await self.redis.srem("alarm:active", f"{sn}:{alarm_type}")
+        logger.info(f"[{sn}] ALARM {alarm_type} resolved (value={value})")
+        return True
+
+    async def restore_state(self):
+        """
+        启动时从 alarm_logs 恢复报警中的状态，避免重启后重复报警
+        每个 (sn, type) 只取最近一条未恢复的记录
+        """
+        if not self.storage.pool:
+            return
+        try:
+            async with self.storage.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    """SELECT DISTINCT ON (sn, type) id, sn, type
+                       FROM alarm_logs
+                       WHERE resolved_at IS NULL AND status IN ('active', 'ack')
+                       ORDER BY sn, type, triggered_at DESC"""
+                )
+            self.states.clear()
+            now = time.time()
+            for row in rows:
+                self.states.mark_active(row['sn'], row['type'], row['id'], now)
+
+            await self.redis.delete("alarm:active")
+            if rows:
+                await self.redis.sadd("alarm:active", *[f"{r['sn']}:{r['type']}" for r in rows])
+            logger.info(f"Restored {self.states.active_count()} active alarms")
+        except Exception as e:
+            logger.error(f"Failed to restore alarm state: {e}")
+
+    async def log_alarm(self, sn: str, alarm_type: str, value: float, 
+                       threshold: float, notified: bool = True) -> Optional[int]:
+        """Log alarm to database, returns the new alarm id"""
+        try:
+            if self.storage.pool:
+                async with self.storage.pool.acquire() as conn:
+                    return await conn.fetchval(
                         """INSERT INTO alarm_logs (sn, type, value, threshold, notified) 
-                           VALUES ($1, $2, $3, $4, $5)""",
+                           VALUES ($1, $2, $3, $4, $5) RETURNING id""",
                         sn, alarm_type, value, threshold, notified
                     )
         except Exception as e:
             logger.error(f"Failed to log alarm: {e}")
+        return None
 
     async def send_notifications(self, sn: str, device_name: str, alarm_type: str, 
                                 value: float, threshold: float, message: str = ""):
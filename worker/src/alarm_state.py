@@ -0,0 +1,137 @@
+"""
+MCS-IOT 报警状态机 (Alarm State Machine)
+
+该文件为报警中心提供按 "设备 + 报警类型" 维度维护的有状态判定能力，取代逐条样本独立触发的旧模式。
+主要功能包括：
+1. 状态流转：NORMAL → PENDING → ACTIVE → CLEARING → NORMAL，仅在进入 ACTIVE (触发) 与离开 ACTIVE (恢复/RESOLVED) 时产生写库与通知。
+2. 滞回带 (Hysteresis)：触发条件与恢复条件分离，数值在阈值附近振荡时不会反复报警。
+3. 持续时间条件：支持配置触发前需持续超限的最短时间，以及恢复前需持续正常的最短时间。
+4. 紧凑的内存结构：只为非 NORMAL 的 (sn, type) 保留一个带 __slots__ 的小对象，活跃报警计数可直接得到。
+
+结构：
+- AlarmPolicy: 滞回比例及持续时间参数 (来自 config:alarm_general)。
+- AlarmState: 单个 (sn, type) 的状态槽。
+- AlarmStateMachine: 状态表，提供 evaluate 判定入口及 mark_active / mark_resolved 状态确认。
+"""
+from typing import Dict, Optional, Tuple
+
+# 状态常量
+NORMAL = 0
+PENDING = 1     # 已超限，等待满足最短持续时间
+ACTIVE = 2      # 报警中 (alarm_logs 中有对应的未恢复记录)
+CLEARING = 3    # 报警中但数值已回到恢复带内，等待满足恢复持续时间
+
+# evaluate 返回的转换动作
+ACTIVATE = "activate"
+RESOLVE = "resolve"
+
+
+class AlarmPolicy:
+    """滞回与持续时间参数"""
+    __slots__ = ("hysteresis_percent", "min_duration", "clear_duration")
+
+    def __init__(self, hysteresis_percent: float = 5.0, min_duration: int = 0, clear_duration: int = 30):
+        self.hysteresis_percent = max(float(hysteresis_percent), 0.0)
+        self.min_duration = max(int(min_duration), 0)
+        self.clear_duration = max(int(clear_duration), 0)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "AlarmPolicy":
+        return cls(
+            hysteresis_percent=config.get("hysteresis_percent", 5.0),
+            min_duration=config.get("min_duration_seconds", 0),
+            clear_duration=config.get("clear_duration_seconds", 30)
+        )
+
+    def band(self, threshold: float) -> float:
+        """根据阈值计算滞回带宽度"""
+        return abs(threshold) * self.hysteresis_percent / 100.0
+
+
+class AlarmState:
+    """单个 (sn, type) 的状态槽"""
+    __slots__ = ("state", "since", "alarm_id")
+
+    def __init__(self, state: int, since: float, alarm_id: Optional[int] = None):
+        self.state = state
+        self.since = since
+        self.alarm_id = alarm_id
+
+
+class AlarmStateMachine:
+    """
+    报警状态表
+    NORMAL 状态不占用条目，因此表大小只与 "正在超限或报警中" 的 (sn, type) 数量相关。
+    """
+
+    def __init__(self):
+        self._states: Dict[Tuple[str, str], AlarmState] = {}
+        self._active = 0
+
+    def evaluate(self, sn: str, alarm_type: str, breached: bool, cleared: bool,
+                 now: float, policy: AlarmPolicy) -> Optional[str]:
+        """
+        输入一次样本判定结果，返回需要执行的转换动作 (ACTIVATE / RESOLVE / None)
+        - breached: 样本满足触发条件 (如 ppm > high_limit)
+        - cleared: 样本满足恢复条件 (如 ppm <= high_limit - 滞回带)
+        调用方执行写库成功后需调用 mark_active / mark_resolved 确认，失败则下一个样本会再次返回相同动作。
+        """
+        key = (sn, alarm_type)
+        slot = self._states.get(key)
+
+        if slot is None or slot.state == PENDING:
+            if not breached:
+                if slot is not None:
+                    del self._states[key]
+                return None
+            if slot is None:
+                slot = AlarmState(PENDING, now)
+                self._states[key] = slot
+            if now - slot.since >= policy.min_duration:
+                return ACTIVATE
+            return None
+
+        # ACTIVE / CLEARING
+        if not cleared:
+            slot.state = ACTIVE
+            return None
+        if slot.state == ACTIVE:
+            slot.state = CLEARING
+            slot.since = now
+        if now - slot.since >= policy.clear_duration:
+            return RESOLVE
+        return None
+
+    def is_active(self, sn: str, alarm_type: str) -> bool:
+        slot = self._states.get((sn, alarm_type))
+        return slot is not None and slot.state in (ACTIVE, CLEARING)
+
+    def mark_active(self, sn: str, alarm_type: str, alarm_id: Optional[int], now: float):
+        """确认报警已写入 alarm_logs，进入 ACTIVE 状态"""
+        key = (sn, alarm_type)
+        slot = self._states.get(key)
+        if slot is None:
+            self._states[key] = AlarmState(ACTIVE, now, alarm_id)
+            self._active += 1
+        elif slot.state in (NORMAL, PENDING):
+            slot.state = ACTIVE
+            slot.since = now
+            slot.alarm_id = alarm_id
+            self._active += 1
+
+    def mark_resolved(self, sn: str, alarm_type: str) -> Optional[int]:
+        """确认报警已恢复，释放状态槽，返回原报警记录 ID"""
+        slot = self._states.pop((sn, alarm_type), None)
+        if slot is None:
+            return None
+        if slot.state in (ACTIVE, CLEARING):
+            self._active -= 1
+        return slot.alarm_id
+
+    def active_count(self) -> int:
+        """当前报警中的 (sn, type) 数量"""
+        return self._active
+
+    def clear(self):
+        self._states.clear()
+        self._active = 0
@@ -4,27 +4,159 @@ MCS-IOT 数据归档与生命周期管理 (Data Archiving & Lifecycle)
 该文件负责时序数据的长期备份及本地数据库的自动清理，确保系统在高并发写入下存储空间的稳定。
 主要功能包括：
 1. 实现“本地-云端”二级存储架构：本地只保留近 N 天数据，历史数据自动归档至 Cloudflare R2 等兼容 S3 的云存储。
-2. 自动化归档流程：定期将指定日期的传感器数据导出为压缩的 CSV 文件并上传校验。
-3. 本地存储释放：在确认云端归档成功后，自动从 PostgreSQL/TimescaleDB 中清除过期数据。
-4. 云端生命周期管理：自动清理 R2 中超过保留期限的备份文件。
-5. 存储审计：提供本地数据库及云存储占用情况的统计 API。
+2. 自动化归档流程：定期将指定日期的传感器数据以流式方式导出 (COPY TO STDOUT → 增量 gzip → 分片上传/本地文件)，内存占用与行数无关；可选列式 Parquet 格式 (见 parquet_export.py)。
+3. 本地存储释放：通过 TimescaleDB 分块删除 (drop_chunks) 清除过期数据，截止时间落在分块中间时按边界策略处理；启用归档时截止时间不超过最早一个未归档的日期，未确认归档的数据不会被删除。
+4. 云端生命周期管理：按归档目录选取并清理 R2 中超过保留期限的备份文件 (不列举存储桶)。
+5. 归档目录：每个归档文件的大小、行数、SHA-256、设备数及时间范围在写入时记录到 archive_logs，存储统计及文件列表直接读取该表；桶列举仅用于定期对账 (reconcile_catalog)。
+6. 归档任务队列：后端的手动备份等操作通过 Redis 队列 (archive:jobs) 交由 Worker 执行，复用同一套流式导出逻辑。
+7. 补归档 (backfill)：对比 archive_logs 与 sensor_data 中实际存在数据的日期，以有限并发逐日补齐漏归档的日期 (Worker 停机、上传失败等)。
 
 结构：
+- GzipStream: 流式压缩，输出到对象存储的上传句柄 (见 object_store.py，云存储及本地目录均为异步接口)。
+- HashingSink: 写入时计算 SHA-256 的上传句柄包装。
+- ArchiveCoverage / CsvCoverageTap: 导出时累计归档目录信息 (设备数、首末时间)。
 - Archiver: 核心管理类，包含配置迁移、S3 交互及归档任务流。
 - run_daily_archive: 每日任务的总控函数。
 - archive_day / cleanup_old_data: 原子化的备份与清理操作。
+- find_missing_days / backfill: 漏归档日期的检测与并行补归档。
+- reconcile_catalog: 归档目录与云存储桶的对账。
+- run_job_consumer: 归档任务队列的消费循环。
 """
 import asyncio
-import gzip
-import csv
-import io
+import hashlib
+import json
 import os
 import logging
-from datetime import datetime, timedelta, date
+import zlib
+from datetime import datetime, timedelta, date, time
 from typing import Optional, Dict, Any, List
 
+from object_store import PART_SIZE, LocalObjectStore, create_object_store
+from storage_stats import format_size
+
 logger = logging.getLogger(__name__)
 
+# 归档任务队列 (后端写入，Worker 消费) 及结果键前缀
+ARCHIVE_JOB_QUEUE = "archive:jobs"
+ARCHIVE_RESULT_PREFIX = "archive:result:"
+ARCHIVE_RESULT_TTL = 600
+
+LOCAL_ARCHIVE_DIR = "/tmp/mcs_archive"
+# 补归档时同时导出的天数 (每天占用一个数据库连接及一路分片上传)
+BACKFILL_CONCURRENCY = 3
+ARCHIVE_COLUMNS = "time, sn, v_raw, ppm, temp, humi, bat, rssi, seq"
+# 归档文件名: sensor_data_YYYYMMDD[_manual].csv.gz / .parquet
+ARCHIVE_FILE_PATTERN = r"sensor_data_(\d{8})(_manual)?\.(csv\.gz|parquet)$"
+
+
+class GzipStream:
+    """增量 gzip 压缩，压缩结果直接写入下游 sink"""
+    
+    def __init__(self, sink, level: int = 6):
+        self.sink = sink
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+        self.raw_bytes = 0
+    
+    async def write(self, data: bytes):
+        self.raw_bytes += len(data)
+        compressed = self._compressor.compress(data)
+        if compressed:
+            await self.sink.write(compressed)
+    
+    async def finish(self):
+        """写出压缩尾部，不关闭下游 sink"""
+        await self.sink.write(self._compressor.flush())
+    
+    async def close(self) -> int:
+        await self.finish()
+        return await self.sink.close()
+    
+    async def abort(self):
+        await self.sink.abort()
+
+
+class HashingSink:
+    """在写入下游 sink 的同时计算 SHA-256"""
+    
+    def __init__(self, sink):
+        self.sink = sink
+        self._hash = hashlib.sha256()
+    
+    @property
+    def checksum(self) -> str:
+        return self._hash.hexdigest()
+    
+    async def write(self, data: bytes):
+        self._hash.update(data)
+        await self.sink.write(data)
+    
+    async def close(self) -> int:
+        return await self.sink.close()
+    
+    async def abort(self):
+        await self.sink.abort()
+
+
+class ArchiveCoverage:
+    """归档目录信息 (设备数、首末时间)，在流式导出时逐批累计，不再单独扫描当日数据"""
+    
+    def __init__(self):
+        self.sns = set()
+        self.time_start = None
+        self.time_end = None
+    
+    @property
+    def sn_count(self) -> int:
+        return len(self.sns)
+    
+    def update(self, sns, time_start: datetime, time_end: datetime):
+        self.sns.update(sns)
+        if self.time_start is None or time_start < self.time_start:
+            self.time_start = time_start
+        if self.time_end is None or time_end > self.time_end:
+            self.time_end = time_end
+
+
+class CsvCoverageTap:
+    """
+    解析 COPY 输出的 CSV 行 (前两列为 time, sn，按 time 排序) 累计目录信息，数据原样写入下游
+    行可能跨越 COPY 数据块，未结束的行保留到下一块
+    """
+    
+    def __init__(self, stream, coverage: ArchiveCoverage):
+        self.stream = stream
+        self.coverage = coverage
+        self._pending = b""
+        self._header = True
+        self._sns = set()
+        self._first = None
+        self._last = None
+    
+    async def write(self, data: bytes):
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        if self._header and lines:
+            lines = lines[1:]
+            self._header = False
+        for line in lines:
+            if not line:
+                continue
+            time_text, sn, _ = line.split(b",", 2)
+            if self._first is None:
+                self._first = time_text
+            self._last = time_text
+            self._sns.add(sn)
+        await self.stream.write(data)
+    
+    def finish(self):
+        if self._first is None:
+            return
+        self.coverage.update(
+            (sn.strip(b'"').decode() for sn in self._sns),
+            datetime.fromisoformat(self._first.decode()),
+            datetime.fromisoformat(self._last.decode())
+        )
+
 
 class Archiver:
     """数据归档器"""
@@ -33,12 +165,11 @@ class Archiver:
         self.db_pool = db_pool
         self.redis = redis
         self.config = None
-        self._s3_client = None
+        self._store = None
     
     async def load_config(self):
         """加载归档配置（自动迁移旧版配置）"""
         try:
-            import json
             import re
             config_str = await self.redis.get("config:archive")
             if config_str:
@@ -57,7 +188,7 @@ class Archiver:
                     # 保存迁移后的配置
                     await self.redis.set("config:archive", json.dumps(self.config))
                 
-                # 兼容新版统一字段格式：将新版字段映射到旧版字段（供 _get_s3_client 使用）
+                # 兼容新版统一字段格式：将新版字段映射到旧版字段（供 create_object_store 使用）
                 # 新版字段: account_id, bucket, access_key, secret_key, cloud_retention_days
                 # 旧版字段: r2_account_id, r2_bucket, r2_access_key, r2_secret_key, r2_retention_days
                 if self.config.get("account_id") and not self.config.get("r2_account_id"):
@@ -87,49 +218,25 @@ class Archiver:
             logger.error(f"Failed to load archive config: {e}")
             self.config = {"enabled": False}
     
-    def _get_s3_client(self):
-        """获取 S3 客户端 (缓存)"""
-        if self._s3_client:
-            return self._s3_client
-        
-        try:
-            import boto3
-            from botocore.config import Config as BotoConfig
-            # 根据 account_id 构建 endpoint URL
-            account_id = self.config.get('r2_account_id', '').strip()
-            if not account_id:
-                logger.warning("R2 account_id not configured")
-                return None
-            
-            endpoint = f"https://{account_id}.r2.cloudflarestorage.com"
-            
-            self._s3_client = boto3.client(
-                's3',
-                endpoint_url=endpoint,
-                aws_access_key_id=self.config['r2_access_key'],
-                aws_secret_access_key=self.config['r2_secret_key'],
-                config=BotoConfig(
-                    signature_version='s3v4',
-                    retries={'max_attempts': 3, 'mode': 'standard'}
-                ),
-                region_name='auto'  # Required for Cloudflare R2
-            )
-            return self._s3_client
-        except ImportError:
-            logger.warning("boto3 not installed")
-            return None
-        except Exception as e:
-            logger.error(f"Failed to create S3 client: {e}")
-            return None
+    def _get_store(self):
+        """获取云存储实例 (缓存)，未配置云存储时返回 None"""
+        if self._store is None:
+            self._store = create_object_store(self.config or {})
+        return self._store
+    
+    def _cloud_configured(self) -> bool:
+        """是否配置了云存储"""
+        return self._get_store() is not None
     
     async def run_daily_archive(self) -> Dict[str, Any]:
         """
         每日归档任务 (在 00:00 执行)
-        1. 备份 local_retention_days 天前的数据到 R2
-        2. 删除数据库中超过 local_retention_days 天的数据
+        1. 备份 local_retention_days 天前的数据到 R2，同时补齐更早的漏归档日期
+        2. 删除数据库中超过 local_retention_days 天且已确认归档的数据
         3. 清理 R2 中超过 r2_retention_days 天的备份
         """
         await self.load_config()
+        self._store = None
         
         result = {
             "timestamp": datetime.now().isoformat(),
@@ -146,20 +253,20 @@ class Archiver:
         local_retention = self.config.get("local_retention_days", 3)
         r2_retention = self.config.get("r2_retention_days", 30)
         
-        # Step 1: 备份 local_retention 天前的数据
+        # Step 1: 归档 local_retention 天前的数据，并补齐之前漏归档的日期
         target_date = (datetime.now() - timedelta(days=local_retention)).date()
-        archive_result = await self.archive_day(target_date)
+        archive_result = await self.backfill(until=target_date)
         result["archive_result"] = archive_result
         
-        # Step 2: 如果备份成功，删除所有超过 local_retention 天的数据
-        if archive_result.get("status") in ["success", "empty"]:
-            cleanup_result = await self.cleanup_old_data(local_retention)
+        # Step 2: 删除超过 local_retention 天的数据 (截止时间不超过最早的未归档日期)
+        if archive_result.get("status") in ["success", "partial", "empty"]:
+            cleanup_result = await self.cleanup_old_data(local_retention, require_archived=True)
             result["cleanup_result"] = cleanup_result
         else:
             result["cleanup_result"] = {"status": "skipped", "message": "备份未成功，跳过清理"}
         
         # Step 3: 清理 R2 中过期的备份
-        if self.config.get("r2_account_id"):
+        if self._cloud_configured():
             r2_cleanup = await self.cleanup_r2_old_backups(r2_retention)
             result["r2_cleanup_result"] = r2_cleanup
         
@@ -167,14 +274,64 @@ class Archiver:
         logger.info(f"Daily archive completed: {result}")
         return result
     
-    async def archive_day(self, target_date: date) -> Dict[str, Any]:
+    def _archive_format(self) -> str:
+        """归档文件格式: csv (CSV.GZ，默认) / parquet (需要 pyarrow)"""
+        fmt = (self.config or {}).get("archive_format", "csv")
+        if fmt == "parquet":
+            from parquet_export import PYARROW_AVAILABLE
+            if not PYARROW_AVAILABLE:
+                logger.warning("pyarrow not installed, falling back to CSV.GZ archive")
+                return "csv"
+        return fmt if fmt == "parquet" else "csv"
+    
+    async def _export_csv(self, conn, start: datetime, end: datetime, sink, coverage: ArchiveCoverage) -> int:
+        """COPY ... TO STDOUT → 增量 gzip → sink，返回行数"""
+        stream = GzipStream(sink)
+        tap = CsvCoverageTap(stream, coverage)
+        status = await conn.copy_from_query(
+            f"""
+            SELECT {ARCHIVE_COLUMNS}
+            FROM sensor_data
+            WHERE time >= $1 AND time < $2
+            ORDER BY time
+            """,
+            start, end,
+            output=tap.write,
+            format='csv',
+            header=True
+        )
+        tap.finish()
+        await stream.finish()
+        return int(status.split()[-1])
+    
+    async def _export_parquet(self, conn, start: datetime, end: datetime, sink, coverage: ArchiveCoverage) -> int:
+        """服务端游标 → 本地临时 Parquet 文件 → 按块写入 sink，返回行数"""
+        import tempfile
+        from parquet_export import export_parquet
+        
+        fd, tmp_path = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+        try:
+            row_count = await export_parquet(conn, start, end, tmp_path, coverage)
+            with open(tmp_path, 'rb') as f:
+                while True:
+                    block = f.read(PART_SIZE)
+                    if not block:
+                        break
+                    await sink.write(block)
+            return row_count
+        finally:
+            os.remove(tmp_path)
+    
+    async def archive_day(self, target_date: date, manual: bool = False) -> Dict[str, Any]:
         """
-        归档指定日期的数据到 R2
-        1. 查询数据
-        2. 导出为 CSV.GZ
-        3. 上传到 R2
-        4. 验证上传
-        5. 记录归档日志
+        归档指定日期的数据到云存储 (未配置云存储时保存到本地)
+        1. 按时间范围流式读取数据 (可命中分块裁剪)
+           - csv: COPY ... TO STDOUT，增量 gzip 压缩
+           - parquet: 服务端游标，按 (sn, time) 排序，按设备划分行组
+        2. 分片上传到云存储 / 写入本地文件，同时计算 SHA-256
+        3. 验证上传
+        4. 写入归档目录 archive_logs (手动备份以 kind = 'manual' 单独记录，不覆盖当日的定时归档)
         """
         result = {
             "date": str(target_date),
@@ -183,125 +340,283 @@ class Archiver:
             "file_size": 0
         }
         
+        start = datetime.combine(target_date, time.min)
+        end = start + timedelta(days=1)
+        fmt = self._archive_format()
+        suffix = "_manual" if manual else ""
+        ext = "parquet" if fmt == "parquet" else "csv.gz"
+        content_type = 'application/vnd.apache.parquet' if fmt == "parquet" else 'application/gzip'
+        file_name = f"sensor_data_{target_date.strftime('%Y%m%d')}{suffix}.{ext}"
+        r2_path = f"archive/{target_date.year}/{target_date.month:02d}/{file_name}"
+        result["format"] = fmt
+        sink = None
+        
         try:
-            # Step 1: 查询数据
             async with self.db_pool.acquire() as conn:
-                rows = await conn.fetch("""
-                    SELECT time, sn, v_raw, ppm, temp, humi, bat, rssi, seq
-                    FROM sensor_data
-                    WHERE time::date = $1
-                    ORDER BY time
-                """, target_date)
-            
-            if not rows:
-                result["status"] = "empty"
-                result["message"] = f"No data for {target_date}"
-                logger.info(f"No data to archive for {target_date}")
-                return result
-            
-            result["row_count"] = len(rows)
-            
-            # Step 2: 生成 CSV
-            csv_buffer = io.StringIO()
-            writer = csv.writer(csv_buffer)
-            writer.writerow(["time", "sn", "v_raw", "ppm", "temp", "humi", "bat", "rssi", "seq"])
-            
-            for row in rows:
-                writer.writerow([
-                    row['time'].isoformat(),
-                    row['sn'],
-                    row['v_raw'],
-                    row['ppm'],
-                    row['temp'],
-                    row['humi'],
-                    row['bat'],
-                    row['rssi'],
-                    row['seq']
-                ])
-            
-            # 压缩
-            csv_content = csv_buffer.getvalue().encode('utf-8')
-            gzipped = gzip.compress(csv_content)
-            result["file_size"] = len(gzipped)
-            
-            # Step 3: 上传到 R2
-            file_name = f"sensor_data_{target_date.strftime('%Y%m%d')}.csv.gz"
-            r2_path = f"archive/{target_date.year}/{target_date.month:02d}/{file_name}"
-            
-            if self.config.get("r2_account_id"):
-                upload_success = await self._upload_to_r2(gzipped, r2_path)
-                if not upload_success:
-                    result["status"] = "upload_failed"
-                    result["message"] = "上传 R2 失败"
+                has_data = await conn.fetchval(
+                    "SELECT EXISTS (SELECT 1 FROM sensor_data WHERE time >= $1 AND time < $2)",
+                    start, end
+                )
+                if not has_data:
+                    result["status"] = "empty"
+                    result["message"] = f"No data for {target_date}"
+                    logger.info(f"No data to archive for {target_date}")
                     return result
+
+                
+                # Step 1-2: 流式导出 → 输出目标 (云存储分片并行上传 / 本地目录)
+                store = self._get_store()
+                use_cloud = store is not None
+                if not use_cloud:
+                    store = LocalObjectStore(LOCAL_ARCHIVE_DIR)
+                sink = HashingSink(await store.open_upload(r2_path, content_type))
+                if not use_cloud:
+                    r2_path = store.path_for(r2_path)
                 
-                # Step 4: 验证上传
-                verify_success = await self._verify_r2_upload(r2_path, len(gzipped))
+                # 目录信息 (设备数、首末时间) 在导出过程中累计
+                coverage = ArchiveCoverage()
+                if fmt == "parquet":
+                    result["row_count"] = await self._export_parquet(conn, start, end, sink, coverage)
+                else:
+                    result["row_count"] = await self._export_csv(conn, start, end, sink, coverage)
+            
+            result["file_size"] = await sink.close()
+            result["checksum"] = sink.checksum
+            sink = None
+            
+            # Step 3: 验证上传
+            if use_cloud:
+                verify_success = await self._verify_r2_upload(r2_path, result["file_size"])
                 if not verify_success:
                     result["status"] = "verify_failed"
                     result["message"] = "R2 上传验证失败"
                     return result
-            else:
-                # 没有配置 R2，保存到本地
-                local_path = f"/tmp/mcs_archive/{r2_path}"
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                with open(local_path, 'wb') as f:
-                    f.write(gzipped)
-                r2_path = local_path
             
-            # Step 5: 记录归档日志
+            # Step 4: 写入归档目录
             async with self.db_pool.acquire() as conn:
                 await conn.execute("""
-                    INSERT INTO archive_logs (archive_date, file_name, file_size, row_count, r2_path, status)
-                    VALUES ($1, $2, $3, $4, $5, 'uploaded')
-                    ON CONFLICT (archive_date) DO UPDATE SET 
+                    INSERT INTO archive_logs (archive_date, file_name, file_size, row_count, r2_path, status,
+                                              checksum, sn_count, time_start, time_end, format, kind, created_at)
+                    VALUES ($1, $2, $3, $4, $5, 'uploaded', $6, $7, $8, $9, $10, $11, NOW())
+                    ON CONFLICT (archive_date, kind) DO UPDATE SET 
                         file_name = EXCLUDED.file_name,
                         file_size = EXCLUDED.file_size,
                         row_count = EXCLUDED.row_count,
                         r2_path = EXCLUDED.r2_path,
-                        status = EXCLUDED.status
-                """, target_date, file_name, result["file_size"], result["row_count"], r2_path)
+                        status = EXCLUDED.status,
+                        checksum = EXCLUDED.checksum,
+                        sn_count = EXCLUDED.sn_count,
+                        time_start = EXCLUDED.time_start,
+                        time_end = EXCLUDED.time_end,
+                        format = EXCLUDED.format,
+                        created_at = EXCLUDED.created_at
+                """, target_date, file_name, result["file_size"], result["row_count"], r2_path,
+                    result["checksum"], coverage.sn_count, coverage.time_start, coverage.time_end,
+                    fmt, "manual" if manual else "daily")
             
             result["status"] = "success"
             result["r2_path"] = r2_path
-            logger.info(f"Archive completed for {target_date}: {result['row_count']} rows, {result['file_size']} bytes")
+            logger.info(f"Archive completed for {target_date} ({fmt}): {result['row_count']} rows, {result['file_size']} bytes")
             
         except Exception as e:
+            if sink:
+                await sink.abort()
             result["status"] = "error"
             result["message"] = str(e)
             logger.error(f"Archive failed for {target_date}: {e}")
         
         return result
     
-    async def cleanup_old_data(self, retention_days: int) -> Dict[str, Any]:
-        """删除数据库中超过保留期限的传感器数据"""
-        result = {"status": "pending", "deleted_rows": 0}
+    async def find_missing_days(self, until: date) -> List[date]:
+        """
+        找出 until (含) 之前在 sensor_data 中有数据、但 archive_logs 中没有成功归档记录的日期
+        - 候选日期由分块时间范围推出 (分块元数据，不扫描数据)
+        - 每个候选日期再用 EXISTS 确认确有数据 (按时间范围可裁剪到单个分块)
+        """
+        end = datetime.combine(until + timedelta(days=1), time.min)
+        async with self.db_pool.acquire() as conn:
+            chunks = await conn.fetch("""
+                SELECT range_start, range_end
+                FROM timescaledb_information.chunks
+                WHERE hypertable_name = 'sensor_data' AND range_start < $1
+                ORDER BY range_start
+            """, end)
+            archived = {
+                r['archive_date'] for r in await conn.fetch(
+                    """SELECT archive_date FROM archive_logs
+                       WHERE status = 'uploaded' AND kind = 'daily' AND archive_date <= $1""",
+                    until
+                )
+            }
+            
+            candidates = set()
+            for chunk in chunks:
+                day = chunk['range_start'].date()
+                while datetime.combine(day, time.min) < min(chunk['range_end'], end):
+                    candidates.add(day)
+                    day += timedelta(days=1)
+            
+            missing = []
+            for day in sorted(candidates - archived):
+                start = datetime.combine(day, time.min)
+                has_data = await conn.fetchval(
+                    "SELECT EXISTS (SELECT 1 FROM sensor_data WHERE time >= $1 AND time < $2)",
+                    start, start + timedelta(days=1)
+                )
+                if has_data:
+                    missing.append(day)
+        return missing
+    
+    async def backfill(self, until: date = None, concurrency: int = BACKFILL_CONCURRENCY) -> Dict[str, Any]:
+        """
+        补归档 until (含，默认为本地保留期之外的最后一天) 之前所有漏归档的日期
+        每天一个独立的流式导出任务，最多 concurrency 天同时进行
+        """
+        if until is None:
+            local_retention = (self.config or {}).get("local_retention_days", 3)
+            until = (datetime.now() - timedelta(days=local_retention)).date()
+        
+        result = {"until": str(until), "status": "pending", "days": [], "archived": 0, "failed": 0}
+        try:
+            missing = await self.find_missing_days(until)
+        except Exception as e:
+            result["status"] = "error"
+            result["message"] = str(e)
+            logger.error(f"Backfill scan failed: {e}")
+            return result
+        
+        if not missing:
+            result["status"] = "empty"
+            result["message"] = f"{until} 之前没有漏归档的日期"
+            return result
+        
+        logger.info(f"Backfill: {len(missing)} day(s) to archive ({missing[0]} ~ {missing[-1]})")
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def archive(day: date):
+            async with semaphore:
+                return await self.archive_day(day)
+        
+        day_results = await asyncio.gather(*(archive(d) for d in missing))
+        for day_result in day_results:
+            if day_result["status"] == "success":
+                result["archived"] += 1
+            elif day_result["status"] != "empty":
+                result["failed"] += 1
+        
+        result["days"] = [{k: r.get(k) for k in ("date", "status", "row_count", "file_size", "message") if r.get(k) is not None}
+                          for r in day_results]
+        if result["failed"] == 0:
+            result["status"] = "success"
+        elif result["archived"] > 0:
+            result["status"] = "partial"
+        else:
+            result["status"] = "error"
+            result["message"] = "所有日期均归档失败"
+        logger.info(f"Backfill finished: {result['archived']} archived, {result['failed']} failed")
+        return result
+    
+    async def _archived_cutoff(self, cutoff: datetime) -> datetime:
+        """将删除截止时间限制在最早的未归档日期之前，保证只删除已确认归档的数据"""
+        missing = await self.find_missing_days((cutoff - timedelta(days=1)).date())
+        if missing:
+            capped = datetime.combine(missing[0], time.min)
+            logger.warning(f"Retention capped at {capped.date()}: {len(missing)} day(s) not archived yet")
+            return capped
+        return cutoff
+    
+    async def _estimate_chunk_rows(self, conn, cutoff: datetime) -> List[Any]:
+        """
+        列出起始时间早于 cutoff 的分块及其估算行数 (来自统计信息，不扫描数据)
+        - 已压缩分块: 压缩元数据中的压缩前行数
+        - 未压缩分块: pg_class.reltuples
+        """
+        try:
+            return await conn.fetch("""
+                SELECT c.chunk_schema, c.chunk_name, c.range_start, c.range_end, c.is_compressed,
+                       COALESCE(ccs.numrows_pre_compression, GREATEST(cl.reltuples, 0)::bigint) AS est_rows
+                FROM timescaledb_information.chunks c
+                JOIN pg_class cl ON cl.oid = format('%I.%I', c.chunk_schema, c.chunk_name)::regclass
+                LEFT JOIN _timescaledb_catalog.chunk ch
+                       ON ch.schema_name = c.chunk_schema AND ch.table_name = c.chunk_name
+                LEFT JOIN _timescaledb_catalog.compression_chunk_size ccs ON ccs.chunk_id = ch.id
+                WHERE c.hypertable_name = 'sensor_data' AND c.range_start < $1
+                ORDER BY c.range_start
+            """, cutoff)
+        except Exception as e:
+            # 内部目录结构随 TimescaleDB 版本变化，不可用时退回 reltuples
+            logger.warning(f"Compression catalog unavailable, falling back to reltuples: {e}")
+            return await conn.fetch("""
+                SELECT c.chunk_schema, c.chunk_name, c.range_start, c.range_end, c.is_compressed,
+                       GREATEST(cl.reltuples, 0)::bigint AS est_rows
+                FROM timescaledb_information.chunks c
+                JOIN pg_class cl ON cl.oid = format('%I.%I', c.chunk_schema, c.chunk_name)::regclass
+                WHERE c.hypertable_name = 'sensor_data' AND c.range_start < $1
+                ORDER BY c.range_start
+            """, cutoff)
+    
+    async def cleanup_old_data(self, retention_days: int, boundary: str = None,
+                               require_archived: bool = None) -> Dict[str, Any]:
+        """
+        删除数据库中超过保留期限的传感器数据 (按分块整体删除)
+        - 完全早于截止时间的分块通过 drop_chunks 直接删除，耗时与行数无关
+        - 截止时间落在分块中间时，按 boundary 策略处理该边界分块:
+          keep   - 保留整个分块，待其完全过期后再删除 (默认，不产生行级删除)
+          delete - 仅对该分块内早于截止时间的行执行范围 DELETE
+        - require_archived (默认跟随归档开关): 截止时间不超过最早的未归档日期
+        - 删除行数为统计信息估算值
+        """
+        result = {"status": "pending", "deleted_rows": 0, "dropped_chunks": 0}
+        if boundary is None:
+            boundary = (self.config or {}).get("boundary_strategy", "keep")
+        if require_archived is None:
+            require_archived = bool((self.config or {}).get("enabled"))
         
         try:
-            cutoff_date = (datetime.now() - timedelta(days=retention_days)).date()
+            cutoff = datetime.combine((datetime.now() - timedelta(days=retention_days)).date(), time.min)
+            if require_archived:
+                capped = await self._archived_cutoff(cutoff)
+                if capped < cutoff:
+                    result["requested_cutoff_date"] = str(cutoff.date())
+                    cutoff = capped
+            result["cutoff_date"] = str(cutoff.date())
             
             async with self.db_pool.acquire() as conn:
-                # 先统计要删除的行数
-                count = await conn.fetchval("""
-                    SELECT COUNT(*) FROM sensor_data
-                    WHERE time::date < $1
-                """, cutoff_date)
-                
-                if count == 0:
-                    result["status"] = "empty"
-                    result["message"] = "没有需要删除的旧数据"
-                    return result
+                chunks = await self._estimate_chunk_rows(conn, cutoff)
+                full = [c for c in chunks if c['range_end'] <= cutoff]
+                partial = [c for c in chunks if c['range_end'] > cutoff]
                 
-                # 删除旧数据
-                deleted = await conn.execute("""
-                    DELETE FROM sensor_data
-                    WHERE time::date < $1
-                """, cutoff_date)
+                if full:
+                    dropped = await conn.fetch(
+                        "SELECT drop_chunks('sensor_data', older_than => $1::timestamp)", cutoff
+                    )
+                    result["dropped_chunks"] = len(dropped)
+                    result["deleted_rows"] = sum(c['est_rows'] for c in full)
                 
-                result["deleted_rows"] = count
-                result["cutoff_date"] = str(cutoff_date)
-                result["status"] = "success"
-                logger.info(f"Cleaned up {count} rows older than {cutoff_date}")
+                for chunk in partial:
+                    info = {"chunk": chunk['chunk_name'], "strategy": boundary,
+                            "range_start": str(chunk['range_start']), "range_end": str(chunk['range_end'])}
+                    if boundary == "delete":
+                        status = await conn.execute(
+                            "DELETE FROM sensor_data WHERE time >= $1 AND time < $2",
+                            chunk['range_start'], cutoff
+                        )
+                        deleted = int(status.split()[-1])
+                        info["deleted_rows"] = deleted
+                        result["deleted_rows"] += deleted
+                    result.setdefault("boundary_chunks", []).append(info)
+            
+            if not full and not result["deleted_rows"]:
+                result["status"] = "empty"
+                result["message"] = "没有需要删除的旧数据"
+                return result
+            
+            # 删除改变了历史数据，使后端的历史曲线缓存整体失效
+            await self.redis.incr("history:version")
+            result["status"] = "success"
+            result["row_count_estimated"] = True
+            logger.info(f"Dropped {result['dropped_chunks']} chunks (~{result['deleted_rows']} rows) "
+                        f"older than {cutoff}, boundary strategy: {boundary}")
                 
         except Exception as e:
             result["status"] = "error"
@@ -311,38 +626,35 @@ class Archiver:
         return result
     
     async def cleanup_r2_old_backups(self, retention_days: int) -> Dict[str, Any]:
-        """清理 R2 中超过保留期限的备份文件"""
+        """清理云存储中超过保留期限的备份文件 (按归档目录选取过期文件并批量删除，不列举存储桶)"""
         result = {"status": "pending", "deleted_files": 0, "deleted_files_list": []}
         
         try:
-            s3 = self._get_s3_client()
-            if not s3:
+            store = self._get_store()
+            if not store:
                 result["status"] = "skipped"
-                result["message"] = "S3 客户端不可用"
+                result["message"] = "云存储不可用"
                 return result
             
-            bucket = self.config['r2_bucket']
-            cutoff_date = datetime.now() - timedelta(days=retention_days)
-            
-            # 列出所有归档文件
-            paginator = s3.get_paginator('list_objects_v2')
-            deleted_count = 0
-            deleted_files = []
-            
-            for page in paginator.paginate(Bucket=bucket, Prefix='archive/'):
-                for obj in page.get('Contents', []):
-                    key = obj['Key']
-                    last_modified = obj['LastModified']
-                    
-                    # 检查文件是否过期
-                    if last_modified.replace(tzinfo=None) < cutoff_date:
-                        s3.delete_object(Bucket=bucket, Key=key)
-                        deleted_count += 1
-                        deleted_files.append(key)
-                        logger.info(f"Deleted old backup: {key}")
+            # 过期文件取自归档目录 (上传时间 created_at 与 NOW() 均为数据库时间，不涉及时区换算)
+            async with self.db_pool.acquire() as conn:
+                expired = [
+                    r['r2_path'] for r in await conn.fetch(
+                        """SELECT r2_path FROM archive_logs
+                           WHERE status = 'uploaded' AND r2_path NOT LIKE '/%'
+                             AND created_at < NOW() - make_interval(days => $1)""",
+                        retention_days
+                    )
+                ]
+            deleted_count = await store.delete_many(expired) if expired else 0
+            if expired:
+                async with self.db_pool.acquire() as conn:
+                    await conn.execute(
+                        "UPDATE archive_logs SET status = 'deleted' WHERE r2_path = ANY($1::text[])", expired
+                    )
             
             result["deleted_files"] = deleted_count
-            result["deleted_files_list"] = deleted_files[:10]  # 只返回前10个
+            result["deleted_files_list"] = expired[:10]  # 只返回前10个
             result["status"] = "success"
             logger.info(f"R2 cleanup completed: deleted {deleted_count} files")
             
@@ -353,39 +665,15 @@ class Archiver:
         
         return result
     
-    async def _upload_to_r2(self, data: bytes, path: str) -> bool:
-        """上传到 Cloudflare R2 (S3 兼容)"""
-        try:
-            s3 = self._get_s3_client()
-            if not s3:
-                return False
-            
-            s3.put_object(
-                Bucket=self.config['r2_bucket'],
-                Key=path,
-                Body=data,
-                ContentType='application/gzip'
-            )
-            
-            logger.info(f"Uploaded to R2: {path}")
-            return True
-        except Exception as e:
-            logger.error(f"R2 upload failed: {e}")
-            return False
-    
     async def _verify_r2_upload(self, path: str, expected_size: int) -> bool:
-        """验证 R2 上传是否成功"""
+        """验证云存储上传是否成功"""
         try:
-            s3 = self._get_s3_client()
-            if not s3:
+            store = self._get_store()
+            if not store:
                 return False
             
-            response = s3.head_object(
-                Bucket=self.config['r2_bucket'],
-                Key=path
-            )
-            
-            actual_size = response.get('ContentLength', 0)
+            info = await store.head(path)
+            actual_size = info['size'] if info else 0
             if actual_size == expected_size:
                 logger.info(f"R2 upload verified: {path} ({actual_size} bytes)")
                 return True
@@ -403,63 +691,165 @@ class Archiver:
             "r2": {"size_bytes": 0, "size_human": "0 B", "file_count": 0}
         }
         
-        # 获取本地数据库大小
+        # 获取本地数据库大小 (超表元数据，行数为估算值)
         try:
-            async with self.db_pool.acquire() as conn:
-                # sensor_data 表大小
-                size_result = await conn.fetchrow("""
-                    SELECT pg_total_relation_size('sensor_data') as size,
-                           (SELECT COUNT(*) FROM sensor_data) as count
-                """)
-                if size_result:
-                    stats["local_db"]["size_bytes"] = size_result['size'] or 0
-                    stats["local_db"]["size_human"] = self._format_size(size_result['size'] or 0)
-                    stats["local_db"]["row_count"] = size_result['count'] or 0
+            from storage_stats import get_storage_stats
+            db_stats = await get_storage_stats(self.db_pool, self.redis)
+            sensor_data = db_stats["sensor_data"]
+            stats["local_db"]["size_bytes"] = sensor_data["total_bytes"]
+            stats["local_db"]["size_human"] = format_size(sensor_data["total_bytes"])
+            stats["local_db"]["row_count"] = sensor_data["row_count"]
         except Exception as e:
             logger.error(f"Failed to get local DB stats: {e}")
             stats["local_db"]["error"] = str(e)
         
-        # 获取 R2 存储大小
-        await self.load_config()
-        if self.config.get("r2_account_id"):
-            try:
-                s3 = self._get_s3_client()
-                if s3:
-                    bucket = self.config['r2_bucket']
-                    total_size = 0
-                    file_count = 0
-                    
-                    paginator = s3.get_paginator('list_objects_v2')
-                    for page in paginator.paginate(Bucket=bucket, Prefix='archive/'):
-                        for obj in page.get('Contents', []):
-                            total_size += obj.get('Size', 0)
-                            file_count += 1
-                    
-                    stats["r2"]["size_bytes"] = total_size
-                    stats["r2"]["size_human"] = self._format_size(total_size)
-                    stats["r2"]["file_count"] = file_count
-            except Exception as e:
-                logger.error(f"Failed to get R2 stats: {e}")
-                stats["r2"]["error"] = str(e)
-        else:
-            stats["r2"]["message"] = "R2 未配置"
+        # 获取云存储大小 (来自归档目录，不列举存储桶)
+        try:
+            async with self.db_pool.acquire() as conn:
+                catalog = await conn.fetchrow("""
+                    SELECT COALESCE(SUM(file_size), 0) AS size, COUNT(*) AS count
+                    FROM archive_logs
+                    WHERE status = 'uploaded' AND r2_path NOT LIKE '/%'
+                """)
+            stats["r2"]["size_bytes"] = catalog['size']
+            stats["r2"]["size_human"] = format_size(catalog['size'])
+            stats["r2"]["file_count"] = catalog['count']
+        except Exception as e:
+            logger.error(f"Failed to get archive catalog stats: {e}")
+            stats["r2"]["error"] = str(e)
         
         return stats
     
-    def _format_size(self, size_bytes: int) -> str:
-        """格式化文件大小"""
-        if size_bytes < 1024:
-            return f"{size_bytes} B"
-        elif size_bytes < 1024 * 1024:
-            return f"{size_bytes / 1024:.2f} KB"
-        elif size_bytes < 1024 * 1024 * 1024:
-            return f"{size_bytes / (1024 * 1024):.2f} MB"
-        else:
-            return f"{size_bytes / (1024 * 1024 * 1024):.2f} GB"
+    async def reconcile_catalog(self) -> Dict[str, Any]:
+        """
+        归档目录与云存储桶对账 (定期执行，日常读取只走 archive_logs)
+        - 目录中存在但桶中缺失的文件: 标记为 missing
+        - 桶中存在但目录中缺失的文件 (如数据库重建): 按文件名补登记，行数等信息未知
+        - 大小不一致: 以桶中为准
+        """
+        import re
+        
+        result = {"status": "pending", "missing": 0, "registered": 0, "resized": 0}
+        store = self._get_store()
+        if not store:
+            result["status"] = "skipped"
+            result["message"] = "云存储不可用"
+            return result
+        
+        try:
+            objects = {obj['key']: obj for obj in await store.list('archive/')}
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, r2_path, file_size FROM archive_logs
+                    WHERE status = 'uploaded' AND r2_path NOT LIKE '/%'
+                """)
+                catalogued = {r['r2_path'] for r in rows}
+                
+                missing = [r['id'] for r in rows if r['r2_path'] not in objects]
+                if missing:
+                    await conn.execute("UPDATE archive_logs SET status = 'missing' WHERE id = ANY($1::int[])", missing)
+                
+                resized = [(r['id'], objects[r['r2_path']]['size']) for r in rows
+                           if r['r2_path'] in objects and objects[r['r2_path']]['size'] != r['file_size']]
+                if resized:
+                    await conn.executemany("UPDATE archive_logs SET file_size = $2 WHERE id = $1", resized)
+                
+                registered = 0
+                for key, obj in objects.items():
+                    if key in catalogued:
+                        continue
+                    file_name = key.split('/')[-1]
+                    match = re.search(ARCHIVE_FILE_PATTERN, file_name)
+                    if not match:
+                        continue
+                    status = await conn.execute("""
+                        INSERT INTO archive_logs (archive_date, file_name, file_size, r2_path, status, format, kind, created_at)
+                        VALUES ($1, $2, $3, $4, 'uploaded', $5, $6, $7)
+                        ON CONFLICT (archive_date, kind) DO UPDATE SET
+                            file_name = EXCLUDED.file_name,
+                            file_size = EXCLUDED.file_size,
+                            r2_path = EXCLUDED.r2_path,
+                            status = EXCLUDED.status,
+                            format = EXCLUDED.format
+                        WHERE archive_logs.status <> 'uploaded'
+                    """, datetime.strptime(match.group(1), "%Y%m%d").date(), file_name, obj['size'], key,
+                        "parquet" if match.group(3) == "parquet" else "csv",
+                        "manual" if match.group(2) else "daily",
+                        # last_modified 为 UTC 时间，转换为本地时间后写入 (与 created_at 的 NOW() 一致)
+                        obj['last_modified'].astimezone().replace(tzinfo=None) if obj['last_modified'] else datetime.now())
+                    registered += int(status.split()[-1])
+            
+            result.update(status="success", missing=len(missing), registered=registered,
+                          resized=len(resized), objects=len(objects))
+            logger.info(f"Archive catalog reconciled: {len(objects)} objects, {len(missing)} missing, "
+                        f"{registered} registered, {len(resized)} resized")
+        except Exception as e:
+            result["status"] = "error"
+            result["message"] = str(e)
+            logger.error(f"Archive catalog reconcile failed: {e}")
+        
+        await self.redis.set("archive:reconcile",
+                             json.dumps({"timestamp": datetime.now().isoformat(), **result}), ex=30 * 86400)
+        return result
+    
+    async def run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """执行一个来自任务队列的归档任务"""
+        await self.load_config()
+        self._store = None
+        job_type = job.get("type")
+        
+        if job_type == "backup":
+            target_date = date.fromisoformat(job["date"]) if job.get("date") else date.today()
+            result = await self.archive_day(target_date, manual=True)
+            result["cloud"] = self._cloud_configured()
+            result["provider"] = self.config.get("provider") or "cloudflare"
+            return result
+        
+        if job_type == "cleanup":
+            return await self.cleanup_old_data(int(job["days"]), job.get("boundary"))
+        
+        if job_type == "backfill":
+            until = date.fromisoformat(job["until"]) if job.get("until") else None
+            return await self.backfill(until, int(job.get("concurrency") or BACKFILL_CONCURRENCY))
+        
+        if job_type == "reconcile":
+            return await self.reconcile_catalog()
+        
+        return {"status": "error", "message": f"Unknown archive job type: {job_type}"}
 
 
-async def run_archive():
-    """运行归档任务 (由 scheduler 调用)"""
+async def run_job_consumer(db_pool, redis):
+    """
+    归档任务队列消费循环
+    任务格式: {"id": "...", "type": "backup" | "cleanup" | "backfill" | "reconcile", ...}，结果写入 archive:result:{id} (列表，供提交方 BLPOP 等待)
+    """
+    archiver = Archiver(db_pool, redis)
+    while True:
+        try:
+            item = await redis.blpop(ARCHIVE_JOB_QUEUE, timeout=5)
+            if not item:
+                continue
+            job = json.loads(item[1])
+            logger.info(f"Archive job received: {job.get('type')} ({job.get('id')})")
+            
+            try:
+                result = await archiver.run_job(job)
+            except Exception as e:
+                logger.error(f"Archive job {job.get('id')} failed: {e}")
+                result = {"status": "error", "message": str(e)}
+            
+            result_key = f"{ARCHIVE_RESULT_PREFIX}{job.get('id')}"
+            await redis.rpush(result_key, json.dumps(result, default=str))
+            await redis.expire(result_key, ARCHIVE_RESULT_TTL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Archive job consumer error: {e}")
+            await asyncio.sleep(5)
+
+
+async def run_archive(mode: str = "daily", until: Optional[date] = None, concurrency: int = BACKFILL_CONCURRENCY):
+    """运行归档任务 (独立运行时使用，调度器直接复用 Worker 的连接池)"""
     import redis.asyncio as aioredis
     import asyncpg
     
@@ -468,11 +858,15 @@ async def run_archive():
     redis = await aioredis.from_url(redis_url, decode_responses=True)
     
     db_dsn = f"postgres://{os.getenv('DB_USER','postgres')}:{os.getenv('DB_PASS','password')}@{os.getenv('DB_HOST','timescaledb')}:5432/{os.getenv('DB_NAME','mcs_iot')}"
-    db_pool = await asyncpg.create_pool(db_dsn)
+    db_pool = await asyncpg.create_pool(db_dsn, max_size=max(10, concurrency + 2))
     
     try:
         archiver = Archiver(db_pool, redis)
-        result = await archiver.run_daily_archive()
+        if mode == "backfill":
+            await archiver.load_config()
+            result = await archiver.backfill(until, concurrency)
+        else:
+            result = await archiver.run_daily_archive()
         logger.info(f"Archive result: {result}")
         return result
     finally:
@@ -481,5 +875,16 @@ async def run_archive():
 
 
 if __name__ == "__main__":
-    # 手动运行测试
-    asyncio.run(run_archive())
+    # 手动运行:
+    #   python archiver.py                                   执行一次每日归档
+    #   python archiver.py backfill [--until YYYY-MM-DD] [--concurrency N]   补归档漏掉的日期
+    import argparse
+    
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="MCS-IOT 数据归档")
+    parser.add_argument("mode", nargs="?", choices=["daily", "backfill"], default="daily")
+    parser.add_argument("--until", type=date.fromisoformat, default=None,
+                        help="补归档截止日期 (含)，默认为本地保留期之外的最后一天")
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(run_archive(args.mode, args.until, args.concurrency))
@@ -0,0 +1,57 @@
+"""
+MCS-IOT 下行命令中继 (Downlink Command Relay)
+
+该文件负责消费后端写入 Redis 的设备下行命令，并通过 Worker 已建立的 MQTT 连接发送给设备。后端进程不再各自持有 MQTT 连接，可以任意扩展副本数量。
+主要功能包括：
+1. 命令队列：后端将命令写入 commands:queue (列表)，多个 Worker 副本通过 BLPOP 竞争消费，每条命令只发送一次。
+2. 过期丢弃：命令携带 expires_at，Worker 停机期间积压的命令 (例如重启) 过期后不再下发。
+3. 结果回传：发送结果写入 commands:result:{id} (列表)，提交方可在短时间内 BLPOP 等待确认。
+
+结构：
+- run_command_consumer: 命令队列的消费循环。
+"""
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 命令队列 (后端写入，Worker 消费) 及结果键前缀，与 backend/src/commands.py 一致
+COMMAND_QUEUE = "commands:queue"
+COMMAND_RESULT_PREFIX = "commands:result:"
+COMMAND_RESULT_TTL = 60
+
+
+async def run_command_consumer(redis, mqtt_client):
+    """
+    下行命令队列消费循环
+    命令格式: {"id": "...", "messages": [{"topic": "mcs/{sn}/cmd", "payload": "..."}], "expires_at": 时间戳}
+    """
+    while True:
+        try:
+            item = await redis.blpop(COMMAND_QUEUE, timeout=5)
+            if not item:
+                continue
+            command = json.loads(item[1])
+            messages = command.get("messages") or []
+
+            if command.get("expires_at") and time.time() > command["expires_at"]:
+                logger.warning(f"Command {command.get('id')} expired, dropped ({len(messages)} messages)")
+                result = {"status": "expired", "sent": 0, "total": len(messages)}
+            elif not mqtt_client.connected:
+                result = {"status": "error", "message": "MQTT not connected", "sent": 0, "total": len(messages)}
+            else:
+                sent = sum(1 for m in messages if mqtt_client.publish(m["topic"], m["payload"]))
+                result = {"status": "success" if sent == len(messages) else "partial",
+                          "sent": sent, "total": len(messages)}
+                logger.info(f"Command {command.get('id')} relayed: {sent}/{len(messages)}")
+
+            result_key = f"{COMMAND_RESULT_PREFIX}{command.get('id')}"
+            await redis.rpush(result_key, json.dumps(result))
+            await redis.expire(result_key, COMMAND_RESULT_TTL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Command consumer error: {e}")
+            await asyncio.sleep(5)
@@ -0,0 +1,109 @@
+"""
+MCS-IOT Cron 表达式解析 (Cron Schedule)
+
+该文件为定时任务调度器提供类 cron 的调度定义，取代按 "每天几点" 手工推算下次时间的方式 (避免月末日期溢出等问题)。
+主要功能包括：
+1. 解析标准 5 段表达式：分 时 日 月 周，支持 *、*/n、a-b、a-b/n 及逗号列表。
+2. 支持常用别名：@hourly、@daily、@weekly、@monthly。
+3. 计算任意时间点之后的下一次触发时间 (本地时间)，日期推进全部基于 timedelta，跨月、跨年安全。
+4. 日与周同时受限时按 cron 惯例取 "或" 关系。
+
+结构：
+- CronSchedule: 解析后的调度对象，提供 next_after 计算下次触发时间。
+"""
+from datetime import datetime, timedelta
+from typing import FrozenSet
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+
+# 各字段取值范围 (分, 时, 日, 月, 周)
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(expr: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in expr.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"Invalid cron step: {expr}")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field out of range: {expr}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """5 段 cron 表达式"""
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        fields = ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expr}")
+
+        parsed = [_parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # cron 中 0 与 7 均表示周日，转换为 Python weekday (周一 = 0)
+        self.weekdays = frozenset((d - 1) % 7 for d in weekdays)
+        self._dom_any = fields[2] == "*"
+        self._dow_any = fields[4] == "*"
+
+    def _day_matches(self, dt: datetime) -> bool:
+        dom = dt.day in self.days
+        dow = dt.weekday() in self.weekdays
+        if self._dom_any and self._dow_any:
+            return True
+        if self._dom_any:
+            return dow
+        if self._dow_any:
+            return dom
+        return dom or dow
+
+    def next_after(self, dt: datetime) -> datetime:
+        """返回严格晚于 dt 的下一次触发时间"""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        # 最坏情况为 "2 月 29 日" 之类的表达式，需要跨越数年
+        for _ in range(20000):
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                later = [h for h in self.hours if h > t.hour]
+                if later:
+                    t = t.replace(hour=min(later), minute=0)
+                else:
+                    t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.minute not in self.minutes:
+                later = [m for m in self.minutes if m > t.minute]
+                if later:
+                    t = t.replace(minute=min(later))
+                else:
+                    t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            return t
+
+        raise ValueError(f"Cron expression never matches: {self.expr}")
+
+    def __repr__(self):
+        return f"CronSchedule({self.expr!r})"
@@ -5,8 +5,8 @@ MCS-IOT 后台工作程序总控 (Worker Main Entry)
 主要功能包括：
 1. 初始化 Redis 连接及持久化存储 (Storage)。
 2. 实例化并配置各核心组件：校准器 (Calibrator)、报警中心 (AlarmCenter)、授权守卫 (LicenseGuard) 等。
-3. 启动定时任务调度器 (Scheduler)，处理数据归档、设备在线检查等周期性逻辑。
-4. 建立 MQTT 连接，并建立同步消息回调与异步逻辑处理 (Processor) 之间的桥梁。
+3. 启动定时任务调度器 (Scheduler)，处理数据归档、设备在线检查等周期性逻辑，并启动归档任务队列消费者。
+4. 建立 MQTT 连接，并建立同步消息回调与异步逻辑处理 (Processor) 之间的桥梁；同时中继后端提交的设备下行命令。
 5. 实现服务的优雅停机 (Graceful Shutdown)，确保资源在退出前正确释放。
 
 结构：
@@ -31,6 +31,8 @@ from processor import Processor
 from alarm import AlarmCenter
 from license import LicenseGuard
 from scheduler import Scheduler
+from archiver import run_job_consumer
+from command_relay import run_command_consumer
 
 # Setup Logging
 logging.basicConfig(
@@ -62,6 +64,7 @@ async def main():
 
     # 4. Initialize Alarm Center
     alarm = AlarmCenter(redis, storage)
+    await alarm.restore_state()
 
     # 5. Initialize License Guard
     license_guard = LicenseGuard(redis)
@@ -76,6 +79,9 @@ async def main():
     await scheduler.start()
     logger.info("Scheduler started")
 
+    # 归档任务队列 (后端手动备份等操作由 Worker 执行)
+    archive_jobs = asyncio.create_task(run_job_consumer(storage.pool, redis))
+
     # 7. Initialize Processor
     processor = Processor(calib, storage, redis, alarm)
 
@@ -99,6 +105,9 @@ async def main():
     mqtt_client = MQTTClient(on_mqtt_message, redis_client=redis)
     mqtt_client.start()
 
+    # 下行命令队列 (后端各副本提交的设备命令经 Worker 的 MQTT 连接发送)
+    command_relay = asyncio.create_task(run_command_consumer(redis, mqtt_client))
+
     # Graceful Shutdown
     stop_event = asyncio.Event()
     
@@ -115,6 +124,8 @@ async def main():
     # Cleanup
     logger.info("Shutting down...")
     await scheduler.stop()
+    archive_jobs.cancel()
+    command_relay.cancel()
     mqtt_client.stop()
     await storage.close()
     await redis.close()
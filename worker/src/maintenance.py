@@ -0,0 +1,211 @@
+"""
+MCS-IOT 数据库维护 (Chunk-aware DB Maintenance)
+
+该文件取代对整张超表执行 VACUUM ANALYZE 的夜间优化，依据 TimescaleDB 元数据只处理真正需要维护的分块 (chunk)。
+主要功能包括：
+1. 统计信息更新：只对最近写入且未压缩的 sensor_data 分块执行 ANALYZE，已压缩的历史分块不会再变化，无需重复扫描。
+2. 压缩进度核查：读取压缩策略 (policy_compression) 的作业状态，记录最近一次运行结果及失败次数。
+3. 补压缩：对超过 compress_after 仍未压缩的分块执行 compress_chunk，并发度受信号量限制，避免与写入争抢 I/O。
+4. 维护报告：每个分块的耗时及作业状态写入 Redis (system:db_maintenance)，供健康检查查看。
+5. 连续聚合首次物化：迁移以 WITH NO DATA 创建的连续聚合由刷新策略只维护最近窗口，此处对历史数据做一次完整刷新，完成后登记到 aggregates:ready 供后端查询路由使用。
+
+结构：
+- run_db_maintenance: 入口函数，由调度器定时调用。
+- _analyze_recent_chunks / _compress_lagging_chunks: 各维护步骤。
+- _compression_job_status: 查询压缩策略作业状态。
+- materialize_continuous_aggregates: 连续聚合的首次完整物化。
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+HYPERTABLE = "sensor_data"
+# 视为 "最近写入" 的分块时间范围 (小时)
+ANALYZE_WINDOW_HOURS = 48
+# 补压缩并发数
+COMPRESS_CONCURRENCY = 2
+# 压缩策略缺失时使用的默认 compress_after
+DEFAULT_COMPRESS_AFTER = "1 day"
+# 维护语句等待锁的上限，避免阻塞写入
+LOCK_TIMEOUT = "5s"
+# 连续聚合 (视图名, 刷新策略的 end_offset)，与后端迁移 #6 及 aggregates.py 一致
+CONTINUOUS_AGGREGATES = (
+    ("sensor_data_1m", "1 minute"),
+    ("sensor_data_10m", "10 minutes"),
+    ("sensor_data_1h", "1 hour"),
+)
+AGGREGATES_READY_KEY = "aggregates:ready"
+
+
+async def _compression_job_status(conn) -> dict:
+    """读取压缩策略作业的配置及运行状态"""
+    row = await conn.fetchrow(
+        """
+        SELECT j.job_id,
+               j.config->>'compress_after' AS compress_after,
+               s.last_run_status,
+               s.last_successful_finish,
+               s.next_start,
+               s.total_failures
+        FROM timescaledb_information.jobs j
+        LEFT JOIN timescaledb_information.job_stats s ON s.job_id = j.job_id
+        WHERE j.proc_name = 'policy_compression' AND j.hypertable_name = $1
+        """,
+        HYPERTABLE
+    )
+    if not row:
+        logger.warning(f"{HYPERTABLE} 未配置压缩策略，使用默认 compress_after = {DEFAULT_COMPRESS_AFTER}")
+        return {"job_id": None, "compress_after": DEFAULT_COMPRESS_AFTER}
+
+    return {
+        "job_id": row['job_id'],
+        "compress_after": row['compress_after'] or DEFAULT_COMPRESS_AFTER,
+        "last_run_status": row['last_run_status'],
+        "last_successful_finish": row['last_successful_finish'].isoformat() if row['last_successful_finish'] else None,
+        "next_start": row['next_start'].isoformat() if row['next_start'] else None,
+        "total_failures": row['total_failures'] or 0,
+    }
+
+
+async def _analyze_recent_chunks(db_pool) -> list:
+    """对最近写入的未压缩分块执行 ANALYZE"""
+    async with db_pool.acquire() as conn:
+        chunks = await conn.fetch(
+            """
+            SELECT chunk_schema, chunk_name
+            FROM timescaledb_information.chunks
+            WHERE hypertable_name = $1
+              AND NOT is_compressed
+              AND range_end > LOCALTIMESTAMP - make_interval(hours => $2)
+            ORDER BY range_start
+            """,
+            HYPERTABLE, ANALYZE_WINDOW_HOURS
+        )
+
+        results = []
+        await conn.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+        for chunk in chunks:
+            name = f'"{chunk["chunk_schema"]}"."{chunk["chunk_name"]}"'
+            started = time.time()
+            try:
+                await conn.execute(f"ANALYZE {name}")
+                status = "ok"
+            except Exception as e:
+                status = f"error: {e}"
+                logger.error(f"ANALYZE {name} 失败: {e}")
+            results.append({"chunk": chunk["chunk_name"], "action": "analyze",
+                            "status": status, "seconds": round(time.time() - started, 3)})
+        await conn.execute("RESET lock_timeout")
+
+        # 元数据表体量很小，直接整表处理
+        for table in ("alarm_logs", "devices"):
+            await conn.execute(f"VACUUM ANALYZE {table}")
+    return results
+
+
+async def _compress_lagging_chunks(db_pool, compress_after: str) -> list:
+    """压缩超过 compress_after 仍未压缩的分块 (压缩策略落后或失败时补齐)"""
+    async with db_pool.acquire() as conn:
+        chunks = await conn.fetch(
+            """
+            SELECT chunk_schema, chunk_name
+            FROM timescaledb_information.chunks
+            WHERE hypertable_name = $1
+              AND NOT is_compressed
+              AND range_end <= LOCALTIMESTAMP - $2::text::interval
+            ORDER BY range_start
+            """,
+            HYPERTABLE, compress_after
+        )
+
+    if not chunks:
+        return []
+    logger.warning(f"发现 {len(chunks)} 个未按策略压缩的分块，开始补压缩")
+
+    semaphore = asyncio.Semaphore(COMPRESS_CONCURRENCY)
+
+    async def compress(chunk):
+        name = f'{chunk["chunk_schema"]}.{chunk["chunk_name"]}'
+        async with semaphore:
+            started = time.time()
+            try:
+                async with db_pool.acquire() as conn:
+                    await conn.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+                    try:
+                        await conn.execute(
+                            "SELECT compress_chunk($1::text::regclass, if_not_compressed => true)", name
+                        )
+                    finally:
+                        await conn.execute("RESET lock_timeout")
+                status = "ok"
+            except Exception as e:
+                status = f"error: {e}"
+                logger.error(f"压缩分块 {name} 失败: {e}")
+            return {"chunk": chunk["chunk_name"], "action": "compress",
+                    "status": status, "seconds": round(time.time() - started, 3)}
+
+    return await asyncio.gather(*(compress(c) for c in chunks))
+
+
+async def run_db_maintenance(db_pool, redis):
+    """执行一次分块级数据库维护，并将报告写入 Redis"""
+    started = time.time()
+
+    async with db_pool.acquire() as conn:
+        job_status = await _compression_job_status(conn)
+
+    if job_status.get("last_run_status") == "Failed":
+        logger.warning(f"压缩策略作业最近一次运行失败 (累计失败 {job_status.get('total_failures')} 次)")
+
+    analyzed = await _analyze_recent_chunks(db_pool)
+    compressed = await _compress_lagging_chunks(db_pool, job_status["compress_after"])
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "duration_seconds": round(time.time() - started, 3),
+        "compression_job": job_status,
+        "analyzed_chunks": len(analyzed),
+        "compressed_chunks": sum(1 for r in compressed if r["status"] == "ok"),
+        "chunks": analyzed + list(compressed),
+    }
+    await redis.set("system:db_maintenance", json.dumps(report), ex=7 * 86400)
+
+    logger.info(
+        f"数据库维护完成: ANALYZE {len(analyzed)} 个分块, 补压缩 {report['compressed_chunks']} 个分块, "
+        f"耗时 {report['duration_seconds']:.1f}s"
+    )
+    return report
+
+
+async def materialize_continuous_aggregates(db_pool, redis) -> list:
+    """对尚未完成首次物化的连续聚合执行一次完整刷新，返回本次物化的视图"""
+    ready = await redis.smembers(AGGREGATES_READY_KEY)
+    async with db_pool.acquire() as conn:
+        existing = {
+            r['view_name'] for r in await conn.fetch(
+                "SELECT view_name FROM timescaledb_information.continuous_aggregates WHERE hypertable_name = $1",
+                HYPERTABLE
+            )
+        }
+        # 视图被删除 (如重建数据库) 时撤销就绪标记，后端回退到原始数据查询
+        stale = [v for v in ready if v not in existing]
+        if stale:
+            await redis.srem(AGGREGATES_READY_KEY, *stale)
+
+        materialized = []
+        for view, end_offset in CONTINUOUS_AGGREGATES:
+            if view in ready or view not in existing:
+                continue
+            started = time.time()
+            # refresh_continuous_aggregate 不能在事务中执行，asyncpg 默认自动提交
+            await conn.execute(
+                f"CALL refresh_continuous_aggregate('{view}', NULL, LOCALTIMESTAMP - INTERVAL '{end_offset}')"
+            )
+            await redis.sadd(AGGREGATES_READY_KEY, view)
+            materialized.append(view)
+            logger.info(f"连续聚合 {view} 首次物化完成，耗时 {time.time() - started:.1f}s")
+    return materialized
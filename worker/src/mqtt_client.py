@@ -100,7 +100,9 @@ class MQTTClient:
         self.client.disconnect()
 
     def publish(self, topic, payload):
+        """发布消息，返回是否已成功进入发送队列"""
         if not self.connected:
             logger.warning("Attempted to publish while disconnected")
-            return
-        self.client.publish(topic, payload)
+            return False
+        result = self.client.publish(topic, payload)
+        return result.rc == mqtt.MQTT_ERR_SUCCESS
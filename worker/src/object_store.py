@@ -0,0 +1,324 @@
+"""
+MCS-IOT 对象存储抽象层 (Async Object Storage)
+
+该文件为归档相关功能提供统一的异步对象存储接口，Worker 与 Backend 各持有一份相同的副本 (两者为独立镜像)。
+主要功能包括：
+1. 非阻塞 I/O：boto3 为同步客户端，所有调用在独立的线程池中执行，分页列举、上传下载不会冻结事件循环。
+2. 并行分片上传：流式写入时最多 UPLOAD_CONCURRENCY 个分片同时上传，内存占用上限为 (并发数 + 1) × 分片大小。
+3. 批量删除：按每批 1000 个键调用 delete_objects，多个批次并发执行。
+4. 多云支持：Cloudflare R2、腾讯云 COS、阿里云 OSS (S3 兼容接口)，兼容新旧两种配置字段。
+5. 本地文件系统实现：未配置云存储或测试时，以本地目录模拟同样的接口。
+
+结构：
+- ObjectStore: 接口定义。
+- S3ObjectStore / S3Upload: 基于 boto3 + 线程池的实现及分片上传句柄。
+- LocalObjectStore / LocalUpload: 本地目录实现。
+- storage_endpoint / create_object_store: 由归档配置构建存储实例。
+"""
+import asyncio
+import functools
+import logging
+import os
+import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 分片大小 (S3 要求除最后一片外不小于 5MB)
+PART_SIZE = 8 * 1024 * 1024
+# 同时上传的分片数
+UPLOAD_CONCURRENCY = 4
+# delete_objects 单次最多 1000 个键
+DELETE_BATCH_SIZE = 1000
+DELETE_CONCURRENCY = 4
+
+# 对象存储专用线程池，避免占满默认线程池影响其他阻塞调用
+MAX_WORKERS = 16
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="object-store")
+
+
+class ObjectStore(ABC):
+    """异步对象存储接口，对象以 dict 描述: {"key", "size", "last_modified"}"""
+
+    @abstractmethod
+    async def open_upload(self, key: str, content_type: str = "application/octet-stream"):
+        """开始流式上传，返回带 write / close / abort 的上传句柄"""
+
+    @abstractmethod
+    async def head(self, key: str) -> Optional[Dict[str, Any]]:
+        """返回对象信息，不存在时返回 None"""
+
+    @abstractmethod
+    async def list(self, prefix: str = "") -> List[Dict[str, Any]]:
+        """列举前缀下的所有对象"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """删除单个对象"""
+
+    @abstractmethod
+    async def delete_many(self, keys: List[str]) -> int:
+        """批量删除，返回成功删除的数量"""
+
+    @abstractmethod
+    async def download(self, key: str, path: str):
+        """下载对象到本地文件"""
+
+    async def presigned_url(self, key: str, expires: int = 3600) -> Optional[str]:
+        return None
+
+
+class S3Upload:
+    """S3 分片上传句柄，缓冲区满一个分片即在后台上传，最多 UPLOAD_CONCURRENCY 个分片同时进行"""
+
+    def __init__(self, store: "S3ObjectStore", key: str, upload_id: str):
+        self.store = store
+        self.key = key
+        self.upload_id = upload_id
+        self.size = 0
+        self._buffer = bytearray()
+        self._parts: Dict[int, str] = {}
+        self._tasks = []
+        self._next_part = 1
+        self._slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def _upload_part(self, part_number: int, body: bytes):
+        try:
+            response = await self.store._call(
+                self.store.client.upload_part, Bucket=self.store.bucket, Key=self.key,
+                UploadId=self.upload_id, PartNumber=part_number, Body=body
+            )
+            self._parts[part_number] = response['ETag']
+        finally:
+            self._slots.release()
+
+    async def _flush(self):
+        await self._slots.acquire()
+        body = bytes(self._buffer)
+        self._buffer.clear()
+        self._tasks.append(asyncio.create_task(self._upload_part(self._next_part, body)))
+        self._next_part += 1
+        # 尽早暴露失败的分片
+        for task in self._tasks:
+            if task.done():
+                task.result()
+
+    async def write(self, data: bytes):
+        self._buffer.extend(data)
+        self.size += len(data)
+        if len(self._buffer) >= PART_SIZE:
+            await self._flush()
+
+    async def close(self) -> int:
+        if self._buffer or not self._tasks:
+            await self._flush()
+        await asyncio.gather(*self._tasks)
+        parts = [{"ETag": etag, "PartNumber": n} for n, etag in sorted(self._parts.items())]
+        await self.store._call(
+            self.store.client.complete_multipart_upload, Bucket=self.store.bucket, Key=self.key,
+            UploadId=self.upload_id, MultipartUpload={"Parts": parts}
+        )
+        return self.size
+
+    async def abort(self):
+        for task in self._tasks:
+            task.cancel()
+        try:
+            await self.store._call(self.store.client.abort_multipart_upload, Bucket=self.store.bucket,
+                                   Key=self.key, UploadId=self.upload_id)
+        except Exception as e:
+            logger.warning(f"Abort multipart upload failed ({self.key}): {e}")
+
+
+class S3ObjectStore(ObjectStore):
+    """S3 兼容对象存储 (boto3 调用在线程池中执行)"""
+
+    def __init__(self, client, bucket: str):
+        self.client = client
+        self.bucket = bucket
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+    async def open_upload(self, key, content_type="application/octet-stream"):
+        response = await self._call(self.client.create_multipart_upload,
+                                    Bucket=self.bucket, Key=key, ContentType=content_type)
+        return S3Upload(self, key, response['UploadId'])
+
+    async def head(self, key):
+        try:
+            response = await self._call(self.client.head_object, Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"key": key, "size": response.get('ContentLength', 0),
+                "last_modified": response.get('LastModified')}
+
+    async def list(self, prefix=""):
+        def list_all():
+            objects = []
+            paginator = self.client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    objects.append({"key": obj['Key'], "size": obj.get('Size', 0),
+                                    "last_modified": obj.get('LastModified')})
+            return objects
+        return await self._call(list_all)
+
+    async def delete(self, key):
+        await self._call(self.client.delete_object, Bucket=self.bucket, Key=key)
+
+    async def delete_many(self, keys):
+        semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+        async def delete_batch(batch):
+            async with semaphore:
+                response = await self._call(
+                    self.client.delete_objects, Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True}
+                )
+            errors = response.get('Errors', [])
+            for err in errors:
+                logger.warning(f"Delete failed: {err.get('Key')} ({err.get('Code')})")
+            return len(batch) - len(errors)
+
+        batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+        return sum(await asyncio.gather(*(delete_batch(b) for b in batches)))
+
+    async def download(self, key, path):
+        await self._call(self.client.download_file, self.bucket, key, path)
+
+    async def presigned_url(self, key, expires=3600):
+        return await self._call(self.client.generate_presigned_url, 'get_object',
+                                Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires)
+
+
+class LocalUpload:
+    """本地文件上传句柄，先写入 .part 临时文件，完成后原子重命名"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._tmp_path = path + ".part"
+        self._file = open(self._tmp_path, 'wb')
+
+    async def write(self, data: bytes):
+        self._file.write(data)
+        self.size += len(data)
+
+    async def close(self) -> int:
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return self.size
+
+    async def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class LocalObjectStore(ObjectStore):
+    """以本地目录模拟对象存储 (未配置云存储时的归档目标，也用于测试)"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def open_upload(self, key, content_type="application/octet-stream"):
+        return LocalUpload(self.path_for(key))
+
+    async def head(self, key):
+        path = self.path_for(key)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return {"key": key, "size": stat.st_size, "last_modified": datetime.fromtimestamp(stat.st_mtime)}
+
+    async def list(self, prefix=""):
+        objects = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".part"):
+                    continue
+                key = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    objects.append(await self.head(key))
+        return objects
+
+    async def delete(self, key):
+        path = self.path_for(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    async def delete_many(self, keys):
+        deleted = 0
+        for key in keys:
+            if os.path.exists(self.path_for(key)):
+                await self.delete(key)
+                deleted += 1
+        return deleted
+
+    async def download(self, key, path):
+        shutil.copyfile(self.path_for(key), path)
+
+
+def storage_endpoint(config: dict) -> tuple:
+    """
+    根据提供商构建 S3 兼容 endpoint
+    返回: (endpoint_url, region_name)，未配置时返回 (None, None)
+    """
+    provider = config.get("provider") or "cloudflare"
+    if provider == "cloudflare":
+        account_id = (config.get("account_id") or config.get("r2_account_id") or "").strip()
+        if not account_id:
+            return None, None
+        return f"https://{account_id}.r2.cloudflarestorage.com", "auto"  # Required for Cloudflare R2
+
+    region = (config.get("region") or "").strip()
+    if not region:
+        return None, None
+    if provider == "tencent":
+        return f"https://cos.{region}.myqcloud.com", region
+    if provider == "alibaba":
+        return f"https://{region}.aliyuncs.com", region
+    logger.warning(f"Unsupported storage provider: {provider}")
+    return None, None
+
+
+def create_object_store(config: dict) -> Optional[S3ObjectStore]:
+    """由归档配置创建云存储实例 (兼容 r2_* 旧字段)，未配置或 boto3 不可用时返回 None"""
+    endpoint, region = storage_endpoint(config)
+    bucket = config.get("bucket") or config.get("r2_bucket")
+    access_key = config.get("access_key") or config.get("r2_access_key")
+    secret_key = config.get("secret_key") or config.get("r2_secret_key")
+    if not endpoint or not bucket or not access_key:
+        return None
+
+    try:
+        import boto3
+        from botocore.config import Config as BotoConfig
+    except ImportError:
+        logger.warning("boto3 not installed")
+        return None
+
+    client = boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=BotoConfig(
+            signature_version='s3v4',
+            max_pool_connections=MAX_WORKERS,
+            retries={'max_attempts': 3, 'mode': 'standard'}
+        ),
+        region_name=region
+    )
+    return S3ObjectStore(client, bucket)
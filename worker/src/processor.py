@@ -4,9 +4,9 @@ MCS-IOT 消息处理器 (Message Processor)
 该文件负责解析来自 MQTT 的原始报文，并驱动业务逻辑。
 主要功能包括：
 1. 路由解析：根据 MQTT Topic (如 mcs/{sn}/up) 区分数据上报及状态上报。
-2. 状态维护：收到任何上报时，更新设备在 Redis 中的在线标记及 TTL。
+2. 状态维护：收到任何上报时，更新设备在 Redis 中的在线标记及 TTL，并刷新最近上报时间索引 (devices:last_seen)。
 3. 数据加工：整合校准算法 (Calibrator)，将原始电压值转为 ppm 浓度值。
-4. 资源同步：将加工后的数据同步持久化到数据库 (Storage) 并缓存实时数据供大屏使用 (Redis Hash)。
+4. 资源同步：将加工后的数据同步持久化到数据库 (Storage) 并缓存实时数据供大屏使用 (Redis Hash)，同时发布到 realtime:updates 频道供后端推送。
 5. 报警触发：完成数据处理后，调起报警中心 (AlarmCenter) 进行阈值判定。
 
 结构：
@@ -17,15 +17,37 @@ MCS-IOT 消息处理器 (Message Processor)
 import json
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
+# 实时数据发布频道 (与后端 realtime.REALTIME_CHANNEL 一致)
+REALTIME_CHANNEL = "realtime:updates"
+
+# 历史桶定型延迟 (与后端 history_cache.FINALIZE_LAG 一致)，乱序到达且早于该秒数的上报视为迟到数据
+HISTORY_FINALIZE_LAG = 60
+
 class Processor:
     def __init__(self, calibrator, storage, redis, alarm=None):
         self.calib = calibrator
         self.storage = storage
         self.redis = redis
         self.alarm = alarm
+        # 每台设备已收到的最新时间戳 (设备时钟)，用于识别乱序到达的迟到数据
+        self._newest_ts = {}
+
+    async def _is_late(self, sn: str, ts: float) -> bool:
+        """
+        是否为迟到数据：早于该设备已收到的最新时间戳 (乱序 / 补传) 且已超过定型延迟
+        与设备自身的时间线比较，时钟整体偏慢的设备按序上报时不会被误判 (后端缓存同样按设备最新时间判断桶是否定型)
+        """
+        newest = self._newest_ts.get(sn)
+        if newest is None:
+            # Worker 重启后首次收到该设备数据，以 Redis 中的最新数据时间为准
+            prev = await self.redis.hget(f"realtime:{sn}", "ts")
+            newest = float(prev) if prev else ts
+        self._newest_ts[sn] = max(newest, ts)
+        return ts < newest and time.time() - ts > HISTORY_FINALIZE_LAG
 
     async def process_message(self, topic, payload_str):
         try:
@@ -54,6 +76,8 @@ class Processor:
         # 1. Update Last Seen in Redis
         # Key: "online:{sn}" -> TTL 90s (设备每10秒上报一次，90秒无数据判定离线)
         await self.redis.setex(f"online:{sn}", 90, "1")
+        # 最近上报时间索引 (ZSET, score = 服务器接收时间)，供调度器增量检测离线设备
+        await self.redis.zadd("devices:last_seen", {sn: time.time()})
         
         # 2. Calculate Concentration
         v_raw = float(data.get('v_raw', 0))
@@ -64,6 +88,9 @@ class Processor:
         
         # 3. Store to DB
         await self.storage.save_sensor_data(sn, data, ppm)
+        # 迟到数据会改变已定型的历史桶，使该设备的历史曲线缓存失效 (见 backend/src/history_cache.py)
+        if await self._is_late(sn, float(data.get('ts') or 0)):
+            await self.redis.incr(f"history:version:{sn}")
         
         # 4. Cache Realtime Data for Dashboard
         # Key: "realtime:{sn}" -> Hash
@@ -77,12 +104,17 @@ class Processor:
             "ts": str(int(data.get('ts', 0)))
         }
         await self.redis.hset(f"realtime:{sn}", mapping=rt_data)
+        # 发布到实时频道，由后端推送中心扇出到所有大屏 (见 backend/src/realtime.py)
+        await self.redis.publish(REALTIME_CHANNEL, json.dumps({"sn": sn, "status": "online", **rt_data}))
         
         # 5. Check Alarm (包含浓度、低电量、弱信号)
         if self.alarm:
+            # 收到上报即恢复离线报警 (仅在报警中时写库)
+            await self.alarm.resolve_alarm(sn, "OFFLINE")
             rssi = int(data.get('rssi', 0)) if data.get('rssi') else None
             network = data.get('net', '')
-            await self.alarm.check_and_alert(sn, ppm, temp, bat, rssi=rssi, network=network)
+            humi = float(data['humi']) if data.get('humi') is not None else None
+            await self.alarm.check_and_alert(sn, ppm, temp, bat, rssi=rssi, network=network, humi=humi)
         
         logger.info(f"[{sn}] v={v_raw:.1f}, ppm={ppm:.2f}, bat={bat}% (Saved)")
 
@@ -0,0 +1,103 @@
+"""
+MCS-IOT 实时数据快照物化 (Materialized Realtime Snapshot)
+
+该文件负责定期将所有设备的实时数据物化为一份序列化好的快照，后端 /api/dashboard/realtime 只需一次 Redis 读取即可返回，并支持 ETag / 304。
+主要功能包括：
+1. 元数据缓存：设备与仪表的 JOIN 结果 (名称、单位、仪表颜色等) 在内存中缓存 METADATA_TTL 秒，不在每次物化时查询数据库。
+2. 管道读取：每台设备的 realtime:{sn}、online:{sn}、position:{sn} 通过一个 Redis 管道批量读取，往返次数与设备数量无关。
+3. 变化检测：快照内容的 SHA-1 作为 ETag，与上次写入相同时不重写，后端据此对未变化的请求返回 304。
+4. 存储格式：快照写入 Redis Hash realtime:snapshot (etag, body, updated_at)，body 为与 DeviceRealtime 响应模型一致的 JSON 数组。
+
+结构：
+- SNAPSHOT_KEY: 快照键名 (与 backend/src/dashboard.py 一致)。
+- RealtimeSnapshot: 快照构建器，由调度器的 realtime_snapshot 任务周期调用 refresh。
+"""
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = "realtime:snapshot"
+# 设备元数据缓存时间 (秒)
+METADATA_TTL = 60
+
+
+def _float(value):
+    return float(value) if value else None
+
+
+def _int(value):
+    return int(float(value)) if value else None
+
+
+class RealtimeSnapshot:
+    """实时数据快照构建器"""
+
+    def __init__(self, db_pool, redis):
+        self.db_pool = db_pool
+        self.redis = redis
+        self._metadata: List[Dict] = []
+        self._metadata_at = 0.0
+        self._etag = None
+
+    async def _get_metadata(self) -> List[Dict]:
+        now = time.time()
+        if not self._metadata_at or now - self._metadata_at >= METADATA_TTL:
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT d.sn, d.name, d.instrument_id, d.unit, d.sensor_type,
+                           i.name as instrument_name, i.color as instrument_color
+                    FROM devices d
+                    LEFT JOIN instruments i ON d.instrument_id = i.id
+                    ORDER BY d.sn
+                """)
+            self._metadata = [dict(row) for row in rows]
+            self._metadata_at = now
+        return self._metadata
+
+    async def refresh(self) -> bool:
+        """重建快照，内容有变化并写入 Redis 时返回 True"""
+        metadata = await self._get_metadata()
+
+        pipe = self.redis.pipeline(transaction=False)
+        for device in metadata:
+            sn = device['sn']
+            pipe.hgetall(f"realtime:{sn}")
+            pipe.exists(f"online:{sn}")
+            pipe.hgetall(f"position:{sn}")
+        results = await pipe.execute() if metadata else []
+
+        devices = []
+        for i, device in enumerate(metadata):
+            rt_data, is_online, pos_data = results[i * 3:i * 3 + 3]
+            devices.append({
+                "sn": device['sn'],
+                "name": device['name'],
+                "ppm": _float(rt_data.get('ppm')),
+                "temp": _float(rt_data.get('temp')),
+                "status": "online" if is_online else "offline",
+                "position_x": _float(pos_data.get('x')),
+                "position_y": _float(pos_data.get('y')),
+                "battery": _int(rt_data.get('bat')),
+                "rssi": _int(rt_data.get('rssi')),
+                "network": rt_data.get('net') or None,
+                "instrument_name": device['instrument_name'],
+                "instrument_color": device['instrument_color'],
+                "instrument_id": device['instrument_id'],
+                "unit": device['unit'] or "ppm",
+                "sensor_type": device['sensor_type'],
+            })
+
+        body = json.dumps(devices, ensure_ascii=False, separators=(",", ":"))
+        etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        if etag == self._etag:
+            # 内容未变化，只刷新时间戳供后端判断快照是否仍在维护
+            await self.redis.hset(SNAPSHOT_KEY, "updated_at", time.time())
+            return False
+
+        await self.redis.hset(SNAPSHOT_KEY, mapping={"etag": etag, "body": body, "updated_at": time.time()})
+        self._etag = etag
+        return True
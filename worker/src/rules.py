@@ -0,0 +1,345 @@
+"""
+MCS-IOT 窗口报警规则引擎 (Windowed Alarm Rule Engine)
+
+该文件在静态阈值之外，为报警中心提供基于时间窗口的规则判定能力，全部在 Worker 内存中完成，不产生额外的数据库查询。
+主要功能包括：
+1. 环形缓冲区：每条规则持有一个定长、基于 array 的环形缓冲区，内存占用与窗口长度无关地被上限约束。
+2. 规则类型：
+   - rate_of_rise: 窗口内浓度上升速率 (每分钟) 超过阈值。
+   - moving_avg: 最近 N 秒滑动平均值超过阈值。
+   - k_of_n: 最近 n 个样本中至少 k 个超过阈值。
+3. O(1) 摊还判定：滑动平均维护运行和，k_of_n 维护超限计数，过期样本在写入时顺带淘汰。
+4. 规则编译与热更新：设备规则 (Redis rules:{sn}，JSON 数组) 被编译为求值器并缓存，后台修改后通过 rules:version 通知 Worker 重新加载；Redis 中缺失时回退读取 devices.alarm_rules 并写回。
+
+结构：
+- RingBuffer: (时间, 数值) 定长环形缓冲区。
+- RateOfRiseRule / MovingAverageRule / KOfNRule: 各规则求值器，push 写入样本并返回判定结果。
+- compile_rules: 将规则定义编译为求值器列表。
+- RuleEngine: 按设备缓存已编译规则，提供 evaluate 入口及已删除规则的报警类型 (pop_retired)。
+"""
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 单条规则缓冲区的最大样本数 (10 秒上报间隔下约 2 小时)
+MAX_BUFFER_SIZE = 720
+
+# 每种规则默认写入 alarm_logs.type 的报警类型
+DEFAULT_ALARM_TYPES = {
+    "rate_of_rise": "RATE_RISE",
+    "moving_avg": "AVG_HIGH",
+    "k_of_n": "K_OF_N",
+}
+
+METRICS = ("ppm", "temp", "humi")
+
+
+class RingBuffer:
+    """定长 (时间, 数值) 环形缓冲区，底层为两个 array('d')"""
+    __slots__ = ("capacity", "_ts", "_values", "_head", "_size")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._ts = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        self._head = 0  # 最旧元素位置
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def is_full(self) -> bool:
+        return self._size == self.capacity
+
+    def append(self, ts: float, value: float):
+        """写入新样本 (调用方需保证未满)"""
+        idx = (self._head + self._size) % self.capacity
+        self._ts[idx] = ts
+        self._values[idx] = value
+        self._size += 1
+
+    def popleft(self) -> Tuple[float, float]:
+        idx = self._head
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        return self._ts[idx], self._values[idx]
+
+    def oldest(self) -> Tuple[float, float]:
+        return self._ts[self._head], self._values[self._head]
+
+    def newest(self) -> Tuple[float, float]:
+        idx = (self._head + self._size - 1) % self.capacity
+        return self._ts[idx], self._values[idx]
+
+    def values(self):
+        for i in range(self._size):
+            yield self._values[(self._head + i) % self.capacity]
+
+
+class _Rule(ABC):
+    """规则求值器基类"""
+    __slots__ = ("alarm_type", "metric", "threshold", "hysteresis")
+
+    def __init__(self, alarm_type: str, metric: str, threshold: float, hysteresis: float):
+        self.alarm_type = alarm_type
+        self.metric = metric
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+
+    @abstractmethod
+    def push(self, ts: float, value: float) -> Optional[Tuple[float, bool, bool]]:
+        """写入样本，返回 (统计值, 是否触发, 是否恢复)；样本不足时返回 None"""
+
+    @abstractmethod
+    def describe(self, value: float) -> str:
+        """报警消息中的规则描述"""
+
+
+class RateOfRiseRule(_Rule):
+    """窗口内上升速率 (单位/分钟) 超过阈值"""
+    __slots__ = ("window", "buf")
+
+    def __init__(self, alarm_type, metric, threshold, hysteresis, window_seconds: int):
+        super().__init__(alarm_type, metric, threshold, hysteresis)
+        self.window = window_seconds
+        self.buf = RingBuffer(MAX_BUFFER_SIZE)
+
+    def push(self, ts, value):
+        buf = self.buf
+        while len(buf) and (buf.is_full() or buf.oldest()[0] < ts - self.window):
+            buf.popleft()
+        buf.append(ts, value)
+        if len(buf) < 2:
+            return None
+        t0, v0 = buf.oldest()
+        dt = ts - t0
+        if dt <= 0:
+            return None
+        rate = (value - v0) * 60.0 / dt
+        return rate, rate > self.threshold, rate <= self.threshold - self.hysteresis
+
+    def describe(self, value):
+        return f"{self.metric} 上升速率 {value:.2f}/min (阈值: {self.threshold:.2f}/min, 窗口 {self.window}s)"
+
+
+class MovingAverageRule(_Rule):
+    """最近 window_seconds 秒滑动平均值超过阈值"""
+    __slots__ = ("window", "buf", "_sum", "_pushes")
+
+    def __init__(self, alarm_type, metric, threshold, hysteresis, window_seconds: int):
+        super().__init__(alarm_type, metric, threshold, hysteresis)
+        self.window = window_seconds
+        self.buf = RingBuffer(MAX_BUFFER_SIZE)
+        self._sum = 0.0
+        self._pushes = 0
+
+    def push(self, ts, value):
+        buf = self.buf
+        while len(buf) and (buf.is_full() or buf.oldest()[0] < ts - self.window):
+            self._sum -= buf.popleft()[1]
+        buf.append(ts, value)
+        self._sum += value
+
+        # 每写满一轮重新求和一次，消除浮点累积误差 (摊还 O(1))
+        self._pushes += 1
+        if self._pushes >= buf.capacity:
+            self._pushes = 0
+            self._sum = sum(buf.values())
+
+        avg = self._sum / len(buf)
+        return avg, avg > self.threshold, avg <= self.threshold - self.hysteresis
+
+    def describe(self, value):
+        return f"{self.metric} {self.window}s 平均值 {value:.2f} (阈值: {self.threshold:.2f})"
+
+
+class KOfNRule(_Rule):
+    """最近 n 个样本中至少 k 个超过阈值"""
+    __slots__ = ("k", "n", "_flags", "_pos", "_filled", "_count")
+
+    def __init__(self, alarm_type, metric, threshold, hysteresis, k: int, n: int):
+        super().__init__(alarm_type, metric, threshold, hysteresis)
+        self.k = k
+        self.n = n
+        self._flags = array("b", bytes(n))
+        self._pos = 0
+        self._filled = 0
+        self._count = 0
+
+    def push(self, ts, value):
+        flag = 1 if value > self.threshold else 0
+        if self._filled == self.n:
+            self._count -= self._flags[self._pos]
+        else:
+            self._filled += 1
+        self._flags[self._pos] = flag
+        self._count += flag
+        self._pos = (self._pos + 1) % self.n
+        return float(self._count), self._count >= self.k, self._count < self.k
+
+    def describe(self, value):
+        return f"最近 {self.n} 个样本中 {int(value)} 个 {self.metric} 超过 {self.threshold:.2f} (要求 {self.k} 个)"
+
+
+def compile_rule(rule: dict) -> Optional[_Rule]:
+    """将单条规则定义编译为求值器，定义无效时返回 None"""
+    if not rule.get("enabled", True):
+        return None
+    rule_type = rule.get("type")
+    if rule_type not in DEFAULT_ALARM_TYPES:
+        logger.warning(f"Unknown alarm rule type: {rule_type}")
+        return None
+
+    metric = rule.get("metric", "ppm")
+    if metric not in METRICS:
+        logger.warning(f"Unknown alarm rule metric: {metric}")
+        return None
+
+    alarm_type = (rule.get("alarm_type") or DEFAULT_ALARM_TYPES[rule_type])[:32]
+    threshold = float(rule["threshold"])
+    hysteresis = float(rule.get("hysteresis", 0))
+
+    if rule_type == "rate_of_rise":
+        return RateOfRiseRule(alarm_type, metric, threshold, hysteresis,
+                              max(int(rule.get("window_seconds", 60)), 1))
+    if rule_type == "moving_avg":
+        return MovingAverageRule(alarm_type, metric, threshold, hysteresis,
+                                 max(int(rule.get("window_seconds", 600)), 1))
+    n = min(max(int(rule.get("n", 5)), 1), MAX_BUFFER_SIZE)
+    k = min(max(int(rule.get("k", 3)), 1), n)
+    return KOfNRule(alarm_type, metric, threshold, hysteresis, k, n)
+
+
+def compile_rules(raw: Optional[str]) -> List[_Rule]:
+    """编译设备规则 JSON 数组"""
+    if not raw:
+        return []
+    try:
+        definitions = json.loads(raw)
+    except json.JSONDecodeError:
+        logger.error(f"Invalid alarm rules JSON: {raw[:100]}")
+        return []
+
+    compiled = []
+    for rule in definitions if isinstance(definitions, list) else []:
+        try:
+            evaluator = compile_rule(rule)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Invalid alarm rule {rule}: {e}")
+            continue
+        if evaluator:
+            compiled.append(evaluator)
+    return compiled
+
+
+class _DeviceRules:
+    __slots__ = ("raw", "rules", "version")
+
+    def __init__(self, raw, rules, version):
+        self.raw = raw
+        self.rules = rules
+        self.version = version
+
+
+class RuleEngine:
+    """
+    按设备缓存已编译规则
+    - 每 VERSION_CHECK_INTERVAL 秒读取一次全局 rules:version
+    - 版本变化后，设备在下一个样本到达时重新读取 rules:{sn}；规则未变化时保留缓冲区状态
+    - rules:{sn} 不存在 (Redis 按 allkeys-lru 淘汰或重启) 时回退读取 devices.alarm_rules 并写回 Redis
+    """
+    VERSION_CHECK_INTERVAL = 5
+
+    def __init__(self, redis, storage=None):
+        self.redis = redis
+        self.storage = storage
+        self._devices: Dict[str, _DeviceRules] = {}
+        self._version = None
+        self._version_checked_at = 0.0
+        self._retired: Dict[str, set] = {}  # 规则被删除后需要恢复的报警类型
+
+    async def _current_version(self) -> Optional[str]:
+        now = time.time()
+        if now - self._version_checked_at >= self.VERSION_CHECK_INTERVAL:
+            self._version_checked_at = now
+            try:
+                self._version = await self.redis.get("rules:version")
+            except Exception as e:
+                logger.error(f"Redis error getting rules version: {e}")
+        return self._version
+
+    async def get_rules(self, sn: str) -> List[_Rule]:
+        version = await self._current_version()
+        entry = self._devices.get(sn)
+        if entry is not None and entry.version == version:
+            return entry.rules
+
+        try:
+            raw = await self.redis.get(f"rules:{sn}")
+        except Exception as e:
+            logger.error(f"Redis error getting rules for {sn}: {e}")
+            return entry.rules if entry else []
+        if raw is None:
+            raw = await self._load_from_db(sn)
+            if raw is None:
+                return entry.rules if entry else []
+
+        if entry is not None and entry.raw == raw:
+            entry.version = version
+            return entry.rules
+
+        rules = compile_rules(raw)
+        if entry is not None:
+            retired = {r.alarm_type for r in entry.rules} - {r.alarm_type for r in rules}
+            if retired:
+                self._retired.setdefault(sn, set()).update(retired)
+        self._devices[sn] = _DeviceRules(raw, rules, version)
+        if rules:
+            logger.info(f"[{sn}] Compiled {len(rules)} alarm rules")
+        return rules
+
+    async def _load_from_db(self, sn: str) -> Optional[str]:
+        """从数据库读取设备规则并写回 Redis，数据库不可用时返回 None"""
+        if not self.storage or not self.storage.pool:
+            return None
+        try:
+            async with self.storage.pool.acquire() as conn:
+                raw = await conn.fetchval("SELECT alarm_rules FROM devices WHERE sn = $1", sn)
+        except Exception as e:
+            logger.error(f"DB error loading rules for {sn}: {e}")
+            return None
+        # 无规则的设备同样写入 "[]"，避免每次版本变化都回退查询数据库
+        raw = raw or "[]"
+        try:
+            await self.redis.set(f"rules:{sn}", raw)
+        except Exception as e:
+            logger.error(f"Redis error priming rules for {sn}: {e}")
+        return raw
+
+    def pop_retired(self, sn: str) -> set:
+        """取出因规则删除而需要恢复的报警类型"""
+        return self._retired.pop(sn, set())
+
+    async def evaluate(self, sn: str, sample: Dict[str, Optional[float]],
+                       ts: float = None) -> List[Tuple[_Rule, float, bool, bool]]:
+        """
+        写入一个样本并返回每条规则的判定结果: [(rule, 统计值, 是否触发, 是否恢复), ...]
+        """
+        rules = await self.get_rules(sn)
+        if not rules:
+            return []
+        ts = ts if ts is not None else time.time()
+        results = []
+        for rule in rules:
+            value = sample.get(rule.metric)
+            if value is None:
+                continue
+            outcome = rule.push(ts, float(value))
+            if outcome is not None:
+                results.append((rule, outcome[0], outcome[1], outcome[2]))
+        return results
@@ -1,27 +1,109 @@
 """
 MCS-IOT 定时任务调度器 (Task Scheduler)
 
-该文件负责驱动系统中所有非触发式的后台任务，确保系统的自我维护与状态同步。
+该文件负责驱动系统中所有非触发式的后台任务，确保系统的自我维护与状态同步。支持多个 Worker 副本同时运行 (高可用)。
 主要调度任务包括：
-1. 设备离线检测 (每分钟)：扫描超时的设备并自动切换状态、发出报警。
-2. 系统健康报表 (每5分钟)：汇总各组件状态并更新至 Redis 供前端实时查询。
-3. 历史数据归档 (每日凌晨2点)：触发数据的云端备份与本地清理，释放存储空间。
-4. 商业授权巡检 (每日凌晨3点)：定期在线核验授权合法性。
-5. 数据库自动优化 (每日凌晨4点)：执行 VACUUM ANALYZE，保持数据库在高吞吐下的查询性能。
+1. 设备离线检测 (每5秒，分片)：基于最近上报时间索引增量找出超时设备，批量切换状态、发出报警并发布到实时频道。
+2. 设备统计 (每10秒)：汇总在线/离线设备数量供前端查询。
+3. 系统健康报表 (每5分钟)：汇总各组件状态并更新至 Redis 供前端实时查询。
+4. 历史数据归档 (每日凌晨2点)：触发数据的云端备份与本地清理，释放存储空间。
+5. 商业授权巡检 (每日凌晨3点)：定期在线核验授权合法性。
+6. 数据库维护 (每6小时)：只 ANALYZE 最近写入的分块并补压缩落后的分块 (见 maintenance.py)，不再整表 VACUUM。
+7. 归档目录对账 (每周日凌晨4点半)：列举云存储桶并与 archive_logs 核对，日常的文件列表与统计只读取该表。
+8. 连续聚合物化 (每10分钟)：新建的历史曲线连续聚合完成首次完整刷新后登记为可用，已就绪时为空操作。
+9. 实时快照物化 (每2秒)：将所有设备的实时数据序列化为一份快照 (realtime:snapshot)，供大屏接口一次读取并支持 ETag (见 realtime_snapshot.py)。
+
+调度机制：
+- 领导者选举：各副本通过 Redis 租约 (scheduler:leader，SET NX PX + 续约) 竞选，只有领导者执行单例任务 (MODE_SINGLETON)。
+- 分片任务：MODE_SHARD 任务在每个副本上运行，副本通过 scheduler:members 心跳得到自己的分片编号。
+- 持久化状态：单例任务的上次/下次运行时间保存在 scheduler:jobs，重启或领导者切换后会补跑错过的任务 (合并为一次)。
+- 防重叠：单例任务执行期间持有 scheduler:lock:{name} 锁 (后台续期)，同一任务不会在多个副本或同一副本上重叠执行。
+- 调度定义：支持 cron 表达式 (见 cron.py) 或固定间隔，并可配置随机抖动 (jitter)。
 
 结构：
-- Scheduler: 核心类，封装了基于 asyncio 的循环任务控制。
-- _run_every / _run_at_time: 基础的任务循环原语，支持间隔运行及定时运行。
+- Job: 任务定义及运行时状态。
+- Scheduler: 核心类，负责租约/心跳维护及任务派发。
 - Task Implementations: 各个具体业务任务的实现函数。
 """
 import asyncio
+import json
 import logging
-from datetime import datetime, time
+import os
+import random
+import socket
+import time
+import uuid
+import zlib
+from datetime import datetime
 from typing import Callable, Optional
 import redis.asyncio as aioredis
 
+from cron import CronSchedule
+
 logger = logging.getLogger(__name__)
 
+# 无上报超过该时间判定离线 (与 Processor 中 online:{sn} 的 TTL 一致)
+OFFLINE_TIMEOUT = 90
+# 离线检测间隔 (基于 ZSET 增量查询，开销与设备总数无关)
+OFFLINE_CHECK_INTERVAL = 5
+
+# 实时数据快照物化间隔 (秒)
+REALTIME_SNAPSHOT_INTERVAL = 2
+
+# 领导者租约时长及心跳间隔 (秒)
+LEASE_TTL = 15
+HEARTBEAT_INTERVAL = 5
+# 调度循环精度 (秒)
+TICK_INTERVAL = 1
+
+MODE_SINGLETON = "singleton"  # 仅领导者执行
+MODE_SHARD = "shard"          # 所有副本执行，各自处理一个分片
+
+# 仅当键值仍为自己的标识时续期 / 删除
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Job:
+    """定时任务定义"""
+    
+    def __init__(self, name: str, title: str, func: Callable, cron: str = None,
+                 interval: int = None, mode: str = MODE_SINGLETON, jitter: int = 0,
+                 lock_ttl: int = 300):
+        if (cron is None) == (interval is None):
+            raise ValueError(f"Job {name} needs exactly one of cron / interval")
+        self.name = name
+        self.title = title
+        self.func = func
+        self.cron = CronSchedule(cron) if cron else None
+        self.interval = interval
+        self.mode = mode
+        self.jitter = jitter
+        self.lock_ttl = lock_ttl
+        
+        self.next_run: Optional[float] = None  # None 表示当前副本不负责该任务
+        self.running = False
+    
+    def compute_next(self, after: float) -> float:
+        """计算 after 之后的下一次运行时间 (含抖动)"""
+        if self.cron:
+            next_time = self.cron.next_after(datetime.fromtimestamp(after)).timestamp()
+        else:
+            next_time = after + self.interval
+        if self.jitter:
+            next_time += random.uniform(0, self.jitter)
+        return next_time
+
 
 class Scheduler:
     """异步定时任务调度器"""
@@ -32,125 +114,269 @@ class Scheduler:
         self.tasks = []
         self.running = False
         self.alarm_center = None  # 延迟注入
+        self._offline_cursor = None  # 离线检测已处理到的时间点
+        self._offline_shard = None
+        self._device_total = None
+        self._device_total_at = 0.0
+        self._realtime_snapshot = None
+        
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._lease_expires = 0.0
+        self._shard = (0, 1)  # (分片编号, 分片总数)
+        self._next_heartbeat = 0.0
+        
+        self.jobs = [
+            Job("device_offline", "设备离线检测", self.check_device_offline,
+                interval=OFFLINE_CHECK_INTERVAL, mode=MODE_SHARD),
+            Job("device_stats", "设备统计", self.update_device_stats, interval=10),
+            Job("health_check", "健康检查", self.health_check, interval=300),
+            Job("archive", "数据归档", self.run_archive, cron="0 2 * * *", jitter=60, lock_ttl=600),
+            Job("license_check", "授权校验", self.run_license_check, cron="0 3 * * *", jitter=300),
+            Job("db_optimize", "数据库维护", self.run_db_optimize, cron="15 */6 * * *", jitter=60, lock_ttl=600),
+            Job("archive_reconcile", "归档目录对账", self.run_archive_reconcile, cron="30 4 * * 0", jitter=300),
+            Job("cagg_materialize", "连续聚合物化", self.run_cagg_materialize, interval=600, lock_ttl=600),
+            Job("realtime_snapshot", "实时快照物化", self.run_realtime_snapshot,
+                interval=REALTIME_SNAPSHOT_INTERVAL, lock_ttl=30),
+        ]
     
     def set_alarm_center(self, alarm_center):
         """注入报警中心实例"""
         self.alarm_center = alarm_center
     
+    @property
+    def is_leader(self) -> bool:
+        # 以本地记录的租约到期时间为准，Redis 不可达时租约到期即自动让位
+        return time.time() < self._lease_expires
+    
     async def start(self):
-        """启动所有定时任务"""
+        """启动调度循环"""
         self.running = True
-        logger.info("定时任务调度器已启动")
-        
-        # 创建定时任务
-        self.tasks = [
-            asyncio.create_task(self._run_every(60, self.check_device_offline, "设备离线检测")),
-            asyncio.create_task(self._run_every(300, self.health_check, "健康检查")),
-            asyncio.create_task(self._run_at_time(time(2, 0), self.run_archive, "数据归档")),
-            asyncio.create_task(self._run_at_time(time(3, 0), self.run_license_check, "授权校验")),
-            asyncio.create_task(self._run_at_time(time(4, 0), self.run_db_optimize, "数据库优化")),
-        ]
+        now = time.time()
+        for job in self.jobs:
+            if job.mode == MODE_SHARD:
+                job.next_run = now
+        self.tasks = [asyncio.create_task(self._loop())]
+        logger.info(f"定时任务调度器已启动 (instance={self.instance_id})")
     
     async def stop(self):
-        """停止所有定时任务"""
+        """停止调度并释放租约"""
         self.running = False
         for task in self.tasks:
             task.cancel()
+        try:
+            if self.is_leader:
+                await self.redis.eval(RELEASE_SCRIPT, 1, "scheduler:leader", self.instance_id)
+            await self.redis.zrem("scheduler:members", self.instance_id)
+        except Exception as e:
+            logger.warning(f"释放调度租约失败: {e}")
+        self._lease_expires = 0.0
         logger.info("定时任务调度器已停止")
     
-    async def _run_every(self, interval_seconds: int, func: Callable, name: str):
-        """按固定间隔运行任务"""
-        while self.running:
-            try:
-                await func()
-            except Exception as e:
-                logger.error(f"定时任务 [{name}] 执行失败: {e}")
-            await asyncio.sleep(interval_seconds)
-    
-    async def _run_at_time(self, target_time: time, func: Callable, name: str):
-        """在每天指定时间运行任务"""
+    async def _loop(self):
         while self.running:
-            now = datetime.now()
-            target = datetime.combine(now.date(), target_time)
+            now = time.time()
+            if now >= self._next_heartbeat:
+                self._next_heartbeat = now + HEARTBEAT_INTERVAL
+                try:
+                    await self._heartbeat()
+                except Exception as e:
+                    logger.error(f"调度器心跳失败: {e}")
             
-            # 如果今天的目标时间已过，则等到明天
-            if now.time() >= target_time:
-                target = datetime.combine(now.date(), target_time)
-                target = target.replace(day=target.day + 1)
+            leader = self.is_leader
+            for job in self.jobs:
+                if job.mode == MODE_SINGLETON and not leader:
+                    job.next_run = None
+                    continue
+                if job.next_run is None or job.running or now < job.next_run:
+                    continue
+                job.next_run = job.compute_next(now)
+                job.running = True
+                self.tasks.append(asyncio.create_task(self._run_job(job, now)))
             
-            wait_seconds = (target - now).total_seconds()
-            logger.debug(f"任务 [{name}] 将在 {wait_seconds:.0f} 秒后执行")
+            self.tasks = [t for t in self.tasks if not t.done()]
+            await asyncio.sleep(TICK_INTERVAL)
+    
+    async def _heartbeat(self):
+        """续约/竞选领导者，并刷新副本成员列表以确定分片"""
+        now = time.time()
+        ttl_ms = LEASE_TTL * 1000
+        
+        if self.is_leader:
+            renewed = await self.redis.eval(RENEW_SCRIPT, 1, "scheduler:leader", self.instance_id, ttl_ms)
+            if renewed:
+                self._lease_expires = now + LEASE_TTL
+            else:
+                self._lease_expires = 0.0
+                logger.warning("调度器领导者租约已丢失")
+        else:
+            acquired = await self.redis.set("scheduler:leader", self.instance_id, nx=True, px=ttl_ms)
+            if acquired:
+                self._lease_expires = now + LEASE_TTL
+                logger.info("当前副本成为调度领导者")
+                await self._load_job_state(now)
+        
+        await self.redis.zadd("scheduler:members", {self.instance_id: now})
+        await self.redis.zremrangebyscore("scheduler:members", "-inf", now - LEASE_TTL)
+        members = sorted(await self.redis.zrange("scheduler:members", 0, -1))
+        if self.instance_id in members:
+            shard = (members.index(self.instance_id), len(members))
+            if shard != self._shard:
+                logger.info(f"分片变更: {self._shard} -> {shard}")
+                self._shard = shard
+    
+    async def _load_job_state(self, now: float):
+        """成为领导者时读取单例任务的持久化状态，已错过的运行立即补跑一次"""
+        states = await self.redis.hgetall("scheduler:jobs")
+        for job in self.jobs:
+            if job.mode != MODE_SINGLETON:
+                continue
+            state = json.loads(states[job.name]) if job.name in states else {}
+            next_run = state.get("next_run")
+            if next_run is None:
+                # 从未运行过：间隔任务立即运行，cron 任务等待下一个触发点
+                job.next_run = now if job.interval else job.compute_next(now)
+            else:
+                if next_run < now:
+                    logger.info(f"任务 [{job.title}] 错过计划运行时间 {datetime.fromtimestamp(next_run)}，立即补跑")
+                job.next_run = next_run
+    
+    async def _keep_lock(self, key: str, ttl: int):
+        """任务执行期间定期续期锁"""
+        while True:
+            await asyncio.sleep(ttl / 3)
+            await self.redis.eval(RENEW_SCRIPT, 1, key, self.instance_id, ttl * 1000)
+    
+    async def _run_job(self, job: Job, scheduled_at: float):
+        lock_key = f"scheduler:lock:{job.name}"
+        keeper = None
+        started = time.time()
+        try:
+            if job.mode == MODE_SINGLETON:
+                locked = await self.redis.set(lock_key, self.instance_id, nx=True, px=job.lock_ttl * 1000)
+                if not locked:
+                    logger.warning(f"任务 [{job.title}] 仍在其他副本上运行，本次跳过")
+                    return
+                keeper = asyncio.create_task(self._keep_lock(lock_key, job.lock_ttl))
             
-            await asyncio.sleep(wait_seconds)
+            if job.cron:
+                logger.info(f"开始执行定时任务: {job.title}")
+            status = "ok"
+            try:
+                if job.mode == MODE_SHARD:
+                    await job.func(*self._shard)
+                else:
+                    await job.func()
+            except Exception as e:
+                status = "error"
+                logger.error(f"定时任务 [{job.title}] 执行失败: {e}")
             
-            if self.running:
+            duration = time.time() - started
+            if job.cron:
+                logger.info(f"定时任务 [{job.title}] 执行完成 ({duration:.1f}s)")
+            
+            # 运行结束后才推进持久化的 next_run，进程中途退出时新的领导者会补跑
+            if job.mode == MODE_SINGLETON:
+                await self.redis.hset("scheduler:jobs", job.name, json.dumps({
+                    "last_run": scheduled_at,
+                    "next_run": job.next_run,
+                    "duration": round(duration, 3),
+                    "status": status,
+                    "instance": self.instance_id
+                }))
+        except Exception as e:
+            logger.error(f"任务 [{job.title}] 调度失败: {e}")
+        finally:
+            job.running = False
+            if keeper:
+                keeper.cancel()
                 try:
-                    logger.info(f"开始执行定时任务: {name}")
-                    await func()
-                    logger.info(f"定时任务 [{name}] 执行完成")
+                    await self.redis.eval(RELEASE_SCRIPT, 1, lock_key, self.instance_id)
                 except Exception as e:
-                    logger.error(f"定时任务 [{name}] 执行失败: {e}")
+                    logger.warning(f"释放任务锁 {lock_key} 失败: {e}")
     
     # ==================== 任务实现 ====================
     
-    async def check_device_offline(self):
+    async def check_device_offline(self, shard_index: int = 0, shard_count: int = 1):
         """
-        检测设备离线状态
-        - 扫描所有设备
-        - 检查 Redis 中的 online:{sn} 键
-        - 如果键不存在且设备之前在线，则标记为离线并触发报警
+        检测设备离线状态 (增量，按 SN 分片)
+        - devices:last_seen 为最近上报时间索引 (ZSET, score = 上报时间)
+        - 每次只取出在 (上次检测截止点, now - OFFLINE_TIMEOUT] 之间变为超时的设备
+        - 多副本时每个副本只处理 crc32(sn) % shard_count == shard_index 的设备
+        - 通过一次批量 UPDATE 标记离线，仅对真正发生 online -> offline 转换的设备触发报警
         """
-        async with self.db_pool.acquire() as conn:
-            # 获取所有设备
-            devices = await conn.fetch(
-                "SELECT sn, status FROM devices"
-            )
-            
-            offline_count = 0
-            online_count = 0
-            
-            for device in devices:
-                sn = device['sn']
-                current_status = device['status']
-                
-                # 检查 Redis 中的在线标记
-                is_online = await self.redis.exists(f"online:{sn}")
-                
-                if is_online:
-                    online_count += 1
-                    if current_status != 'online':
-                        # 设备上线，更新状态
-                        await conn.execute(
-                            "UPDATE devices SET status = 'online' WHERE sn = $1",
-                            sn
-                        )
-                else:
-                    offline_count += 1
-                    if current_status == 'online':
-                        # 设备离线，更新状态并触发报警
-                        await conn.execute(
-                            "UPDATE devices SET status = 'offline' WHERE sn = $1",
-                            sn
-                        )
-                        
-                        # 触发离线报警
-                        if self.alarm_center:
-                            await self.alarm_center.process_alarm(
-                                sn=sn,
-                                alarm_type="OFFLINE",
-                                value=0,
-                                threshold=0,
-                                message=f"设备 {sn} 已离线"
-                            )
-                        
-                        logger.warning(f"设备 {sn} 已离线")
+        now = time.time()
+        cutoff = now - OFFLINE_TIMEOUT
+        shard = (shard_index, shard_count)
+        cursor_key = f"devices:offline_cursor:{shard_index}/{shard_count}"
+        
+        if self._offline_shard != shard:
+            # 首次运行或分片变更：读取该分片的持久化截止点
+            # 截止点缺失时从头扫描一次，批量 UPDATE 只作用于 online 设备，重复处理是安全的
+            if self._offline_shard is None:
+                await self._seed_last_seen(now)
+            cursor = await self.redis.get(cursor_key)
+            self._offline_cursor = float(cursor) if cursor else None
+            self._offline_shard = shard
+        
+        low = f"({self._offline_cursor}" if self._offline_cursor is not None else "-inf"
+        stale = await self.redis.zrangebyscore("devices:last_seen", low, cutoff)
+        if shard_count > 1:
+            stale = [sn for sn in stale if zlib.crc32(sn.encode()) % shard_count == shard_index]
+        
+        if stale:
+            async with self.db_pool.acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    UPDATE devices SET status = 'offline'
+                    WHERE sn = ANY($1) AND status = 'online'
+                    RETURNING sn
+                    """,
+                    stale
+                )
             
-            # 更新 Redis 中的统计信息
-            await self.redis.hset("stats:devices", mapping={
-                "online": online_count,
-                "offline": offline_count,
-                "total": len(devices)
-            })
+            for row in rows:
+                sn = row['sn']
+                logger.warning(f"设备 {sn} 已离线")
+                await self.redis.publish("realtime:updates", json.dumps({"sn": sn, "status": "offline"}))
+                if self.alarm_center:
+                    await self.alarm_center.process_alarm(
+                        sn=sn,
+                        alarm_type="OFFLINE",
+                        value=0,
+                        threshold=0,
+                        message=f"设备 {sn} 已离线"
+                    )
+        
+        # 截止点只在本轮处理成功后前移，失败时下一轮重新处理同一区间
+        self._offline_cursor = cutoff
+        await self.redis.set(cursor_key, cutoff, ex=86400)
+    
+    async def _seed_last_seen(self, now: float):
+        """
+        首次运行时为数据库中处于 online 但尚未进入索引的设备补齐条目
+        以当前时间为起点，给予一个完整的超时周期等待其上报
+        """
+        async with self.db_pool.acquire() as conn:
+            rows = await conn.fetch("SELECT sn FROM devices WHERE status = 'online'")
+        if rows:
+            await self.redis.zadd("devices:last_seen", {row['sn']: now for row in rows}, nx=True)
+            logger.info(f"离线检测索引已初始化: {len(rows)} 台在线设备")
+    
+    async def update_device_stats(self):
+        """更新 Redis 中的设备统计 (在线数来自索引，设备总数每分钟查询一次)"""
+        now = time.time()
+        if self._device_total is None or now - self._device_total_at >= 60:
+            async with self.db_pool.acquire() as conn:
+                self._device_total = await conn.fetchval("SELECT COUNT(*) FROM devices")
+            self._device_total_at = now
+        
+        online_count = await self.redis.zcount("devices:last_seen", f"({now - OFFLINE_TIMEOUT}", "+inf")
+        online_count = min(online_count, self._device_total)
+        await self.redis.hset("stats:devices", mapping={
+            "online": online_count,
+            "offline": self._device_total - online_count,
+            "total": self._device_total
+        })
     
     async def health_check(self):
         """
@@ -195,7 +421,6 @@ class Scheduler:
             health["components"]["mqtt"] = {"status": "unknown"}
         
         # 存储健康状态到 Redis
-        import json
         await self.redis.set("system:health", json.dumps(health), ex=600)
         
         if health["status"] != "healthy":
@@ -204,13 +429,38 @@ class Scheduler:
     async def run_archive(self):
         """执行数据归档任务"""
         try:
-            from archiver import run_archive
-            await run_archive()
+            from archiver import Archiver
+            await Archiver(self.db_pool, self.redis).run_daily_archive()
         except ImportError:
             logger.warning("归档模块未加载")
         except Exception as e:
             logger.error(f"数据归档失败: {e}")
     
+    async def run_cagg_materialize(self):
+        """完成新建连续聚合的首次物化"""
+        from maintenance import materialize_continuous_aggregates
+        await materialize_continuous_aggregates(self.db_pool, self.redis)
+    
+    async def run_realtime_snapshot(self):
+        """物化大屏实时数据快照 (内容不变时不重写)"""
+        if self._realtime_snapshot is None:
+            from realtime_snapshot import RealtimeSnapshot
+            self._realtime_snapshot = RealtimeSnapshot(self.db_pool, self.redis)
+        await self._realtime_snapshot.refresh()
+    
+    async def run_archive_reconcile(self):
+        """归档目录与云存储桶对账"""
+        try:
+            from archiver import Archiver
+            archiver = Archiver(self.db_pool, self.redis)
+            await archiver.load_config()
+            if archiver.config.get("enabled"):
+                await archiver.reconcile_catalog()
+        except ImportError:
+            logger.warning("归档模块未加载")
+        except Exception as e:
+            logger.error(f"归档目录对账失败: {e}")
+    
     async def run_license_check(self):
         """执行授权校验"""
         try:
@@ -221,13 +471,6 @@ class Scheduler:
             logger.error(f"授权校验失败: {e}")
     
     async def run_db_optimize(self):
-        """执行数据库优化"""
-        try:
-            async with self.db_pool.acquire() as conn:
-                # VACUUM ANALYZE 主要表
-                await conn.execute("VACUUM ANALYZE sensor_data")
-                await conn.execute("VACUUM ANALYZE alarm_logs")
-                await conn.execute("VACUUM ANALYZE devices")
-                logger.info("数据库优化完成")
-        except Exception as e:
-            logger.error(f"数据库优化失败: {e}")
+        """执行分块级数据库维护 (仅处理最近写入及未按策略压缩的分块)"""
+        from maintenance import run_db_maintenance
+        await run_db_maintenance(self.db_pool, self.redis)